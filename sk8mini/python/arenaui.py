@@ -0,0 +1,321 @@
+'''
+arenaui.py - matplotlib view of the arena, runs in its own process, started by skate
+
+the skate control loop never draws
+	skate publishes route and pose into smem_ui, a shared double array, see smem.py
+	this process polls smem_ui at the frame rate, copies it under the array lock, and draws
+	keyboard commands go back to skate through smem_uikeys, a multiprocessing.Queue
+
+drawing, with blitting:
+	static artists, cones and gate, are drawn once into a background
+	when the cones change, or the window is resized, the background is redrawn
+	animated artists, route lines, legs, sprite, donut, are drawn over a copy of the background each frame
+
+live aerial photo:
+	unless --noaerial, the newest awacs photo is drawn under everything, from the frame ring, see smem.py
+	the slot is mapped, not copied, the crop is not rotated, so imshow gets the extent flipped instead
+	the photo changes every frame, so then cones and gate are drawn as animated artists too
+
+keys handled here:
+	c	save a screen capture
+	all other keys are forwarded to skate, see skate.respondToKeyboard()
+
+video:
+	unless --novideo, the canvas buffer is streamed to 0_arena.mov in mediaout, see recorder.py
+	the figure and axes backgrounds are transparent, as savefig made the old pngs
+	so replay.py can lay the arena over the aerial photos
+	the live aerial photo is in the video too, use --noaerial for the arena alone
+'''
+
+import os
+import time
+import signal
+import numpy as np
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+
+import jlog
+import smem
+import specs
+import nav
+import recorder
+import rt
+
+args = None
+gmem_timestamp = None
+gmem_telemetry = None
+gmem_ui = None
+gmem_uikeys = None
+
+class ArenaView:
+	FPS = 20
+
+	def __init__(self):
+		self.version = -1	# route version drawn
+		self.pose_t = -1.0	# pose drawn
+		self.cones = None
+		self.bg = None		# background, static artists only
+		self.fullDraw = True
+		self.closed = False
+		self.legs = []
+		self.static = []
+		self.aerial = None	# image artist, the live photo
+		self.rgba = None	# the photo, rgba, opaque, matplotlib draws rgba fastest
+		self.frame = 0		# frame ring number drawn
+		self.recorder = None
+		if not args.novideo:
+			self.recorder = recorder.Recorder(f'{args.mediaout}/0_arena', specs.wArenaPx, specs.hArenaPx, self.FPS)
+
+		self.fig = plt.figure()
+		self.fig.set_size_inches(6,6)  # at dpi 100, a 600x600 image to match aerial
+		self.fig.set_dpi(100)
+		self.ax = self.fig.add_axes((0,0,1,1))
+		self.ax.set_xlim(-132,+132)
+		self.ax.set_ylim(-132,+132)
+		self.ax.set_autoscale_on(False)
+		self.ax.set_aspect('equal', anchor='C')  # keep fixed aspect ratio on window resize
+		self.fig.patch.set_alpha(0)
+		self.ax.patch.set_alpha(0)
+		self.ax.tick_params(axis='both', which='both', left=False, right=False, top=False, bottom=False, labelleft=False, labelbottom=False)
+		if not args.noaerial and gmem_telemetry.frames:
+			# pixel 0,0 of the unrotated crop is the far corner of the arena, x +132, y -132
+			self.rgba = np.full(smem.FRAME_SHAPE[:2] + (4,), 255, np.uint8)
+			self.aerial = self.ax.imshow(self.rgba, extent=(132,-132,132,-132), interpolation='nearest', animated=True, visible=False)
+
+		mpl.rcParams['savefig.dpi'] = 100
+		mpl.rcParams['savefig.pad_inches'] = 0.0
+		mpl.rcParams['savefig.transparent'] = True
+		mpl.rcParams['savefig.bbox'] = 'tight'
+
+		self.fig.canvas.mpl_connect('key_press_event', self.onpress)
+		self.fig.canvas.mpl_connect('resize_event', self.onresize)
+		self.fig.canvas.mpl_connect('close_event', self.onclose)
+
+		# line connecting waypoints
+		linestyle, marker = ('-', '.') if args.drawnav else ('', '')
+		self.nextline, = self.ax.plot([], [], linestyle=linestyle, marker=marker, color='g', linewidth=.5, animated=True)
+		self.wayline,  = self.ax.plot([], [], linestyle=linestyle, marker=marker, color='g', animated=True)
+		self.hiway,    = self.ax.plot([], [], linestyle=linestyle, marker=marker, color='r', animated=True)
+
+		# sprite and donut
+		self.sprite = mpl.patches.Polygon(specs.skateSprite, facecolor='none', edgecolor='black', animated=True)
+		self.ax.add_patch(self.sprite)
+		self.donutouter = plt.Circle((0,0), specs.donut_outer_dia/2, facecolor='white', edgecolor='black', animated=True)
+		self.donutinner = plt.Circle((0,0), specs.donut_inner_dia/2, color='magenta', animated=True)
+		self.ax.add_artist(self.donutouter)
+		self.ax.add_artist(self.donutinner)
+		self.togo = self.ax.text(-128, 126, '', fontsize='10', ha='left', va='top', color='black', animated=True)
+
+		plt.show(block=False)
+
+	def onpress(self, event):
+		if event.key == 'c':
+			self.capture()
+		else:
+			gmem_uikeys.put(event.key)
+
+	def onresize(self, event):
+		self.fullDraw = True
+
+	def onclose(self, event):
+		self.closed = True
+
+	def capture(self):
+		fname = f'{args.mediaout}/arena_{time.strftime("%Y%m%d-%H%M%S")}.png'
+		self.fig.savefig(fname)
+		self.fullDraw = True  # savefig renders the whole canvas again
+		jlog.info(f'UI: screen capture {fname}')
+
+	def animated(self):
+		aerial = [self.aerial] + self.static if self.aerial else []  # in drawing order
+		return aerial + [self.nextline, self.wayline, self.hiway] + [a for leg in self.legs for a in leg] + [self.donutouter, self.donutinner, self.sprite, self.togo]
+
+	# ---- route ----
+
+	def setCones(self, cones, gate, gatesize):
+		for a in self.static:
+			a.remove()
+		self.static = []
+		for i in range(len(cones)):  # cone order left to right
+			pt = cones[i]
+			self.static.append(self.ax.add_artist(plt.Circle(pt, specs.cone_diameter/2, color='y')))
+			if args.drawnav:
+				self.static.append(self.ax.add_artist(plt.Circle(pt, specs.turning_radius, fill=False, color='y')))
+			self.static.append(self.ax.text(pt[0], pt[1], str(i+1), fontsize='12', ha='center', va='center', color='black'))
+
+		w = h = gatesize
+		self.static.append(self.ax.add_artist(plt.Rectangle((gate[0]-(w/2), gate[1]-(h/2)), w, h, color='black', fill=False)))
+		if self.aerial:
+			for a in self.static:
+				a.set_animated(True)  # drawn over the photo
+		self.fullDraw = True
+
+	def setLegs(self, numlegs):
+		dia = specs.turning_radius * 2
+		while len(self.legs) < numlegs:
+			line, = self.ax.plot([], [], color='blue', lw=1, animated=True)
+			arc = mpl.patches.Arc((0,0), dia, dia, theta1=0, theta2=0, color='blue', animated=True)
+			self.ax.add_patch(arc)
+			self.legs.append([line, arc])
+		for i in range(len(self.legs)):
+			self.legs[i][0].set_visible(i < numlegs)
+			self.legs[i][1].set_visible(i < numlegs)
+
+	def setRoute(self, mem):
+		gate = [mem[smem.UI_GATE_X], mem[smem.UI_GATE_Y]]
+		numcones = int(mem[smem.UI_NUM_CONES])
+		cones = mem[smem.UI_CONES : smem.UI_CONES + numcones*2].reshape(-1,2)
+		static = mem[smem.UI_GATE_X : smem.UI_CONES + numcones*2]  # gate, cones
+		if self.cones is None or not np.array_equal(static, self.cones):
+			self.setCones(cones, gate, mem[smem.UI_GATE_SIZE])
+			self.cones = static.copy()
+
+		numwaypts = int(mem[smem.UI_NUM_WAYPTS])
+		waypts = mem[smem.UI_WAYPTS : smem.UI_WAYPTS + numwaypts*2].reshape(-1,2)
+		if numwaypts <= 0:
+			return
+
+		if args.drawnav:
+			first, last = int(mem[smem.UI_PAT_FIRST]), int(mem[smem.UI_PAT_LAST])
+			self.wayline.set_data(*waypts[first:last+2].T)
+			first, last = int(mem[smem.UI_NEXT_FIRST]), int(mem[smem.UI_NEXT_LAST])
+			points = waypts[first:last+2] if first >= 0 else np.zeros((2,2))
+			self.nextline.set_data(*points.T)
+
+		end = max(0, min(int(mem[smem.UI_NDXWAYPT]), numwaypts-1))
+		start = max(0, end-1) if args.drawnav else end
+		self.hiway.set_data(*waypts[[start, end]].T)
+
+		if args.drawpretty:
+			self.setPrettyLegs(mem, gate)
+
+	def setPrettyLegs(self, mem, gate):
+		# one leg for each mark drawn, each leg has one line and one arc
+		nummarks = int(mem[smem.UI_NUM_MARKS])
+		base = int(mem[smem.UI_MARK_BASE])
+		first = int(mem[smem.UI_MARK_FIRST])
+		marks = mem[smem.UI_MARKS : smem.UI_MARKS + nummarks*smem.MARK_SIZE].reshape(-1, smem.MARK_SIZE)
+		continuous = mem[smem.UI_CONTINUOUS] > 0
+		numlegs = (base + nummarks - first) + (0 if continuous else 1)
+		self.setLegs(max(0, numlegs))
+		i = 0
+		for n in range(first - base, nummarks):
+			center, entry, exit, rdir = marks[n][0:2], marks[n][2:4], marks[n][4:6], marks[n][6]
+			A = gate if (base + n) == 0 else marks[n-1][4:6]
+			self.legs[i][0].set_data([A[0], entry[0]], [A[1], entry[1]])
+			t1,_ = nav.thetaFromPoint(entry, center)
+			t2,_ = nav.thetaFromPoint(exit, center)
+			if rdir > 0:  # cw
+				t2,t1 = (t1, t2)  # reverse (mpl.Arc draws ccw)
+				if t1 == t2:
+					t2 -= .001  # avoid full circle
+			arc = self.legs[i][1]
+			arc.set_center(center)
+			arc.theta1 = np.degrees(t1)
+			arc.theta2 = np.degrees(t2)
+			i += 1
+
+		# one more line from last exit to gate, if not continuous
+		if not continuous and nummarks > 0:
+			A = marks[nummarks-1][4:6]
+			self.legs[i][0].set_data([A[0], gate[0]], [A[1], gate[1]])
+
+	# ---- pose ----
+
+	def setPose(self, mem):
+		cbase = (mem[smem.UI_CBASE_X], mem[smem.UI_CBASE_Y])
+		donut = (mem[smem.UI_DONUT_X], mem[smem.UI_DONUT_Y])
+		r = mpl.transforms.Affine2D().rotate_deg(360-mem[smem.UI_HEADING])
+		t = mpl.transforms.Affine2D().translate(*cbase)
+		self.sprite.set_transform(r + t + self.ax.transData)
+		self.donutinner.set_center(donut)
+		self.donutouter.set_center(donut)
+		togo = mem[smem.UI_TOGO]
+		self.togo.set_text(f'{togo:.0f} cm to go' if togo > 0 else '')
+
+	# ---- aerial ----
+
+	def setAerial(self):
+		# the newest photo from the frame ring, True if there is a new one
+		ring = gmem_telemetry.frames
+		for attempt in range(2):
+			newest = ring.newest()
+			if newest is None or newest[0] == self.frame:
+				return False
+			n, t, pixels, seq = newest
+			np.copyto(self.rgba[:,:,:3], pixels[:,:,::-1])  # bgr to rgb
+			self.aerial.set_data(self.rgba)  # matplotlib keeps a copy
+			if ring.isIntact(n, seq):
+				self.frame = n
+				self.aerial.set_visible(True)
+				return True
+		return False  # lapped twice, try again next frame
+
+	# ---- draw ----
+
+	def draw(self):
+		canvas = self.fig.canvas
+		if self.fullDraw or self.bg is None:
+			canvas.draw()
+			self.bg = canvas.copy_from_bbox(self.fig.bbox)
+			self.fullDraw = False
+		else:
+			canvas.restore_region(self.bg)
+		for a in self.animated():
+			self.ax.draw_artist(a)
+		canvas.blit(self.fig.bbox)
+
+	def record(self):
+		self.recorder.tick(np.asarray(self.fig.canvas.buffer_rgba()), self.pose_t)
+
+	def update(self):
+		# copy smem_ui under the lock, then draw what changed
+		with gmem_ui.get_lock():
+			mem = np.array(np.frombuffer(gmem_ui.get_obj()))
+		changed = False
+		if mem[smem.UI_VERSION] != self.version:
+			self.version = mem[smem.UI_VERSION]
+			self.setRoute(mem)
+			changed = True
+		newpose = mem[smem.UI_POSE_T] != self.pose_t
+		if newpose:
+			self.pose_t = mem[smem.UI_POSE_T]
+			self.setPose(mem)
+			changed = True
+		if self.aerial and self.setAerial():
+			changed = True
+		if changed or self.fullDraw:
+			self.draw()
+		if self.recorder and self.pose_t > 0:
+			self.record()
+
+def isKilled():
+	return (gmem_timestamp[smem.TIME_KILLED] > 0)
+
+def ui_main(arguments, timestamp, telemetry, uimem, uikeys, timestart):
+	global args, gmem_timestamp, gmem_telemetry, gmem_ui, gmem_uikeys
+	args = arguments
+	gmem_timestamp = timestamp
+	gmem_telemetry = telemetry
+	gmem_ui = uimem
+	gmem_uikeys = uikeys
+	signal.signal(signal.SIGINT, signal.SIG_IGN)  # leave for gcs
+	jlog.setup('ui   ', args.verbose, args.quiet, args.mediaout)
+	rt.apply('ui', args, 'skate')  # forked from skate, undo its profile if it has one
+	jlog.timestart = timestart  # elapsed times match skate's, as the png filenames did
+	jlog.info(f'starting process id: {os.getpid()}')
+
+	view = ArenaView()
+	delay = 1 / view.FPS
+	while not isKilled() and not view.closed:
+		t = time.time()
+		view.update()
+		view.fig.canvas.flush_events()  # keyboard, resize
+		gmem_telemetry.beat(smem.HB_UI)
+		sleeptime = delay - (time.time() - t)
+		if sleeptime > 0:
+			time.sleep(sleeptime)
+	if view.recorder:
+		view.recorder.stop()
+	plt.close('all')
+	jlog.info(f'ui exit')
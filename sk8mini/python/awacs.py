@@ -10,6 +10,74 @@ functions:
 	detect objects in the photo
 	share object positions with other processes
 
+capture modes:
+	capture - one http request to /capture for each photo
+	stream  - one long-lived request to /stream on port 81, read multipart jpeg parts as they arrive
+	both use a pooled requests.Session, so the tcp connection is kept alive between requests
+
+pipeline:
+	three stages run concurrently, so the next http request overlaps detection of the current photo
+		capture thread - settle, http request, jpeg bytes
+		detect thread  - decode, crop, georeference, find donut and cones
+		publish (main) - write positions and the crop to shared memory, save to disk
+	stages are joined by LatestQueue, a one-slot queue where a new item replaces a stale one
+	so a slow stage skips old photos instead of falling behind the camera
+	a photo that fails detection, a bad jpeg say, is dropped and counted, --maxdetecterrors in a row stop awacs
+
+decode and georeference:
+	only the arena crop is decoded, if PyTurboJPEG is installed
+		lossless jpeg crop to the MCU-aligned box around the arena, then decode that
+		otherwise decode the full frame and slice the crop, a view, not a copy
+	the camera is mounted upside down, but the crop is not rotated
+		the donut kernel is rotated 180 once at startup
+		detected points are rotated 180 in coordinate space, see geoReferencePoint()
+		so the positions in shared memory are the same as rotating the pixels
+
+preprocess:
+	Preprocess holds the views of one photo that the detectors share: gray, normalized gray, hsv
+	each view is computed at most once per photo, only if a detector asks for it
+	output buffers are allocated once and reused for every photo
+	the cone saturation threshold follows a slow moving average of photo saturation,
+		sampled from a subsampled photo every few photos, instead of a full-frame mean every photo
+
+detect donut:
+	DonutLocator, correlation with the donut kernel, float32, via matchTemplate over a window only
+		tracking: search a small window around the last fix
+		full search: coarse search of a pyramid level, then refine in a small window at each finer level
+		fall back to full search when the peak-to-sidelobe ratio (psr) drops below --donutpsr
+	returns a subpixel peak, by parabolic fit, and the psr as confidence
+
+detect cones:
+	full scan, hsv mask of the whole photo, contours qualified by size, see scanCones()
+	with --conemap, ConeMap locks the cone set after --conelock consistent full scans
+		then checks each cone in a small window only, the cones don't move during a run
+		full rescan every --conerescan photos, or as soon as a cone check fails
+
+save photos:
+	Archiver, a background thread writes the jpeg bytes exactly as received from the camera
+	no decode, no re-encode, full frame, not cropped or rotated, see replay.py
+	the queue is bounded, if the disk falls behind, photos are dropped and counted, capture never waits
+
+replay:
+	--replay <session folder> replaces the camera with the jpgs saved in an earlier session
+	no wifi, no camera, same decode, detect and publish path
+	paced by the timestamps in the filenames, or as fast as possible with --replayfast
+		with --replayfast the pipeline queues wait instead of skipping, so every photo is detected
+	kill when the last photo is published, see the throughput summary in the log
+	run standalone for a detection benchmark:  python awacs.py --replay <folder> --replayfast
+
+supervision:
+	the awacs heartbeat beats once per published photo, so a capture hung in requests, or a stalled detect, stops it
+	an error in a thread, or a failed setup, ends this process only, see stop()
+	gcs restarts it, without touching skate, a replay that completes still kills the whole run
+
+timing:
+	every stage is timed into a histogram, see timing.py
+		settle, http, transfer, crop, decode, donut, cones, publish, save
+	http is the wait for the response headers, or for the next part of the stream
+	transfer is reading the jpeg bytes
+	histograms are written to the session folder every 10 seconds, p50/p95/p99 are logged at exit
+
 ---------------
 sources:
 
@@ -64,6 +132,10 @@ feasibiliry of writing images to micro sd card on drone
 
 import signal
 import time
+import threading
+import multiprocessing
+import queue
+import io
 import random
 import cv2
 import requests
@@ -72,19 +144,42 @@ import os
 import sys
 import argparse
 import math
+import glob
 import nmcli
 
 import jlog
+import specs
+import timing
+import rt
 from smem import *
 
+try:
+	from turbojpeg import TurboJPEG, TJPF_BGR  # optional, for decoding only the arena crop
+	turbo = TurboJPEG()
+except Exception:
+	turbo = None
+
+# MCU block size in pixels, by jpeg subsampling: 444, 422, 420, gray, 440, 411
+mcuWidth  = [8, 16, 16, 8,  8, 32]
+mcuHeight = [8,  8, 16, 8, 16,  8]
+
 def setupArgParser(parser):
 	# runtime directives
 	parser.add_argument('--nosave'  ,action='store_true'           ,help='suppress save image to disk')
+	parser.add_argument('--nopipeline',action='store_true'         ,help='capture, detect, publish serially in one thread')
+	parser.add_argument('--archivequeue',default=30 ,type=int        ,help='photos waiting to be saved, before dropping')
+	parser.add_argument('--replay'  ,default=''                    ,help='session folder of saved jpgs, replaces the camera')
+	parser.add_argument('--replayfast',action='store_true'         ,help='replay as fast as possible, ignore the timestamps')
 
 	# webserver settings
 	parser.add_argument('--ssid'    ,default='AWACS'               ,help='network ssid, alternate JASMINE_2')
 	parser.add_argument('--sspw'    ,default='indecent'            ,help='network password, alternate 8496HAG#1')
 	parser.add_argument('--camurl'  ,default='http://192.168.4.1'  ,help='URL of camera webserver, alt http://192.168.1.102')
+	parser.add_argument('--nonet'   ,action='store_true'           ,help='stay on the current network, eg camsim.py on localhost')
+	parser.add_argument('--maxcaptureerrors',default=10,type=int     ,help='consecutive capture errors before kill')
+	parser.add_argument('--maxdetecterrors',default=10,type=int      ,help='consecutive detect errors before stop')
+	parser.add_argument('--streamurl',default='http://192.168.4.1:81',help='URL of camera stream server, port 81')
+	parser.add_argument('--capturemode',default='capture',choices=['capture','stream'],help='one-shot /capture per photo, or multipart /stream')
 
 	# disk filenames
 	#parser.add_argument('--imgdir'  ,default='/home/john/media/webapps/sk8mini/awacs/photos' ,help='folder for saving images')
@@ -96,11 +191,16 @@ def setupArgParser(parser):
 
 	# object detection
 	parser.add_argument('--numcones'  ,default=9    ,type=int        ,help='number of cones in the arena')
+	parser.add_argument('--donutpsr'  ,default=6.0  ,type=float      ,help='donut peak-to-sidelobe ratio, below this do a full search')
+	parser.add_argument('--conemap'   ,action='store_true'           ,help='lock the cone positions, verify instead of full scan')
+	parser.add_argument('--conelock'  ,default=5    ,type=int        ,help='consistent full scans before the cone map is locked')
+	parser.add_argument('--conerescan',default=100  ,type=int        ,help='photos between full scans once the cone map is locked')
 
 # the following globals are set during startup BEFORE the process starts
 args = None   # command-line arguments
 
 netIsUp = False
+stopped = False	# this process is ending, the others go on
 
 # camera settings
 cameraSettleTime = .3
@@ -108,73 +208,283 @@ cameraSettleTime = .3
 # disk filenames
 imgext = 'jpg'
 
-# image dimensions
-width = 1280 # determined by camera framesize setting
-height = 1024
-w = 600   # arbitrary arena size
-h = 600
+# image dimensions, see specs.py
+width = specs.wCameraPx
+height = specs.hCameraPx
+w = specs.wArenaPx
+h = specs.hArenaPx
 
 # cropping boundaries
-ctrx = 660  # 640
-ctry = 466  # 512
-x = int(ctrx - (w/2))
-y = int(ctry - (h/2))
-r = x+w
-b = y+h
+ctrx = specs.cropCtrX
+ctry = specs.cropCtrY
+x = specs.cropLeft
+y = specs.cropTop
+r = specs.cropRight
+b = specs.cropBottom
 
 # the following globals are used only within awacs_process
 photo_timestamp = 0.0
-donutkernel = None
+donutlocator = None
+preprocess = None
+conemap = None
+archiver = None
+replaysource = None
+npublished = 0
+ncaptureerrors = 0
+ndetecterrors = 0
+nrowdetecterrors = 0  # consecutive
+pcapture = None  # LatestQueue, capture thread to detect thread
+pdetect = None   # LatestQueue, detect thread to publisher
+session = None   # requests.Session, keeps the connection alive
+stream = None    # buffered reader over the /stream response
 
 def kill(msg):
 	jlog.info(f'kill: {msg}')
 	smem_timestamp[TIME_KILLED] = time.time()
 
+def stop(msg):
+	global stopped
+	jlog.info(f'stop: {msg}')
+	stopped = True
+
+def isKilled():
+	return stopped or (smem_timestamp[TIME_KILLED] > 0)
+
+class LatestQueue:
+	''' one-slot queue between pipeline stages, put() replaces an item not yet taken '''
+	def __init__(self, lossless=False):
+		self.q = queue.Queue(maxsize=1)
+		self.dropped = 0
+		self.lossless = lossless  # put() waits instead, for --replayfast
+
+	def put(self, item):
+		if self.lossless:
+			self.q.put(item)
+			return
+		while True:
+			try:
+				self.q.put_nowait(item)
+				return
+			except queue.Full:
+				try:
+					self.q.get_nowait()
+					self.dropped += 1
+				except queue.Empty:
+					pass
+
+	def get(self, timeout=None):
+		return self.q.get(timeout=timeout)  # raises queue.Empty on timeout
+
 def setCenter(x,y):
 	global ctrx, ctry
 	ctrx = x
 	ctry = y
 
+def getSession():
+	global session
+	if not session:
+		session = requests.Session()
+		session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+	return session
+
 def getText(qstring):
 	url = f'{args.camurl}/{qstring}'
-	response = requests.get(url, timeout=10)	# blocking
+	response = getSession().get(url, timeout=10)	# blocking
 	return response
 
 def getImage(qstring):
 	url = f'{args.camurl}/{qstring}'
 	timestampReq = time.time()
-	resp = requests.get(url, stream=True, timeout=10).raw	# blocking
+	with timing.stage('http'):
+		resp = getSession().get(url, stream=True, timeout=10)	# blocking, until headers
+	if resp.status_code != 200:  # an error page is not a photo, captureWithRetry retries it
+		resp.close()  # back to the pool
+		raise Exception(f'camera capture response {resp.status_code}')
+	with timing.stage('transfer'):
+		jpeg = resp.content
 	timestampResp = time.time()
-	image = np.asarray(bytearray(resp.read()), dtype="uint8")
-	image = cv2.imdecode(image, cv2.IMREAD_COLOR)
-	return image, timestampReq, timestampResp
+	return jpeg, timestampReq, timestampResp
+
+def openStream():
+	global stream
+	resp = getSession().get(f'{args.streamurl}/stream', stream=True, timeout=10)
+	if resp.status_code != 200:
+		raise Exception(f'camera stream response {resp.status_code}')
+	stream = io.BufferedReader(resp.raw)
+	jlog.info(f'camera stream open')
+
+def closeStream():
+	global stream
+	if stream:
+		try:
+			stream.close()
+		except Exception:
+			pass
+	stream = None
+
+def getStreamImage():
+	# each part: boundary line, headers including Content-Length, blank line, jpeg bytes
+	if not stream:
+		openStream()
+	length = 0
+	with timing.stage('http'):
+		while True:
+			line = stream.readline()
+			if not line:
+				raise Exception('camera stream closed')
+			line = line.strip()
+			if line.lower().startswith(b'content-length:'):
+				length = int(line.split(b':')[1])
+			elif not line and length:
+				break
+	timestampReq = time.time()  # part headers arrive as soon as the camera has the frame
+	with timing.stage('transfer'):
+		jpeg = stream.read(length)
+	timestampResp = time.time()
+	if len(jpeg) < length:
+		raise Exception(f'camera stream part truncated {len(jpeg)} of {length}')
+	return jpeg, timestampReq, timestampResp
+
+class ReplayComplete(Exception):
+	pass
+
+class ReplaySource:
+	def __init__(self, dirname, fast):
+		self.files = sorted(glob.glob(f'{dirname}/*.{imgext}'))  # names are zero-padded seconds
+		self.times = [float(os.path.basename(f).split('.')[0].replace('_','.')) for f in self.files]
+		self.fast = fast
+		self.ndx = 0
+		self.tstart = 0.0
+		jlog.info(f'replay {len(self.files)} photos from {dirname}')
+
+	def getImage(self):
+		if self.ndx >= len(self.files):
+			raise ReplayComplete('replay complete')
+		if self.ndx == 0:
+			self.tstart = time.time()
+		elif not self.fast:
+			sleeptime = (self.tstart + self.times[self.ndx] - self.times[0]) - time.time()
+			if sleeptime > 0:
+				time.sleep(sleeptime)
+		timestampReq = time.time()
+		with timing.stage('transfer'), open(self.files[self.ndx], 'rb') as fp:
+			jpeg = fp.read()
+		self.ndx += 1
+		return jpeg, timestampReq, time.time()
 
 def capturePhoto():
 	try:
-		image,start,stop = getImage('capture')
-		if len(image) <= 0:
-			raise Exception('{start} image returned empty')
+		if replaysource:
+			jpeg,start,stop = replaysource.getImage()
+		elif args.capturemode == 'stream':
+			jpeg,start,stop = getStreamImage()
+		else:
+			jpeg,start,stop = getImage('capture')
+		if len(jpeg) <= 0:
+			raise Exception(f'{start} image returned empty')
+	except ReplayComplete:
+		raise
 	except Exception as ex:
 		jlog.error(f'capture photo error {ex}')
+		closeStream()
 		raise
 
 	jlog.debug(f'photo captured {start}')
-	return image, start, stop  # do we shut down on one excepton or keep going to retry?
+	return jpeg, start, stop  # do we shut down on one excepton or keep going to retry?
 
-def cropPhoto(image):
-	image = image[y:b, x:r]
+def decodePhoto(jpeg):
+	image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+	if image is None:
+		raise Exception('jpeg decode failed')
 	return image
 
+def cropPhoto(image):
+	return specs.cropPhoto(image)
+
+def turboDecodeArena(jpeg):
+	# lossless crop on MCU boundaries, decode that, then slice off the alignment margin
+	fw, fh, subsample, _ = turbo.decode_header(jpeg)
+	if fw == w and fh == h:
+		return geoReference(turbo.decode(jpeg, pixel_format=TJPF_BGR))  # see decodeArena()
+	mw = mcuWidth[subsample]
+	mh = mcuHeight[subsample]
+	x0 = (x // mw) * mw
+	y0 = (y // mh) * mh
+	x1 = min(fw, -(-r // mw) * mw)
+	y1 = min(fh, -(-b // mh) * mh)
+	with timing.stage('crop'):
+		cropped = turbo.crop(jpeg, x0, y0, x1-x0, y1-y0)
+	with timing.stage('decode'):
+		image = turbo.decode(cropped, pixel_format=TJPF_BGR)
+	return image[y-y0:b-y0, x-x0:r-x0]
+
+def decodeArena(jpeg):
+	if turbo:
+		try:
+			return turboDecodeArena(jpeg)
+		except Exception as ex:
+			jlog.debug(f'turbojpeg crop failed, full decode: {ex}')
+	with timing.stage('decode'):
+		image = decodePhoto(jpeg)
+	if image.shape[:2] == (h,w):
+		return geoReference(image)  # replay of a photo saved already cropped and rotated, undo the rotation
+	with timing.stage('crop'):
+		return cropPhoto(image)
+
 def geoReference(photo):
 	return cv2.rotate(photo, cv2.ROTATE_180)
 
-def savePhoto(image, timestamp):
-	global imgext
-	if not args.nosave:
-		stime = f'{jlog.selapsed()}'.replace('.','_')
-		fname = f'{args.mediaout}/{stime}.{imgext}'
-		cv2.imwrite(fname, image)
-		jlog.debug(f'saved {fname}')
+def geoReferencePoint(pt):
+	# same as geoReference() for one point, (x,y) in the unrotated crop to (x,y) in the arena
+	return [(w-1) - pt[0], (h-1) - pt[1]]
+
+class Archiver:
+	def __init__(self, dirname, maxsize):
+		self.dirname = dirname
+		self.q = queue.Queue(maxsize=maxsize)
+		self.written = 0
+		self.dropped = 0
+		self.stopping = False	# set when the end marker cannot be queued, the thread quits after the photo it is on
+		self.thread = threading.Thread(target=self.run, name='archiver', daemon=True)
+		self.thread.start()
+
+	def put(self, jpeg, timestamp):
+		try:
+			self.q.put_nowait((jpeg, timestamp))
+		except queue.Full:
+			self.dropped += 1
+
+	def run(self):
+		while not self.stopping:
+			item = self.q.get()
+			if item is None:
+				break
+			jpeg, timestamp = item
+			stime = f'{timestamp - jlog.timestart:011.5f}'.replace('.','_') # same as jlog.selapsed()
+			fname = f'{self.dirname}/{stime}.{imgext}'
+			try:
+				with timing.stage('save'), open(fname, 'wb') as fp:
+					fp.write(jpeg)
+				self.written += 1
+				jlog.debug(f'saved {fname}')
+			except Exception as ex:
+				self.dropped += 1
+				jlog.error(f'save photo error {ex}')
+
+	def stop(self, timeout=5):
+		try:
+			self.q.put(None, timeout=timeout)  # full, and not draining, if a disk write stalled
+		except queue.Full:
+			self.stopping = True
+		self.thread.join(timeout)
+		left = sum(1 for item in list(self.q.queue) if item is not None)
+		if left or self.thread.is_alive():
+			jlog.error(f'archiver stalled, photos left unarchived:{left}')
+		jlog.info(f'archiver photos written:{self.written}, dropped:{self.dropped}')
+
+def savePhoto(jpeg, timestamp):
+	if archiver:
+		archiver.put(jpeg, timestamp)
 
 def netUp(ssid, pw):
 	nmcli.disable_use_sudo()
@@ -221,16 +531,162 @@ def prepDonutKernel(fname):
 	kernel = cv2.imread(fname)
 	kernel = cv2.cvtColor(kernel, cv2.COLOR_BGR2GRAY)
 	kernel = ((kernel / 255) - 0.5) * 2 # normalize to -1:+1
+	kernel = cv2.rotate(kernel, cv2.ROTATE_180) # we search the unrotated photo
 	return kernel
 
-def findDonut(frame, kernel):
-	frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-	frame = ((frame / 255) - 0.5) * 2 # normalize to -1:+1
-	convolved = cv2.filter2D(frame, 1, kernel)
-	cidx = np.argmax(convolved)
-	cx = cidx % 600
-	cy = int(cidx / 600)
-	return cx, cy
+def reuse(buf, shape, dtype):
+	if buf is None or buf.shape != shape or buf.dtype != dtype:
+		buf = np.empty(shape, dtype=dtype)
+	return buf
+
+class Preprocess:
+	satevery = 5	# photos between saturation samples
+	satalpha = 0.1	# weight of a new saturation sample in the moving average
+	satstep = 8	# subsample the photo for the saturation sample
+
+	def __init__(self):
+		self.photo = None
+		self.bufgray = None
+		self.bufnorm = None
+		self.bufhsv = None
+		self.bufmask = None
+		self.hasgray = False
+		self.hasnorm = False
+		self.hashsv = False
+		self.nphotos = 0
+		self.avgsat = None
+
+	def set(self, photo):
+		self.photo = photo
+		self.hasgray = self.hasnorm = self.hashsv = False
+		if self.nphotos % self.satevery == 0:
+			self.sampleSaturation()
+		self.nphotos += 1
+
+	def gray(self):
+		if not self.hasgray:
+			self.bufgray = reuse(self.bufgray, self.photo.shape[:2], np.uint8)
+			cv2.cvtColor(self.photo, cv2.COLOR_BGR2GRAY, dst=self.bufgray)
+			self.hasgray = True
+		return self.bufgray
+
+	def norm(self):
+		if not self.hasnorm:
+			gray = self.gray()
+			self.bufnorm = reuse(self.bufnorm, gray.shape, np.float32)
+			np.multiply(gray, np.float32(2/255), out=self.bufnorm, casting='unsafe')
+			self.bufnorm -= 1 # normalize to -1:+1
+			self.hasnorm = True
+		return self.bufnorm
+
+	def hsv(self):
+		if not self.hashsv:
+			self.bufhsv = reuse(self.bufhsv, self.photo.shape, np.uint8)
+			cv2.cvtColor(self.photo, cv2.COLOR_BGR2HSV, dst=self.bufhsv)
+			self.hashsv = True
+		return self.bufhsv
+
+	def coneMask(self):
+		hsv = self.hsv()
+		self.bufmask = reuse(self.bufmask, hsv.shape[:2], np.uint8)
+		cv2.inRange(hsv, coneLowerHSV, coneUpperHSV, dst=self.bufmask)
+		return self.bufmask
+
+	def sampleSaturation(self):
+		small = cv2.cvtColor(np.ascontiguousarray(self.photo[::self.satstep, ::self.satstep]), cv2.COLOR_BGR2HSV)
+		avgs = cv2.mean(small)[1]
+		if self.avgsat is None:
+			self.avgsat = avgs
+		else:
+			self.avgsat += self.satalpha * (avgs - self.avgsat)
+		coneLowerHSV[1] = satLowFromAvg(self.avgsat)
+
+def correlate(gray, kernel, x0, y0, x1, y1):
+	# same response as filter2D, for kernel anchors in x0:x1, y0:y1 only
+	kh, kw = kernel.shape
+	ax, ay = kw//2, kh//2
+	gh, gw = gray.shape
+	top, left = y0-ay, x0-ax
+	bottom, right = y1+(kh-1-ay), x1+(kw-1-ax)
+	roi = gray[max(0,top):min(gh,bottom), max(0,left):min(gw,right)]
+	pt, pl, pb, pr = max(0,-top), max(0,-left), max(0,bottom-gh), max(0,right-gw)
+	if pt or pl or pb or pr:
+		roi = cv2.copyMakeBorder(roi, pt, pb, pl, pr, cv2.BORDER_REFLECT_101)
+	return cv2.matchTemplate(roi, kernel, cv2.TM_CCORR)
+
+def subpixel(a, b, c):
+	# vertex of the parabola through three samples, offset from the middle one
+	d = a - (2*b) + c
+	return 0.5 * (a - c) / d if d < 0 else 0.0
+
+def findPeak(resp, exclude):
+	# subpixel peak, and peak-to-sidelobe ratio with a box of +-exclude around the peak left out
+	rh, rw = resp.shape
+	_, peak, _, (px, py) = cv2.minMaxLoc(resp)
+	sx = subpixel(resp[py,px-1], peak, resp[py,px+1]) if 0 < px < rw-1 else 0.0
+	sy = subpixel(resp[py-1,px], peak, resp[py+1,px]) if 0 < py < rh-1 else 0.0
+
+	ex = resp[max(0,py-exclude):py+exclude+1, max(0,px-exclude):px+exclude+1]
+	n = resp.size - ex.size
+	if n < 8:
+		return px+sx, py+sy, 0.0
+	mean = (float(resp.sum()) - float(ex.sum())) / n
+	var = (float(np.square(resp).sum()) - float(np.square(ex).sum())) / n - (mean * mean)
+	psr = (peak - mean) / math.sqrt(var) if var > 0 else 0.0
+	return px+sx, py+sy, psr
+
+class DonutLocator:
+	levels = 2	# pyramid levels below full resolution, 600 > 300 > 150
+	window = 40	# px, half-size of the tracking window at full resolution
+	refine = 4	# px, half-size of the refine window at each finer level
+	minpsr = 6.0	# below this, the next photo gets a full search
+
+	def __init__(self, kernel, minpsr):
+		self.kernels = [kernel.astype(np.float32)]
+		for i in range(self.levels):
+			self.kernels.append(cv2.pyrDown(self.kernels[-1]))
+		self.minpsr = minpsr
+		self.last = None	# [x,y] of the last fix
+		self.psr = 0.0		# confidence of the last fix
+
+	def search(self, gray, level, center, half):
+		# search a window of +-half around center, or the whole image if no center
+		gh, gw = gray.shape
+		if center is None:
+			x0, y0, x1, y1 = 0, 0, gw, gh
+		else:
+			cx, cy = int(round(center[0])), int(round(center[1]))
+			x0, y0 = max(0, cx-half), max(0, cy-half)
+			x1, y1 = min(gw, cx+half+1), min(gh, cy+half+1)
+		kernel = self.kernels[level]
+		resp = correlate(gray, kernel, x0, y0, x1, y1)
+		px, py, psr = findPeak(resp, max(kernel.shape)//2)
+		return x0+px, y0+py, psr
+
+	def locate(self, pre):
+		gray = pre.norm()
+
+		# tracking
+		if self.last is not None and self.psr >= self.minpsr:
+			x, y, psr = self.search(gray, 0, self.last, self.window)
+			if psr >= self.minpsr:
+				return self.fix(x, y, psr)
+			jlog.debug(f'donut lost, psr {psr:.2f}, full search')
+
+		# full search, coarse to fine
+		pyramid = [gray]
+		for i in range(self.levels):
+			pyramid.append(cv2.pyrDown(pyramid[-1]))
+		x, y, psr = self.search(pyramid[-1], self.levels, None, 0)
+		for level in range(self.levels-1, -1, -1):
+			x, y, _ = self.search(pyramid[level], level, [x*2, y*2], self.refine)
+		return self.fix(x, y, psr)
+
+	def fix(self, x, y, psr):
+		x, y = float(x), float(y)
+		self.last = [x, y]
+		self.psr = psr
+		return x, y, psr
 
 def calcRMSE(predicted, actual): # root mean squared error
 	actual = np.array(actual) 
@@ -245,21 +701,16 @@ coneLowerHSV = np.array([ 27,  -1,  62])  # night:  0, 108,  77  day: 27, 119, 1
 coneUpperHSV = np.array([ 76, 255, 196])  # night: 69, 156, 148  day: 76, 255, 196 
 coneDim = [22, 22]
 
-def findCones(photo, numCones):
-	global coneLowerHSV
-	hsv = cv2.cvtColor(photo, cv2.COLOR_BGR2HSV)
-	h,s,v = cv2.split(hsv)
-	avgs = np.mean(s)
-
+def satLowFromAvg(avgs):
 	# replace sat-lo with a function of avg sat
 	w1 = -0.947
 	w2 = 0.00982
 	b = 141
-	sn = int((w1 * avgs) + (w2 * (avgs**2)) + b)
-	coneLowerHSV[1] = sn
+	return int((w1 * avgs) + (w2 * (avgs**2)) + b)
 
-	# make a mask based on hsv ranges
-	mask = cv2.inRange(hsv,coneLowerHSV,coneUpperHSV)
+def scanCones(pre, numCones): # full scan, returns float centers in the unrotated photo
+	# make a mask based on hsv ranges, sat-lo is kept up to date by Preprocess
+	mask = pre.coneMask()
 
 	# find polygons in the mask
 	contours,_ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -275,51 +726,218 @@ def findCones(photo, numCones):
 		cones.append(scores[key])
 		if len(cones) >= numCones:
 			break
-	cones = list(list(map(int, tup)) for tup in cones)
 	return cones
 
-def processAerialPhoto():
+def findCones(pre, numCones):
+	return list(list(map(int, geoReferencePoint(tup))) for tup in scanCones(pre, numCones))
+
+def isSameCones(a, b, tolerance):
+	# same count, and every cone in each list has a partner in the other within tolerance
+	if len(a) != len(b) or len(a) <= 0:
+		return False
+	d = np.linalg.norm(np.array(a)[:,None,:] - np.array(b)[None,:,:], axis=2)
+	return (d.min(axis=1) < tolerance).all() and (d.min(axis=0) < tolerance).all()
+
+class ConeMap:
+	tolerance = 6	# px, a cone has not moved
+	halfwin = 20	# px, half-size of the check window around a locked cone
+	minfill = 0.3	# fraction of the cone area that must pass the hsv mask in the window
+
+	def __init__(self, numcones, nlock, rescan):
+		self.numcones = numcones
+		self.nlock = nlock
+		self.rescan = rescan
+		self.cones = None	# locked cone positions, unrotated photo
+		self.candidate = None	# last full scan, while unlocked
+		self.nconsistent = 0	# consecutive full scans matching the candidate
+		self.nchecked = 0	# photos checked since the last full scan
+
+	def find(self, pre):
+		if self.cones is not None and self.nchecked < self.rescan:
+			if self.check(pre):
+				self.nchecked += 1
+				return self.cones
+			jlog.info('cone map check failed, unlocked')
+			self.cones = None
+		cones = scanCones(pre, self.numcones)
+		self.scanned(cones)
+		return cones
+
+	def scanned(self, cones):
+		self.nchecked = 0
+		if self.cones is not None:  # scheduled rescan
+			if isSameCones(cones, self.cones, self.tolerance):
+				return
+			jlog.info('cone map rescan differs, unlocked')
+			self.cones = None
+
+		if (len(cones) == self.numcones) and (self.candidate is not None) and isSameCones(cones, self.candidate, self.tolerance):
+			self.nconsistent += 1
+		else:
+			self.nconsistent = 1
+		self.candidate = cones
+		if self.nconsistent >= self.nlock:
+			self.cones = cones
+			jlog.info(f'cone map locked, {len(cones)} cones')
+
+	def check(self, pre):
+		photo = pre.photo
+		ph, pw = photo.shape[:2]
+		minarea = coneDim[0] * coneDim[1] * self.minfill
+		for cx,cy in self.cones:
+			x0, y0 = max(0, int(cx)-self.halfwin), max(0, int(cy)-self.halfwin)
+			x1, y1 = min(pw, int(cx)+self.halfwin+1), min(ph, int(cy)+self.halfwin+1)
+			if pre.hashsv:
+				hsv = pre.hsv()[y0:y1, x0:x1]
+			else:
+				hsv = cv2.cvtColor(photo[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+			mask = cv2.inRange(hsv, coneLowerHSV, coneUpperHSV)
+			m = cv2.moments(mask, binaryImage=True)
+			if m['m00'] < minarea:
+				return False
+			mx = x0 + (m['m10'] / m['m00'])
+			my = y0 + (m['m01'] / m['m00'])
+			if math.hypot(mx-cx, my-cy) > self.tolerance:
+				return False
+		return True
+
+def captureStage():
 	global photo_timestamp
 
 	# captures fail if too close together.  Is it http or camera?
+	# the stream is paced by the camera itself
 	sleeptime = cameraSettleTime - (time.time() - photo_timestamp)
-	if sleeptime > 0:
-		time.sleep(sleeptime)
+	if sleeptime > 0 and args.capturemode == 'capture' and not replaysource:
+		with timing.stage('settle'):
+			time.sleep(sleeptime)
 
 	# get photo from camera
-	photo, start, stop = capturePhoto()
+	jpeg, start, stop = capturePhoto()
 	photo_timestamp = start # closest time as possible to actual camera capture
 	jlog.debug(f'got photo, elapsed {stop - start}')
+	return jpeg, start
 
+def detectStage(jpeg, timestamp):
 	# prep photo
-	photo = cropPhoto(photo)
-	photo = geoReference(photo)
+	photo = decodeArena(jpeg)
+	preprocess.set(photo)
 
 	# object recognition
-	x,y = findDonut(photo, donutkernel)
-	acones = findCones(photo, args.numcones)
-	jlog.debug(f'got objects, donut at {x},{y}')
-
+	with timing.stage('donut'):
+		dx,dy,psr = donutlocator.locate(preprocess)
+	x,y = geoReferencePoint([dx,dy])  # subpixel
+	with timing.stage('cones'):
+		if conemap:
+			acones = list(list(map(int, geoReferencePoint(tup))) for tup in conemap.find(preprocess))
+		else:
+			acones = findCones(preprocess, args.numcones)
+	jlog.debug(f'got objects, donut at {x:.1f},{y:.1f}, psr {psr:.2f}')
+	return jpeg, photo, x, y, psr, acones, timestamp
+
+def publishStage(jpeg, photo, x, y, psr, acones, timestamp):
+	global npublished
 	# move object positions to shared memory
-	smem_positions[NUM_CONES] = len(acones)
-	smem_positions[DONUT_X] = x
-	smem_positions[DONUT_Y] = y
-	pos = CONE1_X
-	for i in range(len(acones)): 
-		smem_positions[pos + i*2] = acones[i][0]
-		smem_positions[pos + i*2 + 1] = acones[i][1]
-	smem_timestamp[TIME_PHOTO] = photo_timestamp
+	with timing.stage('publish'):
+		smem_telemetry.frames.write(timestamp, photo)  # the crop, for live viewers
+		writeDetection(smem_telemetry.detection, timestamp, (x, y), acones, psr)  # one record, seqlocked
+		smem_photoevent.set()  # wake skate
+	smem_telemetry.beat(HB_AWACS)
+	npublished += 1
+	jlog.info(f'found donut:[{x:.1f},{y:.1f}], camera:{timestamp}')
 	
 	# save to disk for ex post facto analysis
-	savePhoto(photo, photo_timestamp)
+	savePhoto(jpeg, timestamp)
+
+def captureWithRetry():
+	# a lost request or a stalled stream costs one photo, not the run
+	global ncaptureerrors
+	nerrors = 0
+	while True:
+		try:
+			return captureStage()
+		except ReplayComplete:
+			raise
+		except Exception:
+			ncaptureerrors += 1
+			nerrors += 1
+			if nerrors >= args.maxcaptureerrors or isKilled():
+				raise
+			time.sleep(cameraSettleTime)
+
+def detectOrSkip(jpeg, timestamp):
+	# a bad photo, an undecodable jpeg say, is dropped, only a run of them ends awacs
+	global ndetecterrors, nrowdetecterrors
+	try:
+		detection = detectStage(jpeg, timestamp)
+		nrowdetecterrors = 0
+		return detection
+	except Exception as ex:
+		ndetecterrors += 1
+		nrowdetecterrors += 1
+		jlog.error(f'detect error, photo {timestamp} dropped, {nrowdetecterrors} in a row: {ex}')
+		if nrowdetecterrors >= args.maxdetecterrors:
+			raise
+		return None
+
+def processAerialPhoto(): # all three stages serially, one photo at a time
+	jpeg, timestamp = captureWithRetry()
+	detection = detectOrSkip(jpeg, timestamp)
+	if detection:
+		publishStage(*detection)
+
+def captureThread():
+	try:
+		while not isKilled():
+			pcapture.put(captureWithRetry())
+	except ReplayComplete:
+		pcapture.put(None)  # passed down the pipeline, the publisher kills
+	except Exception as ex:
+		stop(f'capture thread: {ex}')
+
+def detectThread():
+	try:
+		while not isKilled():
+			try:
+				item = pcapture.get(timeout=1)
+			except queue.Empty:
+				continue
+			if item is None:
+				pdetect.put(None)
+				break
+			detection = detectOrSkip(*item)
+			if detection:
+				pdetect.put(detection)
+	except Exception as ex:
+		stop(f'detect thread: {ex}')
+
+def startPipeline():
+	global pcapture, pdetect
+	lossless = bool(replaysource) and args.replayfast  # benchmark every photo
+	pcapture = LatestQueue(lossless)
+	pdetect = LatestQueue(lossless)
+	threading.Thread(target=captureThread, name='capture', daemon=True).start()
+	threading.Thread(target=detectThread, name='detect', daemon=True).start()
 
-def awacs_main(timestamp, positions):
-	global args, smem_timestamp, smem_positions, donutkernel, imgext
+def publishPipeline(): # publisher, runs in the main thread
+	try:
+		detection = pdetect.get(timeout=1)
+	except queue.Empty:
+		return
+	if detection is None:
+		raise ReplayComplete('replay complete')
+	publishStage(*detection)
+
+def awacs_main(timestamp, telemetry, photoevent, timestart, restart=0):
+	global args, smem_timestamp, smem_telemetry, smem_photoevent, donutlocator, preprocess, conemap, archiver, replaysource
 	smem_timestamp = timestamp
-	smem_positions = positions	
+	smem_telemetry = telemetry
+	smem_photoevent = photoevent
 
 	try: 
 		jlog.setup('awacs', args.verbose, args.quiet, args.mediaout)
+		jlog.timestart = timestart  # gcs's, so photo names go on from the last run after a restart
+		rt.apply('awacs', args)  # before the pipeline threads start
+		timing.setup(f'awacs_{restart}' if restart else 'awacs', args.mediaout)  # a restart keeps the histograms of the last run
 
 		# ignore the KeyboardInterrupt in this subprocess
 		signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -327,30 +945,81 @@ def awacs_main(timestamp, positions):
 		# setup
 		jlog.info(f'starting process id: {os.getpid()}, cameraSettleTime:{cameraSettleTime}')
 
-		try:
-			netUp(args.ssid, args.sspw)
-		except Exception as ex:
-			jlog.info(f'nmcli connection to {args.ssid} failed: {ex}')
-			return
-
-		setupCamera()
-		donutkernel = prepDonutKernel(args.kernel)
+		if args.replay:
+			replaysource = ReplaySource(args.replay, args.replayfast)
+		elif args.nonet:
+			setupCamera()
+		else:
+			try:
+				netUp(args.ssid, args.sspw)
+			except Exception as ex:
+				jlog.info(f'nmcli connection to {args.ssid} failed: {ex}')
+				return
+			setupCamera()
+
+		preprocess = Preprocess()
+		donutlocator = DonutLocator(prepDonutKernel(args.kernel), args.donutpsr)
+		if args.conemap:
+			conemap = ConeMap(args.numcones, args.conelock, args.conerescan)
+		if not args.nosave and not replaysource:  # replayed photos are already on disk
+			archiver = Archiver(args.mediaout, args.archivequeue)
+
+		if not args.nopipeline:
+			startPipeline()
+		tstart = time.time()
 
 		# main loop
 		while True:
-			if smem_timestamp[TIME_KILLED]:
+			if isKilled():
 				jlog.info(f'stopping main loop due to kill')
 				break
-			processAerialPhoto()
-			jlog.info(f'found donut:[{smem_positions[DONUT_X]},{smem_positions[DONUT_Y]}], camera:{photo_timestamp}')
-
+			try:
+				if args.nopipeline:
+					processAerialPhoto()
+				else:
+					publishPipeline()
+			except ReplayComplete:
+				kill('replay complete')
+			timing.dumpIfDue()
+
+		if not args.nopipeline:
+			jlog.info(f'pipeline photos skipped, capture:{pcapture.dropped}, detect:{pdetect.dropped}')
+		elapsed = time.time() - tstart
+		jlog.info(f'published {npublished} photos in {elapsed:.2f} seconds, {npublished/elapsed:.2f} per second, capture errors:{ncaptureerrors}, detect errors:{ndetecterrors}')
 		jlog.debug('fall out of main loop')
 
 	except KeyboardInterrupt:
 		jlog.error('never happen')
 		
 	finally:
-		kill('finally')
-		netDown(args.ssid)
+		stop('finally')
+		closeStream()
+		if archiver:
+			archiver.stop()
+		if not replaysource and not args.nonet:
+			netDown(args.ssid)
+		timing.dump()
+		timing.summary()
 	jlog.info(f'main exit')
 
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--verbose'  ,action='store_true'  ,help='verbose comments'                 ) 
+	parser.add_argument('--quiet'    ,action='store_true'  ,help='suppress all output'              )
+	parser.add_argument('--mediaout' ,default='/home/john/media/webapps/sk8mini/awacs/photos' ,help='folder out for images, log')
+	setupArgParser(parser)
+	rt.setupArgParser(parser)
+	args = parser.parse_args() # returns Namespace object, use dot-notation
+
+	args.mediaout = f'{args.mediaout}/{time.strftime("%Y%m%d-%H%M%S")}'
+	os.mkdir(args.mediaout)
+
+	smem_timestamp = multiprocessing.Array('d', TIME_ARRAY_SIZE) # initialized with zeros
+	smem_telemetry = Telemetry(f'{TELEMETRY_NAME}_awacs', create=True)  # initialized with zeros, not the name a gcs uses
+	smem_photoevent = multiprocessing.Event()
+	try:
+		awacs_main(smem_timestamp, smem_telemetry, smem_photoevent, time.time())
+	finally:
+		smem_telemetry.close()
+		smem_telemetry.unlink()
+
@@ -0,0 +1,172 @@
+'''
+camsim.py - stand-in for the awacs ESP32-CAM webserver, for load and latency testing
+
+serves the endpoints used by awacs.py, from a folder of recorded jpgs:
+	/control?var=framesize&val=12	200, empty body
+	/status				200, json camera settings
+	/capture			one jpg
+	/stream				multipart/x-mixed-replace, same framing as app_httpd.cpp
+/stream is served on --port, and also on --port + 1, like the camera
+
+wifi conditions:
+	--latency ms		added before every response
+	--jitter ms		random extra latency, uniform 0 to jitter
+	--droprate 0-1		fraction of /capture requests, or stream frames, that are dropped
+	--dropstall s		a dropped request stalls this long and then closes with no response
+	--bandwidth KB/s	body is written in chunks, paced to this rate, 0 is unlimited
+
+usage:
+	python camsim.py --frames photos/20240703-080355 --latency 80 --jitter 200 --droprate .05 --bandwidth 300
+	python awacs.py --nonet --camurl http://localhost:8080 --streamurl http://localhost:8081 --capturemode stream
+'''
+
+import argparse
+import glob
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PART_BOUNDARY = '123456789000000000000987654321'
+CHUNK = 4096
+
+args = None
+frames = []	# jpg bytes, in timestamp order
+ndxframe = 0
+lock = threading.Lock()
+settings = {'framesize': 12, 'quality': 18}
+counts = {'capture': 0, 'stream': 0, 'dropped': 0}
+
+def nextFrame():
+	global ndxframe
+	with lock:
+		jpeg = frames[ndxframe]
+		ndxframe = (ndxframe + 1) % len(frames)
+	return jpeg
+
+def delay():
+	time.sleep((args.latency + random.uniform(0, args.jitter)) / 1000)
+
+def isDropped():
+	if random.random() < args.droprate:
+		counts['dropped'] += 1
+		return True
+	return False
+
+class CameraHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'  # keep-alive, like the camera
+
+	def log_message(self, format, *a):
+		if args.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *a)
+
+	def writeBody(self, data):
+		if args.bandwidth <= 0:
+			self.wfile.write(data)
+			return
+		for i in range(0, len(data), CHUNK):
+			chunk = data[i:i+CHUNK]
+			self.wfile.write(chunk)
+			time.sleep(len(chunk) / (args.bandwidth * 1024))
+
+	def respond(self, body, ctype):
+		self.send_response(200)
+		self.send_header('Content-Type', ctype)
+		self.send_header('Content-Length', str(len(body)))
+		self.send_header('Access-Control-Allow-Origin', '*')
+		self.end_headers()
+		self.writeBody(body)
+
+	def drop(self):
+		time.sleep(args.dropstall)
+		self.close_connection = True
+
+	def do_GET(self):
+		url = urllib.parse.urlparse(self.path)
+		query = urllib.parse.parse_qs(url.query)
+		delay()
+		if url.path == '/stream':
+			self.stream()
+		elif url.path == '/control':
+			var = query.get('var', [''])[0]
+			val = query.get('val', ['0'])[0]
+			settings[var] = int(val)
+			self.respond(b'', 'text/html')
+		elif url.path == '/status':
+			self.respond(bytes(json.dumps(settings), 'utf-8'), 'application/json')
+		elif url.path == '/capture':
+			if isDropped():
+				self.drop()
+				return
+			counts['capture'] += 1
+			self.respond(nextFrame(), 'image/jpeg')
+		else:
+			self.send_error(404)
+
+	def stream(self):
+		self.close_connection = True
+		self.send_response(200)
+		self.send_header('Content-Type', f'multipart/x-mixed-replace;boundary={PART_BOUNDARY}')
+		self.send_header('Access-Control-Allow-Origin', '*')
+		self.send_header('Connection', 'close')
+		self.end_headers()
+		period = 1 / args.fps
+		tnext = time.time()
+		try:
+			while True:
+				tnext += period
+				jpeg = nextFrame()
+				if not isDropped():
+					t = time.time()
+					head = f'\r\n--{PART_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\nX-Timestamp: {int(t)}.{int((t%1)*1e6):06d}\r\n\r\n'
+					self.wfile.write(bytes(head, 'utf-8'))
+					self.writeBody(jpeg)
+					counts['stream'] += 1
+				sleeptime = tnext - time.time() + (random.uniform(0, args.jitter) / 1000)
+				if sleeptime > 0:
+					time.sleep(sleeptime)
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+
+def serve(port):
+	server = ThreadingHTTPServer(('', port), CameraHandler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	print(f'camsim listening on port {port}')
+	return server
+
+def main():
+	global args, frames
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--frames'    ,required=True                 ,help='folder of recorded jpgs')
+	parser.add_argument('--port'      ,default=8080  ,type=int       ,help='port, /stream is also on port+1')
+	parser.add_argument('--fps'       ,default=10.0  ,type=float     ,help='stream frame rate')
+	parser.add_argument('--latency'   ,default=0.0   ,type=float     ,help='ms added to every response')
+	parser.add_argument('--jitter'    ,default=0.0   ,type=float     ,help='ms, random extra latency up to this')
+	parser.add_argument('--droprate'  ,default=0.0   ,type=float     ,help='fraction of captures or stream frames dropped')
+	parser.add_argument('--dropstall' ,default=0.0   ,type=float     ,help='seconds a dropped request stalls before closing')
+	parser.add_argument('--bandwidth' ,default=0.0   ,type=float     ,help='KB/s cap on response bodies, 0 unlimited')
+	parser.add_argument('--verbose'   ,action='store_true'           ,help='log every request')
+	args = parser.parse_args()
+
+	for fname in sorted(glob.glob(f'{args.frames}/*.jpg')):
+		with open(fname, 'rb') as fp:
+			frames.append(fp.read())
+	if not frames:
+		print(f'no jpgs in {args.frames}')
+		return
+	print(f'camsim {len(frames)} frames from {args.frames}')
+
+	serve(args.port)
+	serve(args.port + 1)
+	try:
+		while True:
+			time.sleep(10)
+			print(f'camsim capture:{counts["capture"]}, stream:{counts["stream"]}, dropped:{counts["dropped"]}')
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == '__main__':
+	main()
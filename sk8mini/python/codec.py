@@ -0,0 +1,172 @@
+'''
+codec.py - framing of serial messages between skate.py and gcs.ino
+
+text mode, what gcs.ino sends today:
+	AHRS	"heading\troll\tpitch\tsys\tgyro\taccel\tmag\n"
+	COMMAND	"cmd\tval\n"
+
+binary mode, mirrors the structs in sk8mini.h:
+	frame = COBS(type + payload + crc) + 0x00
+	type	'A' AHRS, 'C' COMMAND
+	AHRS	<fffBBBB  heading, roll, pitch, sys, gyro, accel, mag   16 bytes
+	COMMAND	<ii       cmd, val                                       8 bytes
+	crc	CRC-16/CCITT-FALSE of type + payload, little-endian
+	COBS removes every 0x00 from the frame, so 0x00 marks the end of a frame
+	a damaged frame fails the crc and is counted, the next 0x00 resyncs
+
+auto mode:
+	a text line never contains 0x00, a binary frame always ends with one
+	on a 0x00, a frame is tried from the start of the buffer, and from after each newline before it
+		a binary frame may hold 0x0a bytes, text before a frame ends with a newline
+	lines before the frame are taken as text, so a stray 0x00 costs only the line it is in
+	bytes up to a 0x00 that are neither a frame nor end in a newline are dropped as bad
+	until a frame passes its crc, lines are split on newlines as text
+	the first message that parses cleanly decides the mode, and it stays
+'''
+
+import struct
+import binascii
+
+AHRS_TYPE = ord('A')
+COMMAND_TYPE = ord('C')
+AHRS_STRUCT = struct.Struct('<fffBBBB')
+COMMAND_STRUCT = struct.Struct('<ii')
+CRC_STRUCT = struct.Struct('<H')
+MAXFRAME = 64	# longest decoded frame we accept
+
+def crc16(data):
+	return binascii.crc_hqx(data, 0xFFFF)
+
+def cobsEncode(data):
+	out = bytearray()
+	block = bytearray()
+	for byte in data:
+		if byte == 0:
+			out.append(len(block) + 1)
+			out += block
+			block = bytearray()
+		else:
+			block.append(byte)
+			if len(block) == 254:
+				out.append(255)
+				out += block
+				block = bytearray()
+	out.append(len(block) + 1)
+	out += block
+	return bytes(out)
+
+def cobsDecode(src, dst):
+	# decode src into the reusable buffer dst, return the length, or -1 if malformed
+	n = len(src)
+	i = 0
+	o = 0
+	while i < n:
+		code = src[i]
+		i += 1
+		end = i + code - 1
+		if code == 0 or end > n or o + code > len(dst):
+			return -1
+		dst[o:o+code-1] = src[i:end]
+		o += code - 1
+		i = end
+		if code < 255 and i < n:
+			dst[o] = 0
+			o += 1
+	return o
+
+def encodeFrame(msgtype, payload):
+	body = bytes([msgtype]) + payload
+	return cobsEncode(body + CRC_STRUCT.pack(crc16(body))) + b'\x00'
+
+def encodeCommand(cmd, val, mode):
+	if mode == 'binary':
+		return encodeFrame(COMMAND_TYPE, COMMAND_STRUCT.pack(cmd, val))
+	return bytes(f'{cmd}\t{val}\n', 'utf-8')
+
+def encodeAhrs(ahrs, mode):  # for testing, gcs.ino does this
+	if mode == 'binary':
+		return encodeFrame(AHRS_TYPE, AHRS_STRUCT.pack(*ahrs))
+	return bytes('\t'.join(str(v) for v in ahrs) + '\n', 'utf-8')
+
+class Decoder:
+	def __init__(self, mode='auto'):
+		self.mode = mode		# auto, text, binary
+		self.buf = bytearray()		# bytes received, not yet framed
+		self.frame = bytearray(MAXFRAME)  # cobs decode buffer, reused
+		self.ngood = 0
+		self.nbad = 0
+
+	def feed(self, data):
+		# add bytes from the serial port, return a list of complete AHRS tuples
+		self.buf += data
+		samples = []
+		while True:
+			zero = self.buf.find(b'\x00')
+			newline = self.buf.find(b'\n')
+			if self.mode == 'auto' and zero >= 0:
+				start = self.findFrame(zero)
+				if start > 0 and newline < start:
+					end, binary = newline, False	# text lines before the frame first
+				elif start >= 0:
+					end, binary = zero, True
+				elif 0 <= newline < zero:
+					end, binary = newline, False	# no valid frame, stay with text
+				else:
+					end, binary = zero, False	# no line end before the 0x00, not text either, bad
+			elif self.mode == 'binary':
+				end, binary = zero, True
+			else:
+				end, binary = newline, False
+			if end < 0:
+				break
+			chunk = bytes(self.buf[:end])
+			del self.buf[:end+1]
+
+			if binary:
+				ahrs = self.decodeBinary(chunk)
+			else:
+				ahrs = self.decodeText(chunk)
+			if ahrs and self.mode == 'auto':
+				self.mode = 'binary' if binary else 'text'
+
+			if ahrs:
+				self.ngood += 1
+				samples.append(ahrs)
+			elif len(chunk) > 0:
+				self.nbad += 1
+		if len(self.buf) > 4 * MAXFRAME:  # no delimiter in sight, garbage
+			del self.buf[:]
+			self.nbad += 1
+		return samples
+
+	def findFrame(self, zero):
+		# start of a valid binary frame ending at zero, or -1
+		start = 0
+		while start <= zero:
+			if self.decodeBinary(bytes(self.buf[start:zero])):
+				return start
+			newline = self.buf.find(b'\n', start, zero)
+			if newline < 0:
+				return -1
+			start = newline + 1
+		return -1
+
+	def decodeBinary(self, chunk):
+		n = cobsDecode(chunk, self.frame)
+		if n < 3:
+			return None
+		(crc,) = CRC_STRUCT.unpack_from(self.frame, n-2)
+		if crc != crc16(memoryview(self.frame)[:n-2]):
+			return None
+		if self.frame[0] == AHRS_TYPE and n-3 == AHRS_STRUCT.size:
+			return AHRS_STRUCT.unpack_from(self.frame, 1)
+		return None
+
+	def decodeText(self, chunk):
+		try:
+			lst = chunk.decode('utf-8').split()
+			if len(lst) != 7:
+				return None
+			return (float(lst[0]), float(lst[1]), float(lst[2]), int(lst[3]), int(lst[4]), int(lst[5]), int(lst[6]))
+		except (UnicodeDecodeError, ValueError):
+			return None
@@ -2,7 +2,7 @@
 gcs.py  ground control station
 
 runs on laptop
-no longer useful
+starts and supervises skate and awacs
 	it used to do more, but now all functions have been offloaded to skate and awacs
 
 software architecture:
@@ -14,6 +14,8 @@ software architecture:
 			allocate shared data: mapped in smem.py 
 			start two child processes: skate and awacs
 			setup shared memory
+			supervise, see Supervisor
+			optional scheduling profile per child, --rtcpus --rtnice --rtfifo --rtlock, see rt.py
 			kill on Ctrl-C
 
 		awacs - camera and CV
@@ -33,6 +35,19 @@ software architecture:
 			manual piloting - matplotlib keyboard
 			visualize arena - matplotlib
 
+supervisor:
+	each process beats its heartbeat in the telemetry segment, once per loop pass, see smem.py
+	instead of join(), the gcs main loop polls the heartbeats at --superhz
+	every --superreport seconds, it logs loop Hz, mean period, jitter, and the longest gap seen, per process
+	skate declares a deadline for its main loop, --deadline
+		a pass longer than that sets TIME_ESTOP, the skate writer thread stops the throttle
+		the estop clears after the loop has been on time for ESTOP_HOLD seconds
+	awacs beats once per published photo
+		if it exits, or publishes nothing for --awacstimeout seconds, it is terminated and started again
+		skate goes on, it pauses the throttle on late photos as always
+		the new awacs keeps the gcs start time, so photo names go on in order, its histograms go to 0_timing_awacs_{restart}.tsv
+		after --maxrestarts restarts, the run is killed
+
 how to debug multiprocessing:
 	import pdb; pdb.set_trace()  # does not work in child process
 
@@ -58,18 +73,21 @@ import multiprocessing
 import time
 import argparse
 import os
+import numpy as np
 
 import jlog
 from smem import *
 import awacs
 import skate
 import specs
+import rt
 
 awacs_process = False
 skate_process = False
 
 smem_timestamp = None
-smem_positions = None
+smem_telemetry = None
+smem_photoevent = None
 
 args	= None
 
@@ -80,9 +98,15 @@ def getArgs(): # get command-line arguments
 	parser.add_argument('--quiet'	,action='store_true'  ,help='suppress all output'              )
 	parser.add_argument('--sim'	,action='store_true'  ,help='simulation mode'                  )
 	parser.add_argument('--mediaout',default='/home/john/media/webapps/sk8mini/awacs/photos' ,help='folder out for images, log')
+	parser.add_argument('--telemetry',default=TELEMETRY_NAME ,help='name of the shared memory telemetry segment, see smem.py')
+	parser.add_argument('--superhz'	,default=20.0 ,type=float ,help='supervisor polls per second'     )
+	parser.add_argument('--superreport',default=10.0 ,type=float ,help='seconds between loop rate reports')
+	parser.add_argument('--awacstimeout',default=15.0 ,type=float ,help='seconds without a photo before awacs is restarted')
+	parser.add_argument('--maxrestarts',default=3 ,type=int   ,help='awacs restarts before the run is killed')
 
 	awacs.setupArgParser(parser)
 	skate.setupArgParser(parser)
+	rt.setupArgParser(parser)
 	args = parser.parse_args() # returns Namespace object, use dot-notation
 	awacs.args = args
 	skate.args = args
@@ -90,24 +114,115 @@ def getArgs(): # get command-line arguments
 	args.mediaout = f'{args.mediaout}/{time.strftime("%Y%m%d-%H%M%S")}'
 	os.mkdir(args.mediaout)
 
+class Supervisor:
+	ESTOP_HOLD = 1.0	# seconds the skate loop must be on time before the estop clears
+
+	def __init__(self):
+		now = time.time()
+		self.tawacs = now	# awacs started, it gets --awacstimeout to publish its first photo
+		self.tlate = 0.0	# skate last seen late
+		self.treport = now
+		self.restarts = 0
+		self.nestops = 0
+		self.counts = np.zeros(len(HB_NAMES))	# heartbeat counts at the last report
+		self.maxage = np.zeros(len(HB_NAMES))	# longest gap seen since the last report
+
+	def supervise(self, now):
+		hb = np.array(smem_telemetry.heartbeat)  # copy
+		age = np.where(hb['t'] > 0, now - hb['t'], 0.0)
+		self.maxage = np.maximum(self.maxage, age)
+		self.checkDeadline(now, hb[HB_SKATE], age[HB_SKATE])
+		self.checkAwacs(now, hb[HB_AWACS])
+		if now - self.treport >= args.superreport:
+			self.report(now, hb)
+		smem_telemetry.beat(HB_GCS)
+
+	def checkDeadline(self, now, hb, age):
+		deadline = hb['deadline']
+		if deadline > 0 and age > deadline:
+			self.tlate = now
+			if smem_timestamp[TIME_ESTOP] <= 0:
+				smem_timestamp[TIME_ESTOP] = now
+				self.nestops += 1
+				jlog.error(f'supervisor: skate loop {age*1000:.0f} ms since its last pass, deadline {deadline*1000:.0f} ms, estop')
+		elif smem_timestamp[TIME_ESTOP] > 0 and (now - self.tlate) > self.ESTOP_HOLD:
+			smem_timestamp[TIME_ESTOP] = 0
+			jlog.info(f'supervisor: skate loop on time again, estop cleared')
+
+	def checkAwacs(self, now, hb):
+		if awacs_process.is_alive():
+			quiet = now - max(hb['t'], self.tawacs)
+			if quiet < args.awacstimeout:
+				return
+			jlog.error(f'supervisor: awacs no photo for {quiet:.1f} seconds, terminate')
+			awacs_process.terminate()
+			awacs_process.join(2)
+			if awacs_process.is_alive():
+				awacs_process.kill()
+				awacs_process.join()
+		else:
+			jlog.error(f'supervisor: awacs exited, exitcode {awacs_process.exitcode}')
+
+		if self.restarts >= args.maxrestarts:
+			jlog.error(f'supervisor: awacs restarted {self.restarts} times, kill')
+			smem_timestamp[TIME_KILLED] = now
+			return
+		self.restarts += 1
+		smem_telemetry.recover()  # in case it died in the middle of a publish
+		startAwacs(self.restarts)
+		self.tawacs = time.time()
+		jlog.info(f'supervisor: awacs restart {self.restarts}, pid {awacs_process.pid}')
+
+	def report(self, now, hb):
+		dt = now - self.treport
+		for i in range(len(HB_NAMES)):
+			if i == HB_GCS or hb['pid'][i] == 0:
+				continue
+			hz = (hb['count'][i] - self.counts[i]) / dt
+			jlog.info(f'supervisor: {HB_NAMES[i]:5s} {hz:5.1f} Hz, period {hb["period"][i]*1000:6.1f} ms, jitter {hb["jitter"][i]*1000:5.1f} ms, longest gap {self.maxage[i]*1000:6.0f} ms')
+		self.counts = hb['count'].astype(float)
+		self.maxage[:] = 0
+		self.treport = now
+
+def startAwacs(restart=0):
+	global awacs_process
+	awacs_process = multiprocessing.Process(target=awacs.awacs_main, args=(smem_timestamp, smem_telemetry, smem_photoevent, jlog.timestart, restart))
+	awacs_process.start()
+
+def isKilled():
+	return (smem_timestamp[TIME_KILLED] > 0)
+
 def main():
-	global smem_timestamp, smem_positions, awacs_process, skate_process
+	global smem_timestamp, smem_telemetry, smem_photoevent, skate_process
 	try:
 		getArgs()
 		jlog.setup('gcs  ', args.verbose, args.quiet, args.mediaout)
 		jlog.info(f'starting process id: {os.getpid()}, {time.strftime("%Y%m%d-%H%M%S")}')
 
 		smem_timestamp = multiprocessing.Array('d', TIME_ARRAY_SIZE) # initialized with zeros
-		smem_positions = multiprocessing.Array('i', POS_ARRAY_SIZE)  # initialized with zeros
+		try:
+			smem_telemetry = Telemetry(args.telemetry, create=True)  # initialized with zeros, attachable by name
+		except FileExistsError as ex:
+			jlog.error(f'telemetry {ex}')
+			return
+		smem_telemetry.beat(HB_GCS)
+		smem_photoevent = multiprocessing.Event()  # awacs sets, skate waits
 
-		awacs_process = multiprocessing.Process(target=awacs.awacs_main, args=(smem_timestamp, smem_positions))
-		awacs_process.start()
+		startAwacs()
 
-		skate_process = multiprocessing.Process(target=skate.skate_main, args=(smem_timestamp, smem_positions))
+		skate_process = multiprocessing.Process(target=skate.skate_main, args=(smem_timestamp, smem_telemetry, smem_photoevent))
 		skate_process.start()
 
-		skate_process.join() # wait here to catch KeyboardInterrupt
+		supervisor = Supervisor()
+		while skate_process.is_alive():  # wait here to catch KeyboardInterrupt
+			if not isKilled():
+				supervisor.supervise(time.time())
+			time.sleep(1 / args.superhz)
+		if not isKilled():
+			jlog.error(f'skate exited, exitcode {skate_process.exitcode}, kill')
+			smem_timestamp[TIME_KILLED] = time.time()
 		awacs_process.join()
+		jlog.info(f'supervisor: estops:{supervisor.nestops}, awacs restarts:{supervisor.restarts}')
 		jlog.debug('exit main')
 
 	except KeyboardInterrupt:
@@ -115,6 +230,11 @@ def main():
 		smem_timestamp[TIME_KILLED]  = time.time()  # causes awacs and skate to end
 		return
 
+	finally:
+		if smem_telemetry:
+			smem_telemetry.close()
+			smem_telemetry.unlink()  # children keep their mapping, the name goes
+
 if __name__ == '__main__':
 	main()
 	jlog.debug('exit gcs')
@@ -0,0 +1,127 @@
+'''
+recorder.py - stream RGBA frames to one video file, through an ffmpeg subprocess
+
+usage:
+	rec = Recorder(f'{args.mediaout}/0_arena', 600, 600, 20)
+	rec.tick(np.asarray(fig.canvas.buffer_rgba()), pose_t)	# every UI frame
+	rec.stop()
+
+video:
+	{name}.mov, quicktime rle, lossless with alpha, flat line drawings and repeated frames cost little
+	fixed frame rate: on each tick, the frame is written once for every frame period that has come due
+	so the video runs at wall clock speed, a frame repeats while nothing changes
+	a buffer of another size, a resized or hidpi window, is resampled to width x height
+
+index:
+	{name}.tsv, one row per video frame: frame, elapsed, pose_t
+	elapsed is seconds since jlog.timestart, as in the photo filenames
+	pose_t is the photo timestamp drawn in that frame
+
+writing:
+	frames are queued to a writer thread, a full queue drops the frame and counts it
+	if ffmpeg dies, the writer stops, later frames are dropped, and stop() does not wait on the queue
+	if ffmpeg is not installed, the recorder logs it and records nothing
+
+reading back, see replay.py:
+	ffmpeg -i {name}.mov -f rawvideo -pix_fmt rgba -
+'''
+
+import subprocess
+import threading
+import queue
+import time
+import numpy as np
+
+import jlog
+
+class Recorder:
+	def __init__(self, name, width, height, fps, maxsize=8):
+		self.fname = f'{name}.mov'
+		self.width = width
+		self.height = height
+		self.fps = fps
+		self.t0 = 0.0		# time of frame 0
+		self.nframes = 0	# frames due so far
+		self.written = 0
+		self.dropped = 0
+		self.resample = None	# row, col index arrays, when the buffer is another size
+		self.proc = None
+		cmd = ['ffmpeg', '-loglevel', 'error', '-y',
+			'-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+			'-c:v', 'qtrle', '-pix_fmt', 'argb', self.fname]
+		try:
+			self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+		except FileNotFoundError:
+			jlog.error('recorder: ffmpeg not found, no video')
+			return
+		self.index = open(f'{name}.tsv', 'w')
+		self.index.write('frame\telapsed\tpose_t\n')
+		self.q = queue.Queue(maxsize=maxsize)
+		self.thread = threading.Thread(target=self.run, name='recorder', daemon=True)
+		self.thread.start()
+		jlog.info(f'recorder: {self.fname} {width}x{height} at {fps} fps')
+
+	def fit(self, frame):
+		h, w = frame.shape[:2]
+		if (h, w) == (self.height, self.width):
+			return frame
+		if self.resample is None or self.resample[0] != (h, w):  # nearest neighbor
+			rows = (np.arange(self.height) * h // self.height)[:, None]
+			cols = (np.arange(self.width) * w // self.width)[None, :]
+			self.resample = ((h, w), rows, cols)
+		return frame[self.resample[1], self.resample[2]]
+
+	def tick(self, frame, pose_t):
+		# frame, h x w x 4 uint8, is copied before this returns
+		if not self.proc:
+			return
+		t = time.time()
+		if self.nframes <= 0:
+			self.t0 = t
+		due = int((t - self.t0) * self.fps) + 1  # frames that should exist by now
+		count = due - self.nframes
+		if count <= 0:
+			return
+		self.nframes = due
+		try:
+			self.q.put_nowait((np.array(self.fit(frame)), count, t, pose_t))
+		except queue.Full:
+			self.dropped += count
+
+	def run(self):
+		while True:
+			item = self.q.get()
+			if item is None:
+				break
+			frame, count, t, pose_t = item
+			data = frame.tobytes()
+			try:
+				for i in range(count):
+					self.proc.stdin.write(data)
+					self.index.write(f'{self.written}\t{t - jlog.timestart:.5f}\t{pose_t:.5f}\n')
+					self.written += 1
+			except (BrokenPipeError, OSError) as ex:
+				jlog.error(f'recorder: write error {ex}')
+				self.dropped += count
+				break
+
+	def stop(self):
+		if not self.proc:
+			return
+		if self.thread.is_alive():  # else ffmpeg died, nothing drains the queue
+			try:
+				self.q.put(None, timeout=2)
+			except queue.Full:
+				jlog.error('recorder: writer stalled, frames left unwritten')
+		self.thread.join(timeout=5)
+		self.index.close()
+		try:
+			self.proc.stdin.close()
+		except OSError:
+			pass
+		try:
+			self.proc.wait(timeout=10)
+		except subprocess.TimeoutExpired:
+			jlog.error('recorder: ffmpeg did not finish, killed')
+			self.proc.kill()
+		jlog.info(f'recorder: {self.fname} frames written:{self.written}, dropped:{self.dropped}')
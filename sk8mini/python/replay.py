@@ -1,5 +1,14 @@
 '''
 replay.py
+
+awacs saves the full camera frame, jpg bytes as received
+here we crop and rotate it to match the arena, as awacs does for detection
+older sessions saved the 600x600 arena, already cropped and rotated
+
+the arena view is either
+	0_arena.mov, one video with a 0_arena.tsv index, see recorder.py, played in real time
+		each video frame is laid over the last photo saved at or before its elapsed time
+	or, in older sessions, one transparent png per frame, interleaved with the jpgs by filename
 '''
 
 import matplotlib as mpl
@@ -7,6 +16,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import specs
 import glob
+import os
+import subprocess
 
 data_extent = [-132,132,-132,132]
 basedir = 'photos/2024*/'
@@ -42,6 +53,53 @@ def startUI():
 	fig.set_size_inches(6, 6)
 	return fig, ax
 
+def arenaFromPhoto(mat):
+	if mat.shape[0] > specs.hArenaPx:  # full frame
+		mat = specs.cropPhoto(mat)[::-1, ::-1]  # rotate 180
+	return mat
+
+def elapsedFromName(fname):  # 00012_34567.jpg
+	return float(os.path.basename(fname).split('.')[0].replace('_','.'))
+
+def readIndex(fname):  # list of elapsed, by video frame
+	elapsed = []
+	with open(fname) as fp:
+		next(fp)  # header
+		for line in fp:
+			frame, e, pose_t = line.split('\t')
+			elapsed.append(float(e))
+	return elapsed
+
+def replayVideo(lastdir, jpgs):
+	elapsed = readIndex(f'{lastdir}0_arena.tsv')
+	w, h = specs.wArenaPx, specs.hArenaPx
+	cmd = ['ffmpeg', '-loglevel', 'error', '-i', f'{lastdir}0_arena.mov', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-']
+	proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+	jpgtimes = [elapsedFromName(f) for f in jpgs]
+
+	fig, ax = startUI()
+	blank = np.zeros((h, w, 4), dtype=np.uint8)
+	imgJpg = plt.imshow(blank, extent=data_extent)
+	imgArena = plt.imshow(blank, extent=data_extent)
+
+	ndxjpg = -1
+	ndxframe = 0
+	while not killed and ndxframe < len(elapsed):
+		if not paused:
+			data = proc.stdout.read(w * h * 4)
+			if len(data) < w * h * 4:
+				break
+			imgArena.set_data(np.frombuffer(data, dtype=np.uint8).reshape(h, w, 4))
+			while ndxjpg+1 < len(jpgs) and jpgtimes[ndxjpg+1] <= elapsed[ndxframe]:
+				ndxjpg += 1
+				imgJpg.set_data(arenaFromPhoto(plt.imread(jpgs[ndxjpg])))
+			loopdelay = (elapsed[ndxframe+1] - elapsed[ndxframe]) if ndxframe+1 < len(elapsed) else delay
+			ndxframe += 1
+		else:
+			loopdelay = delay
+		plt.pause(max(0.001, loopdelay))
+	proc.kill()
+
 def main():	
 	import sys
 	lastdir = ''
@@ -59,13 +117,17 @@ def main():
 	files1 = glob.glob(pattern1)
 	files2 = glob.glob(pattern2)
 
+	if os.path.exists(f'{lastdir}0_arena.mov'):
+		replayVideo(lastdir, sorted(files1))
+		return
+
 	files = files1 + files2
 	files = sorted(files)
 
 	# create two image objects, jpg underneath, transparent png on top
 	fig, ax = startUI()
 	fname = files[0] 
-	mat = plt.imread(fname)
+	mat = arenaFromPhoto(plt.imread(fname))
 	imgJpg =  plt.imshow(mat, extent=data_extent)
 	mat = plt.imread(fname)
 	imgPng =  plt.imshow(mat, extent=data_extent)
@@ -83,7 +145,7 @@ def main():
 			mat = plt.imread(fname)
 
 			if 'jpg' in fname:
-				imgJpg.set_data(mat)
+				imgJpg.set_data(arenaFromPhoto(mat))
 				loopdelay = 0.001
 			else:
 				imgPng.set_data(mat)
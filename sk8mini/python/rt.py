@@ -0,0 +1,217 @@
+'''
+rt.py - real-time scheduling profile for the gcs child processes, and a jitter benchmark
+
+roles:
+	skate	the control loop, wants to wake on time
+	awacs	CV, wants throughput, not latency
+	ui	matplotlib, least important
+
+usage:
+	rt.apply('skate', args)		# first thing in each process, before it starts any threads
+	rt.apply('ui', args, 'skate')	# in a process forked from skate
+
+options, each a list of role=value, space separated:
+	--rtcpus  'skate=1 awacs=2-3 ui=0'	cpu affinity, os.sched_setaffinity
+	--rtnice  'awacs=5 ui=10'		nice value, SCHED_OTHER, negative needs CAP_SYS_NICE
+	--rtfifo  'skate=50'			SCHED_FIFO priority 1-99, needs CAP_SYS_NICE or root
+	--rtlock				lock and pre-fault the memory of skate, needs CAP_IPC_LOCK or root
+a role not named is left as launched, a setting not named for a role too, so taskset, chrt or nice on gcs still hold
+	skate forks the ui, so if skate has a profile, the ui is reset to the launch settings before its own are applied
+	on linux these calls act on the calling thread, threads started later inherit them
+	a setting that is refused is logged, and the process goes on without it
+
+memory, --rtlock:
+	mallopt, so glibc keeps freed memory in the heap instead of giving it back to the os
+	mlockall, current and future pages stay resident, no page faults in the loop
+	a ballast of --rtprefault MB is allocated, touched and freed, so the heap has room already faulted in
+
+benchmark:
+	python rt.py --bench 30 --load 3 --rtcpus 'skate=0 awacs=1-3' --rtfifo 'skate=50'
+	the skate loop is stood in by a loop that waits on an event with a timeout, as skate.waitForEvent()
+	--load processes run synthetic CV, blur and template match on a 600x600 photo, as awacs
+	two phases of --bench seconds each, both under load:
+		default	no profile, every process as launched
+		profile	the --rt options applied, skate role to the loop, awacs role to the load
+	per phase, histograms of the jitter, how far each period is off 1/hz, and of the lateness, wake time minus the time due
+	the jitter, not the period itself, as the histogram buckets are 19% wide, about 10 ms at a 50 ms period
+	p50/p95/p99/max are logged, and written to 0_timing_rtbench.tsv, see timing.py
+'''
+
+import os
+import time
+import ctypes
+import ctypes.util
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+
+import jlog
+import timing
+
+ROLES = ['skate', 'awacs', 'ui']
+MCL_CURRENT	= 1
+MCL_FUTURE	= 2
+M_TRIM_THRESHOLD = -1
+M_MMAP_MAX	= -4
+
+POLICIES = {os.SCHED_OTHER: 'SCHED_OTHER', os.SCHED_FIFO: 'SCHED_FIFO', os.SCHED_RR: 'SCHED_RR', os.SCHED_BATCH: 'SCHED_BATCH', os.SCHED_IDLE: 'SCHED_IDLE'}
+
+# at import, in gcs, before any profile is applied, as launched, by taskset, chrt or nice
+allcpus = os.sched_getaffinity(0)
+launchpolicy = os.sched_getscheduler(0)
+launchparam = os.sched_getparam(0)
+launchnice = os.getpriority(os.PRIO_PROCESS, 0)
+
+def setupArgParser(parser):
+	parser.add_argument('--rtcpus'         ,default=''                    ,help="cpu affinity per role, 'skate=1 awacs=2-3'")
+	parser.add_argument('--rtnice'         ,default=''                    ,help="nice per role, 'awacs=5 ui=10'"   )
+	parser.add_argument('--rtfifo'         ,default=''                    ,help="SCHED_FIFO priority per role, 'skate=50'")
+	parser.add_argument('--rtlock'         ,action='store_true'           ,help='lock and pre-fault skate memory'  )
+	parser.add_argument('--rtprefault'     ,default=64        ,type=int   ,help='MB of heap to pre-fault with --rtlock')
+
+def parseRoles(spec):
+	roles = {}
+	for item in spec.split():
+		role, value = item.split('=')
+		if role not in ROLES:
+			raise ValueError(f'unknown role {role} in {spec}')
+		roles[role] = value
+	return roles
+
+def parseCpus(value):
+	cpus = set()
+	for part in value.split(','):
+		first, _, last = part.partition('-')
+		cpus.update(range(int(first), int(last or first) + 1))
+	return cpus
+
+def profileOf(role, args):
+	# cpus, nice, fifo named for role, None where not given
+	return parseRoles(args.rtcpus).get(role), parseRoles(args.rtnice).get(role), parseRoles(args.rtfifo).get(role)
+
+def apply(role, args, parent=None):
+	cpus, nice, fifo = profileOf(role, args)
+	if parent and any(profileOf(parent, args)):
+		reset(role)  # forked from a process with a profile, start over from the launch settings
+	profile = []
+
+	if cpus:
+		try:
+			os.sched_setaffinity(0, parseCpus(cpus))
+			profile.append(f'cpus {cpus}')
+		except OSError as ex:
+			jlog.error(f'rt: {role} affinity {cpus} refused: {ex}')
+
+	if fifo:
+		try:
+			os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(int(fifo)))
+			profile.append(f'fifo {fifo}')
+		except OSError as ex:
+			jlog.error(f'rt: {role} SCHED_FIFO {fifo} refused: {ex}')
+
+	if nice:
+		try:
+			os.setpriority(os.PRIO_PROCESS, 0, int(nice))
+			profile.append(f'nice {nice}')
+		except OSError as ex:
+			jlog.error(f'rt: {role} nice {nice} refused: {ex}')
+
+	if role == 'skate' and args.rtlock and lockMemory(args.rtprefault):
+		profile.append(f'locked, {args.rtprefault} MB pre-faulted')
+
+	if profile:
+		jlog.info(f'rt: {role} {", ".join(profile)}')
+
+def reset(role):
+	# back to the affinity, policy and nice gcs was launched with
+	try:
+		os.sched_setaffinity(0, allcpus)
+	except OSError as ex:
+		jlog.error(f'rt: {role} affinity reset to {sorted(allcpus)} refused: {ex}')
+	policy = POLICIES.get(launchpolicy, launchpolicy)
+	try:
+		os.sched_setscheduler(0, launchpolicy, launchparam)
+	except OSError as ex:
+		jlog.error(f'rt: {role} reset to {policy} {launchparam.sched_priority} refused: {ex}')
+	try:
+		os.setpriority(os.PRIO_PROCESS, 0, launchnice)
+	except OSError as ex:
+		jlog.error(f'rt: {role} nice reset to {launchnice} refused: {ex}')
+	jlog.info(f'rt: {role} reset to cpus {sorted(allcpus)}, {policy}, nice {launchnice}')
+
+def lockMemory(mb):
+	libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	libc.mallopt(M_TRIM_THRESHOLD, -1)	# never trim the heap
+	libc.mallopt(M_MMAP_MAX, 0)		# large blocks from the heap too, not their own mmap
+	if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+		jlog.error(f'rt: mlockall refused: {os.strerror(ctypes.get_errno())}')
+		return False
+	ballast = bytearray(mb * 1024 * 1024)  # zero filled, every page touched
+	del ballast
+	return True
+
+# ----------------------------------------
+#    benchmark
+# ----------------------------------------
+
+def cvLoad(role, args, stop):
+	import cv2
+	cv2.setNumThreads(1)  # one cpu per load process
+	if args:
+		apply(role, args)
+	rng = np.random.default_rng()
+	photo = rng.integers(0, 255, (600, 600), dtype=np.uint8)
+	kernel = photo[280:320, 280:320].astype(np.float32)
+	while not stop.is_set():
+		gray = cv2.GaussianBlur(photo, (5, 5), 0).astype(np.float32)
+		cv2.matchTemplate(gray, kernel, cv2.TM_CCORR_NORMED)
+
+def measure(phase, seconds, hz):
+	# the skate main loop: wait on wake, or the frame time, whichever comes first
+	wake = threading.Event()
+	period = 1 / hz
+	tdue = time.perf_counter() + period
+	tlast = time.perf_counter()
+	tend = tlast + seconds
+	while tlast < tend:
+		wake.wait(max(0.0, tdue - time.perf_counter()))
+		t = time.perf_counter()
+		timing.record(f'late {phase}', max(0.0, t - tdue))
+		timing.record(f'jitter {phase}', abs(t - tlast - period))
+		tlast = t
+		tdue += period
+		if tdue < t:  # overran a whole period, start over from now
+			tdue = t + period
+
+def bench(args):
+	jlog.setup('rt   ', args.verbose, args.quiet, args.mediaout)
+	timing.setup('rtbench', args.mediaout, seconds=args.bench)
+	jlog.info(f'rt bench: {args.bench} s per phase, {args.hz} Hz loop, {args.load} load processes, cpus {sorted(allcpus)}')
+	for phase in ['default', 'profile']:
+		stop = multiprocessing.Event()
+		profile = args if phase == 'profile' else None
+		loads = [multiprocessing.Process(target=cvLoad, args=('awacs', profile, stop)) for i in range(args.load)]
+		for p in loads:
+			p.start()
+		if profile:
+			apply('skate', args)
+		time.sleep(1)  # let the load get going
+		measure(phase, args.bench, args.hz)
+		stop.set()
+		for p in loads:
+			p.join()
+		timing.dump()
+	timing.summary()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--verbose'  ,action='store_true'  ,help='verbose comments'                 )
+	parser.add_argument('--quiet'    ,action='store_true'  ,help='suppress all output'              )
+	parser.add_argument('--mediaout' ,default='.'          ,help='folder out for the log and histograms')
+	parser.add_argument('--bench'    ,default=30.0  ,type=float ,help='seconds per phase'           )
+	parser.add_argument('--load'     ,default=os.cpu_count() ,type=int ,help='synthetic CV load processes')
+	parser.add_argument('--hz'       ,default=20.0  ,type=float ,help='loop rate, as skate ui.fps'  )
+	setupArgParser(parser)
+	args = parser.parse_args()
+	bench(args)
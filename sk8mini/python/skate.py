@@ -48,18 +48,52 @@ sources
 	~/webapps/robots/robots/sk8mini/pilot
 		pilot.ino - helm and throttle implemented via espwebserver
 		pilot.py - manual piloting via keyboard as webserver client, using curses
+
+main loop, event-driven:
+	serial thread - blocking read, always holds the newest AHRS sample in sensor, sets wake
+		text or binary framing, see codec.py and --serialmode
+	photo thread  - waits on the photo event set by awacs after each publish, sets wake
+	writer thread - writes helm and throttle commands, paced to sendSettleTime
+		one pending slot per command, a newer value replaces an unsent one
+		throttle STOP goes out ahead of anything else pending
+		helm.set() and throttle.set() only post, they never wait on the serial port
+		while the gcs estop is set, it sends throttle STOP and holds it, even if the main thread is stuck
+	main thread   - waits on wake, or the UI frame time, whichever comes first
+		then pilot on a new photo, pause on a late photo, publish to the UI, poll UI keys
+		each pass beats the skate heartbeat, a pass longer than --deadline sets the estop, see gcs.py
+		the estop pauses the throttle, the first photo after it clears resumes
+	UI process    - arenaui.py, draws route and pose from smem_ui, sends keys back on a queue
+		the control loop never waits on matplotlib or png encoding
+
+time alignment:
+	every AHRS sample also goes into the AhrsRing, with its arrival time
+	photo.heading is the ring interpolated at the photo timestamp, the camera request time
+	wheelbase center and pilot heading error use photo.heading, not the latest sensor.heading
+
+reacquire:
+	a late photo pauses the throttle, the next photo resumes it
+	on resume, the cbase is projected onto every remaining line and arc of the route at once, see Route.nearest()
+	the pilot continues from the segment nearest in position and direction, instead of where it left off
+
+position estimator, --estimate:
+	between photos, the cbase is dead reckoned on each AHRS sample from heading and throttle speed
+	each donut fix corrects it, weighed against the prediction for photo time, Kalman style
+	the pilot then steers from the estimate and the current heading, up to --pilothz
+	without --estimate, the pilot steers once per photo, from the photo alone
 '''
 import signal
 import os
 import sys
 import serial
 import time
+import threading
+import multiprocessing
+import queue
 import argparse
 import traceback
 import random
+import collections
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import math
 import ast
 import re
@@ -68,12 +102,22 @@ import jlog
 import smem
 import specs
 import nav
+import codec
+import arenaui
+import rt
 
 # global shared inter-process memory
 gmem_timestamp = None
-gmem_positions = None
+gmem_telemetry = None  # smem.Telemetry, detection from awacs, pose and pilot state out
+gmem_photoevent = None  # multiprocessing.Event, set by awacs on each new photo
+gmem_ui = None  # multiprocessing.Array, route and pose for the arenaui process
+gmem_uikeys = None  # multiprocessing.Queue, keys from the arenaui process
+poseStage = np.zeros(1, dtype=smem.POSE_DTYPE)  # private records, filled then copied over the shared one, see smem.writeRecord
+pilotStage = np.zeros(1, dtype=smem.PILOT_DTYPE)
+
+wake = threading.Event()  # set by the serial and photo threads, the main loop waits on it
 args = None   # command-line arguments
-captains_log = []
+captains_log = collections.deque(maxlen=1000)  # newest pilot steps, all are in the log file
 
 def setupArgParser(parser):
 	# called by gcs.py before starting this process
@@ -81,16 +125,27 @@ def setupArgParser(parser):
 	parser.add_argument('--baud'           ,default=115200    ,type=int   ,help='serial baud rate'                 )
 	parser.add_argument('--serialtimeout'  ,default=3         ,type=int   ,help='serial timeout'                   )
 	parser.add_argument('--serialminbytes' ,default=10        ,type=int   ,help='serial minimum bytes before read' )
+	parser.add_argument('--serialmode'     ,default='auto'    ,choices=['auto','text','binary'],help='serial framing, see codec.py')
+	parser.add_argument('--ahrsring'       ,default=512       ,type=int   ,help='AHRS samples kept for time alignment')
+	parser.add_argument('--estimate'       ,action='store_true'           ,help='pilot from the position estimator, at sensor rate')
+	parser.add_argument('--pilothz'        ,default=20.0      ,type=float ,help='max pilot rate with --estimate'   )
+	parser.add_argument('--deadline'       ,default=0.5       ,type=float ,help='seconds, longest main loop pass before gcs stops the throttle')
+	parser.add_argument('--fixsigma'       ,default=2.0       ,type=float ,help='cm, std dev of a donut fix'       )
+	parser.add_argument('--drift'          ,default=4.0       ,type=float ,help='cm per sqrt second, dead reckoning drift')
+	parser.add_argument('--reacquireturn'  ,default=30.0      ,type=float ,help='cm, cost of facing against a segment, on reacquire')
 	parser.add_argument('--declination'    ,default=-1.11     ,type=float ,help='# from magnetic-declination.com'  )
 	parser.add_argument('--nocal'          ,action='store_true'           ,help='suppress calibration'             )
-	parser.add_argument('--novideo'        ,action='store_true'           ,help='suppress UI screen save'          )
+	parser.add_argument('--novideo'        ,action='store_true'           ,help='suppress arena video recording'    )
+	parser.add_argument('--noaerial'       ,action='store_true'           ,help='no live aerial photo under the arena')
 	parser.add_argument('--helmbias'       ,default=specs.helm_bias,type=int,help='helm value giving straight line')
 	parser.add_argument('--drawpretty'     ,action='store_true'           ,help='draw lines and arcs'              )
 	parser.add_argument('--drawnav'        ,action='store_true'           ,help='draw waypoints'                   )
 
 def setupObjectModel():
-	global  sensor, comm, helm, throttle, photo, arena, ui
+	global  sensor, ahrs, estimator, comm, helm, throttle, photo, arena, ui
 	sensor = Sensor()
+	ahrs = AhrsRing(args.ahrsring)
+	estimator = Estimator(args.fixsigma, args.drift)
 	comm = Comm()
 	helm = Helm()
 	throttle = Throttle()
@@ -143,6 +198,109 @@ class Pattern:
 		self.rdir = rdir
 		self.reps = reps
 
+class Route:
+	# the waypts compiled into arrays, segment i runs from waypt i-1 to waypt i
+	# the first segment of each mark is a line to its preentry point, the rest are arcs around the cone
+	NONE, LINE, ARC = 0, 1, 2
+
+	def __init__(self, waypts, marks):
+		n = len(waypts)
+		self.n = n
+		self.end = np.array(waypts, dtype=float).reshape(n, 2)
+		self.start = np.roll(self.end, 1, axis=0)
+		self.start[0] = self.end[0]
+		self.kind = np.full(n, self.NONE, dtype=np.int8)
+		self.kind[1:] = self.LINE
+		self.center = np.zeros((n, 2))
+		self.radius = np.zeros(n)
+		self.rdir = np.zeros(n, dtype=np.int8)	# +1 ccw, -1 cw, 0 line
+		self.tfrom = np.zeros(n)		# arc start theta
+		self.sweep = np.zeros(n)		# arc angle, in rdir, from start to end
+
+		for mark in marks:
+			lo = max(mark.firstwaypt+1, 1)
+			hi = min(mark.lastwaypt, n-1)
+			if hi < lo:
+				continue
+			ndx = np.arange(lo, hi+1)
+			rot = -1 if mark.rdir == 'cw' else 1
+			self.kind[ndx] = self.ARC
+			self.center[ndx] = mark.center
+			self.radius[ndx] = specs.turning_radius
+			self.rdir[ndx] = rot
+
+		arc = self.kind == self.ARC
+		d0 = self.start[arc] - self.center[arc]
+		d1 = self.end[arc] - self.center[arc]
+		self.tfrom[arc] = np.arctan2(d0[:,1], d0[:,0]) % math.tau
+		tto = np.arctan2(d1[:,1], d1[:,0]) % math.tau
+		self.sweep[arc] = ((tto - self.tfrom[arc]) * self.rdir[arc]) % math.tau
+
+		vec = self.end - self.start
+		self.length = np.hypot(vec[:,0], vec[:,1])
+		self.length[arc] = self.sweep[arc] * self.radius[arc]
+		self.unit = np.divide(vec, self.length[:,None], out=np.zeros_like(vec), where=self.length[:,None] > 0)
+		self.cumlen = np.cumsum(self.length)	# route length to the end of each segment
+
+	def progress(self, i, pt):
+		# cm along segment i, for an arc the angle travelled around the center, times the radius
+		if self.kind[i] == self.ARC:
+			c = self.center[i]
+			t = math.atan2(pt[1]-c[1], pt[0]-c[0])
+			nt = ((t - self.tfrom[i]) * self.rdir[i]) % math.tau
+			if nt > 5.5:  # just short of the start, not nearly all the way around
+				nt = 0.001
+			return nt * self.radius[i]
+		return (pt[0]-self.start[i][0]) * self.unit[i][0] + (pt[1]-self.start[i][1]) * self.unit[i][1]
+
+	def toGo(self, i, pt):
+		# cm from pt to the end of segment i, and to the end of the route
+		seg = max(0.0, self.length[i] - self.progress(i, pt))
+		return seg, seg + (self.cumlen[-1] - self.cumlen[i])
+
+	def nearest(self, pt, first, heading, turncost):
+		# project pt onto every segment from first on, in one pass, return the best segment and its distance
+		# score is the distance to the segment, plus turncost times how far the heading is from the segment direction there,
+		# 0 when aligned, turncost when opposite, plus 1 cm per meter of route skipped, so the nearest lap wins
+		ndx = np.arange(max(1, first), self.n)
+		if len(ndx) <= 0:
+			return first, float('inf')
+		p = np.asarray(pt, dtype=float)
+
+		# lines, clamped to the segment
+		start = self.start[ndx]
+		unit = self.unit[ndx]
+		along = np.clip(((p - start) * unit).sum(axis=1), 0, self.length[ndx])
+		proj = start + unit * along[:,None]
+		tangent = unit.copy()
+
+		# arcs, clamped to the nearer end
+		arc = self.kind[ndx] == self.ARC
+		if arc.any():
+			a = ndx[arc]
+			v = p - self.center[a]
+			nt = ((np.arctan2(v[:,1], v[:,0]) - self.tfrom[a]) * self.rdir[a]) % math.tau
+			past = nt > self.sweep[a]
+			nt[past] = np.where((nt - self.sweep[a]) < (math.tau - nt), self.sweep[a], 0)[past]
+			theta = self.tfrom[a] + nt * self.rdir[a]
+			cos, sin = np.cos(theta), np.sin(theta)
+			proj[arc] = self.center[a] + self.radius[a][:,None] * np.stack([cos, sin], axis=1)
+			tangent[arc] = self.rdir[a][:,None] * np.stack([-sin, cos], axis=1)
+
+		dist = np.hypot(p[0] - proj[:,0], p[1] - proj[:,1])
+		theta = nav.thetaFromHeading(heading)
+		align = tangent @ np.array([math.cos(theta), math.sin(theta)])
+		skipped = self.cumlen[ndx-1] - self.cumlen[ndx[0]-1]
+		score = dist + turncost * (1 - align) / 2 + skipped / 100
+		best = int(np.argmin(score))
+		return int(ndx[best]), float(dist[best])
+
+	def isPast(self, i, pt):
+		# close enough to the end of segment i to move on, on_mark_distance on a line, on_mark_theta on an arc
+		if self.kind[i] == self.ARC:
+			return (self.progress(i, pt) / self.radius[i]) + Arena.on_mark_theta > self.sweep[i]
+		return self.progress(i, pt) + Arena.on_mark_distance > self.length[i]
+
 class Arena:
 	gate = [0,0]	# start and finish point
 	cones = []	# list of points
@@ -152,6 +310,10 @@ class Arena:
 	ndxpattern = 0	# index into patterns, current pattern
 	ndxmark = 0	# index into marks, current mark
 	ndxwaypt = 0	# index into waypts, current waypt
+	route = None	# waypts compiled, see Route
+	patternoffset = 0	# continuous mode drops completed patterns, marks and waypts from the front of the lists
+	markoffset = 0		#   these count how many, so list index + offset is the index since the start
+	wayptoffset = 0
 	on_mark_distance = 8
 	on_mark_theta = 0.2
 	steady_helm_distance = 12
@@ -193,6 +355,16 @@ class Arena:
 		else:
 			kill('completed')
 	
+	def gotoWaypt(self, ndx):
+		# jump to waypt ndx, with the mark and pattern that contain it
+		self.ndxwaypt = max(1, min(ndx, len(self.waypts)-1))
+		lastwaypts = [mark.lastwaypt for mark in self.marks]
+		self.ndxmark = min(int(np.searchsorted(lastwaypts, self.ndxwaypt)), len(self.marks)-1)
+		lastwaypts = [pat.lastwaypt for pat in self.patterns]
+		self.ndxpattern = min(int(np.searchsorted(lastwaypts, self.ndxwaypt)), len(self.patterns)-1)
+		ui.wayptChanged = ui.markChanged = ui.patternChanged = True
+		jlog.info(f'gotoWaypt: {self.ndxwaypt}, mark {self.ndxmark}, pattern {self.ndxpattern}')
+
 	def firstCone(self, pos, heading):
 		def shortestAngleBetweenTwoHeadings(a,b): # cw or ccw
 			angle1 = ((a - b) + 360) % 360
@@ -230,7 +402,7 @@ class Arena:
 			conendxs = random.sample(allconendxs,  numcones)    # sample
 		
 			if len(self.marks) == 0:  # first-time
-				firstcone = self.firstCone(photo.cbase, sensor.heading)
+				firstcone = self.firstCone(photo.cbase, photo.heading)
 				if firstcone in conendxs:
 					conendxs.pop(conendxs.index(firstcone))
 				else:
@@ -282,8 +454,73 @@ class Arena:
 			pat.lastmark = len(self.marks) + len(marks)
 			self.marks += marks
 
-	def recalcWaypts(self):
+	def markWaypts(self, ndxmark, gatemark):
+		# entry, exit and waypts of one mark, which depend on the marks before and after
 		r = specs.turning_radius
+		waypts = []
+		mark = self.marks[ndxmark]
+
+		# calc entry and exit points for each mark
+		#   the two points define a common tangent line of the two circles
+		#   four solutions: two external, two internal, depending on rdirs
+		#   complicated problem involving matrix math
+		#   so, we use a simplified method, taking the perpendicular
+
+		prevmark = gatemark if ndxmark <= 0 else self.marks[ndxmark-1]
+		nextmark = gatemark if ndxmark+1 >= len(self.marks) else self.marks[ndxmark+1] 
+
+		A = prevmark.center
+		B = mark.center
+		L, R = nav.linePerpendicular(A, B, r)
+		entry = {
+			'L': L,
+			'R': R,
+		}
+		
+		A = nextmark.center
+		B = mark.center
+		L, R = nav.linePerpendicular(A,B,r)
+		exit = {
+			'L': L,
+			'R': R,
+		}
+		
+		if mark.rdir == 'cw':
+			mark.entry = entry['L']
+			mark.exit  = exit['R']
+		else:
+			mark.entry = entry['R']
+			mark.exit  = exit['L']
+	
+		# calc waypts for each mark
+		thetaEntry,_ = nav.thetaFromPoint(mark.entry, mark.center)
+		thetaExit,_ = nav.thetaFromPoint(mark.exit, mark.center)
+		thetaDiff = nav.lengthOfArcTheta(thetaEntry, thetaExit, mark.rdir)
+	
+		thetaPre = (thetaEntry + .5) % math.tau
+		thetaPost = (thetaExit - .5) % math.tau
+		if mark.rdir == 'ccw':
+			thetaPre = (thetaEntry - .5) % math.tau
+			thetaPost = (thetaExit + .5) % math.tau
+	
+		preentry = nav.pointFromTheta(mark.center, thetaPre, specs.turning_radius*1.5)
+		waypts.append( preentry)
+		n = int(thetaDiff/(math.pi/2))
+		thetaIncr = thetaDiff / (n+1)
+		for mult in range(1, n+1):
+			if mark.rdir == 'cw':
+				thetaEx = (thetaEntry - (thetaIncr*mult)) % math.tau
+			else:
+				thetaEx = (thetaEntry + (thetaIncr*mult)) % math.tau
+			intermediate = nav.pointFromTheta(mark.center, thetaEx, specs.turning_radius)
+			waypts.append( intermediate)
+	
+		postexit = nav.pointFromTheta(mark.center, thetaPost, specs.turning_radius*1.5)
+		waypts.append( postexit)
+
+		return waypts
+
+	def recalcWaypts(self):
 		gatemark = Mark.fromGate(self.gate)
 
 		firstwaypt = arena.currentPattern().firstwaypt
@@ -300,77 +537,69 @@ class Arena:
 
 			# loop thru marks in each pattern
 			for ndxmark in range(pat.firstmark, pat.lastmark):
-				waypts = []
 				mark = self.marks[ndxmark]
 				mark.firstwaypt = len(self.waypts)
-
-				# calc entry and exit points for each mark
-				#   the two points define a common tangent line of the two circles
-				#   four solutions: two external, two internal, depending on rdirs
-				#   complicated problem involving matrix math
-				#   so, we use a simplified method, taking the perpendicular
-
-				prevmark = gatemark if ndxmark <= 0 else self.marks[ndxmark-1]
-				nextmark = gatemark if ndxmark+1 >= len(self.marks) else self.marks[ndxmark+1] 
-
-				A = prevmark.center
-				B = mark.center
-				L, R = nav.linePerpendicular(A, B, r)
-				entry = {
-					'L': L,
-					'R': R,
-				}
-				
-				A = nextmark.center
-				B = mark.center
-				L, R = nav.linePerpendicular(A,B,r)
-				exit = {
-					'L': L,
-					'R': R,
-				}
-				
-				if mark.rdir == 'cw':
-					mark.entry = entry['L']
-					mark.exit  = exit['R']
-				else:
-					mark.entry = entry['R']
-					mark.exit  = exit['L']
-	
-				# calc waypts for each mark
-				thetaEntry,_ = nav.thetaFromPoint(mark.entry, mark.center)
-				thetaExit,_ = nav.thetaFromPoint(mark.exit, mark.center)
-				thetaDiff = nav.lengthOfArcTheta(thetaEntry, thetaExit, mark.rdir)
-	
-				thetaPre = (thetaEntry + .5) % math.tau
-				thetaPost = (thetaExit - .5) % math.tau
-				if mark.rdir == 'ccw':
-					thetaPre = (thetaEntry - .5) % math.tau
-					thetaPost = (thetaExit + .5) % math.tau
-	
-				preentry = nav.pointFromTheta(mark.center, thetaPre, specs.turning_radius*1.5)
-				waypts.append( preentry)
-				n = int(thetaDiff/(math.pi/2))
-				thetaIncr = thetaDiff / (n+1)
-				for mult in range(1, n+1):
-					if mark.rdir == 'cw':
-						thetaEx = (thetaEntry - (thetaIncr*mult)) % math.tau
-					else:
-						thetaEx = (thetaEntry + (thetaIncr*mult)) % math.tau
-					intermediate = nav.pointFromTheta(mark.center, thetaEx, specs.turning_radius)
-					waypts.append( intermediate)
-	
-				postexit = nav.pointFromTheta(mark.center, thetaPost, specs.turning_radius*1.5)
-				waypts.append( postexit)
-
-				self.waypts += waypts   # add these waypts to master list
+				self.waypts += self.markWaypts(ndxmark, gatemark)   # add these waypts to master list
 				mark.lastwaypt = len(self.waypts)-1  # last for the mark
 	
 			if (not self.continuous) and (ndxpat >= len(self.patterns)-1): # last time
 				self.waypts.append( gatemark.center)  # finish gate
 
 			pat.lastwaypt = len(self.waypts)-1  # last for the pattern
+		self.route = Route(self.waypts, self.marks)
+		ui.patternChanged = True
+
+	def extendRoute(self):
+		# continuous mode, append one random pattern
+		# of the existing waypts, only those of the last mark change, its exit now leads to the new first mark
+		gatemark = Mark.fromGate(self.gate)
+		ndxfrom = len(self.marks) - 1
+		ndxpat = len(self.patterns) - 1
+		self.addRandomPattern()
+
+		del self.waypts[self.marks[ndxfrom].firstwaypt:]
+		for ndxmark in range(ndxfrom, len(self.marks)):
+			mark = self.marks[ndxmark]
+			mark.firstwaypt = len(self.waypts)
+			self.waypts += self.markWaypts(ndxmark, gatemark)
+			mark.lastwaypt = len(self.waypts)-1
+		for pat in self.patterns[ndxpat:]:
+			pat.firstwaypt = self.marks[pat.firstmark].firstwaypt if pat.firstmark > ndxfrom else pat.firstwaypt
+			pat.lastwaypt = self.marks[pat.lastmark-1].lastwaypt
+
+		self.compact()
+		self.route = Route(self.waypts, self.marks)
 		ui.patternChanged = True
 
+	def compact(self):
+		# drop completed patterns, with their marks and waypts, keeping the marks the UI draws behind the skate
+		# indexes are rebased, the offsets count what was dropped
+		npat = 0
+		while npat < self.ndxpattern and self.patterns[npat].lastmark <= self.ndxmark - self.draw_nback - 1:
+			npat += 1
+		if npat <= 0:
+			return
+		nmark = self.patterns[npat].firstmark
+		nwaypt = self.patterns[npat].firstwaypt - 1  # keep the start point of the first segment
+		del self.patterns[:npat]
+		del self.marks[:nmark]
+		del self.waypts[:nwaypt]
+		for pat in self.patterns:
+			pat.firstmark -= nmark
+			pat.lastmark -= nmark
+			pat.firstwaypt -= nwaypt
+			pat.lastwaypt -= nwaypt
+		for mark in self.marks:
+			mark.firstwaypt -= nwaypt
+			mark.lastwaypt -= nwaypt
+		self.ndxpattern -= npat
+		self.ndxmark -= nmark
+		self.ndxwaypt -= nwaypt
+		self.patternoffset += npat
+		self.markoffset += nmark
+		self.wayptoffset += nwaypt
+		jlog.info(f'compact: dropped {npat} patterns, {nmark} marks, {nwaypt} waypts; kept {len(self.patterns)}, {len(self.marks)}, {len(self.waypts)}')
+
 class Sensor:
 	heading	= 9999.0
 	roll	= 0.0
@@ -381,6 +610,123 @@ class Sensor:
 	mag	= 0
 	t	= 0
 
+class AhrsRing:
+	# timestamped AHRS samples, newest overwrites oldest, written by the serial thread
+	T,HEADING,ROLL,PITCH,SYS,GYRO,ACCEL,MAG = range(8)
+
+	def __init__(self, size):
+		self.size = size
+		self.buf = np.zeros((size, 8), dtype=np.float64)
+		self.n = 0	# samples ever added, next write is at n % size
+		self.lock = threading.Lock()
+
+	def add(self, t, heading, roll, pitch, sys, gyro, accel, mag):
+		with self.lock:
+			self.buf[self.n % self.size] = (t, heading, roll, pitch, sys, gyro, accel, mag)
+			self.n += 1
+
+	def at(self, t):
+		# sample at time t, heading interpolated the short way around, others linear
+		# calibration values come from the nearer sample, outside the buffer the end sample is used
+		with self.lock:
+			count = min(self.n, self.size)
+			if count <= 0:
+				return None
+			first = (self.n - count) % self.size
+			order = (first + np.arange(count)) % self.size
+			times = self.buf[order, self.T]
+			i = int(np.searchsorted(times, t))
+			if i <= 0:
+				return self.buf[order[0]].copy()
+			if i >= count:
+				return self.buf[order[-1]].copy()
+			a = self.buf[order[i-1]]
+			b = self.buf[order[i]]
+			span = b[self.T] - a[self.T]
+			f = ((t - a[self.T]) / span) if span > 0 else 1.0
+			sample = (a if f < .5 else b).copy()
+			sample[self.T] = t
+			sample[self.HEADING] = (a[self.HEADING] + f * (((b[self.HEADING] - a[self.HEADING] + 180) % 360) - 180)) % 360
+			sample[self.ROLL] = a[self.ROLL] + f * (b[self.ROLL] - a[self.ROLL])
+			sample[self.PITCH] = a[self.PITCH] + f * (b[self.PITCH] - a[self.PITCH])
+			return sample
+
+	def headingAt(self, t):
+		sample = self.at(t)
+		return sensor.heading if sample is None else float(sample[self.HEADING])
+
+class Estimator:
+	# cbase position, dead reckoned at sensor rate, corrected by each donut fix
+	# a Kalman filter with position as the state and the fix as a direct measurement
+	GATE = 16.0		# squared mahalanobis distance, a fix further out resets the estimate
+	HISTORY = 256		# predictions kept, to compare a fix against where we thought we were at photo time
+
+	def __init__(self, fixsigma, drift):
+		self.R = np.eye(2) * fixsigma**2	# fix covariance, cm^2
+		self.q = drift**2			# process noise, cm^2 per second
+		self.pos = np.zeros(2)
+		self.P = np.eye(2) * 1e6
+		self.heading = 0.0
+		self.t = 0.0
+		self.ready = False	# no fix yet
+		self.history = collections.deque(maxlen=self.HISTORY)  # (t, pos, P)
+		self.nfix = 0
+		self.nreset = 0
+
+	def predict(self, t, heading, speed):
+		if not self.ready or t <= self.t:
+			return
+		dt = t - self.t
+		# chord of the arc turned since the last sample, at the mean of the two headings
+		turn = ((heading - self.heading + 180) % 360) - 180
+		midheading = (self.heading + turn/2) % 360
+		self.pos = nav.reckonLine(self.pos, midheading, speed * dt)
+		self.P = self.P + np.eye(2) * self.q * dt
+		self.heading = heading
+		self.t = t
+		self.history.append((t, self.pos.copy(), self.P.copy()))
+
+	def correct(self, fix, t, heading):
+		z = np.array(fix, dtype=float)
+		self.nfix += 1
+		if not self.ready:
+			self.reset(z, t, heading)
+			return
+
+		# the prediction for photo time, the last one at or before t
+		tp, pp, Pp = self.history[0] if self.history else (self.t, self.pos, self.P)
+		for h in self.history:
+			if h[0] > t:
+				break
+			tp, pp, Pp = h
+
+		innovation = z - pp
+		S = Pp + self.R
+		if innovation @ np.linalg.solve(S, innovation) > self.GATE:
+			jlog.info(f'estimator reset, fix {formatPoint(z)} vs predicted {formatPoint(pp)}')
+			self.nreset += 1
+			self.reset(z, t, heading)
+			return
+		K = Pp @ np.linalg.inv(S)
+		shift = K @ innovation
+		self.pos = self.pos + shift	# the fix moves everything predicted since photo time
+		self.P = self.P - K @ Pp	# keeps the drift added since photo time
+		for h in self.history:
+			if h[0] >= tp:
+				h[1][:] += shift
+
+	def reset(self, z, t, heading):
+		self.pos = z.copy()
+		self.P = self.R.copy()
+		self.heading = heading
+		self.t = t
+		self.ready = True
+		self.history.clear()
+		self.history.append((t, self.pos.copy(), self.P.copy()))
+
+	def estimate(self):
+		return self.pos.copy(), self.P.copy()
+
 class Helm:
 	helm = 0
 	biased_helm = 0
@@ -392,19 +738,13 @@ class Helm:
 		self.helm = val
 		self.biased_helm = min(90, max(-90, self.helm + args.helmbias))
 		self.t = time.time()
-		comm.sendCommand(comm.HELM, self.biased_helm)
+		comm.post(comm.HELM, self.biased_helm)
 
 	def incStarboard(self):
-		self.helm = val + self.incr
-		self.biased_helm = min(90, max(-90, self.helm + args.helmbias))
-		self.t = time.time()
-		comm.sendCommand(comm.HELM(self.biased_helm))
+		self.set(self.helm + self.incr)
 
 	def incPort(self):
-		self.helm = val - self.incr
-		self.biased_helm = min(90, max(-90, self.helm + args.helmbias))
-		self.t = time.time()
-		comm.sendCommand(comm.HELM(self.biased_helm))
+		self.set(self.helm - self.incr)
 
 class Throttle:
 	throttle = 0
@@ -419,24 +759,29 @@ class Throttle:
 		self.throttle = max(0, min(self.FULL, val))
 		self.right_throttle = self.throttle # * rudder factor
 		self.t = time.time()
-		comm.sendCommand(comm.THROTTLE, self.right_throttle)
+		comm.post(comm.THROTTLE, self.right_throttle)
 	def isPaused(self): 
 		return self.paused
 	def pause(self): 
 		self.paused = True
-		comm.sendCommand(comm.THROTTLE, self.STOP)
+		comm.post(comm.THROTTLE, self.STOP)
 	def unpause(self): 
 		self.paused = False
-		comm.sendCommand(comm.THROTTLE, self.CRUISE)
+		comm.post(comm.THROTTLE, self.CRUISE)
 
 class Photo:
 	MAXTIME = 3.0 # seconds
 	donut = [0,0]
 	cbase = [0,0]
 	cones = [0,0]
+	heading = 0.0	# AHRS heading at time t
+	resumed = False	# first photo after a late photo paused the throttle
+	togo = 0.0	# cm to the end of the route, from the pilot
 	t = 0.0
-	def hasNewPhoto(self): return (gmem_timestamp[smem.TIME_PHOTO] > self.t)
-	def isPhotoLate(self): return (gmem_timestamp[smem.TIME_PHOTO] <= self.t) and ((time.time() - self.t) > self.MAXTIME)
+	seq = 0		# detection record last read
+	snap = np.zeros(1, dtype=smem.DETECTION_DTYPE)  # reused by getPhoto()
+	def hasNewPhoto(self): return (smem.recordSeq(gmem_telemetry.detection) != self.seq)
+	def isPhotoLate(self): return (not self.hasNewPhoto()) and ((time.time() - self.t) > self.MAXTIME)
 
 # ----------------------------------------
 #    comm
@@ -447,55 +792,154 @@ class Comm:
 	sendSettleTime = .2  # .9 fails  timeout on the read side?
 	tsend = 0.0
 	serial_port = False	# instantiation of Serial object
+	decoder = codec.Decoder('text')  # replaced in connectSerial() per --serialmode
 	HELM	= 1 # val = -90 to +90, negative:port, positive:starboard, zero:amidships
 	THROTTLE= 2 # val = -90 to +90, negative:astern, positive:ahead, zero:stop
 
+	# writer thread, one latest-value slot per command
+	pending = {}	# cmd: value, not yet written
+	cond = threading.Condition()
+	writing = False
+	nposted = 0
+	nsent = 0
+	ncoalesced = 0	# replaced in its slot by a newer value before it was written
+	ndropped = 0	# still pending at shutdown
+	estopped = False	# the writer is holding throttle STOP for the gcs estop
+	nrecverrors = 0	# sensor messages that decoded, but failed in recvSensor()
+	estopPoll = .1	# seconds, the writer checks the estop at least this often
+
 	def connectSerial(self):
 		try:
 			self.serial_port = serial.Serial(port=args.port, baudrate=args.baud, timeout=args.serialtimeout)
 		except:
 			return False
 		time.sleep(self.openSettleTime)  # why?
+		self.decoder = codec.Decoder(args.serialmode)
 		return True
 
 	def sendCommand(self, cmd, value):
+		data = codec.encodeCommand(cmd, value, self.decoder.mode)
 		if self.serial_port and self.serial_port.isOpen():
 			settleTime = self.sendSettleTime - (time.time() - self.tsend)
 			if settleTime > 0:
 				time.sleep(settleTime)
-			s = f'{cmd}\t{value}\n' 
-			self.serial_port.write(bytes(s, 'utf-8'))
+			self.serial_port.write(data)
 			self.tsend = time.time()
-			jlog.debug(f'command sent to sk8: {s.strip()}')
+			jlog.debug(f'command sent to sk8: {cmd} {value}')
 		else:
-			jlog.debug(f'command not sent, no serial port: {s.strip()}')
-
-	def recvSensor(self):
-		lst = [1,2]
-		if len(lst) != 7:
-			comm.serial_port.reset_input_buffer() # make sure we get the latest message
-			b = comm.serial_port.readline()	# serial read to \n or timeout, whichever comes first
-			s = b.decode("utf-8")	# to tab-separated string
-			lst = s.split()		# parse into object
-			if len(lst) != 7:
-				jlog.info(f'incomplete serial sensor message ignored {len(lst)}')
-				return
-	
-		sensor.heading	= float( lst[0])
-		sensor.roll	= float( lst[1])
-		sensor.pitch	= float( lst[2])
-		sensor.sys	= int( lst[3])
-		sensor.gyro	= int( lst[4])
-		sensor.accel	= int( lst[5])
-		sensor.mag	= int( lst[6])
+			jlog.debug(f'command not sent, no serial port: {cmd} {value}')
+
+	def post(self, cmd, value):  # any thread, never blocks
+		if not self.writing:
+			self.sendCommand(cmd, value)
+			return
+		with self.cond:
+			self.nposted += 1
+			if cmd in self.pending:
+				self.ncoalesced += 1
+			self.pending[cmd] = value
+			self.cond.notify()
+
+	def nextCommand(self):  # with cond held
+		if self.pending.get(self.THROTTLE) == Throttle.STOP:
+			cmd = self.THROTTLE	# stop pre-empts everything
+		else:
+			cmd = next(iter(self.pending))	# oldest slot first
+		value = self.pending.pop(cmd)
+		if cmd == self.THROTTLE and self.estopped:
+			value = Throttle.STOP
+		return cmd, value
+
+	def checkEstop(self):  # with cond held, writer thread
+		if isEstopped() and not self.estopped:
+			self.estopped = True
+			self.nposted += 1
+			self.pending[self.THROTTLE] = Throttle.STOP
+			jlog.error('estop: throttle stop, the main loop missed its deadline')
+		elif self.estopped and not isEstopped():
+			self.estopped = False
+			jlog.info('estop cleared')
+		return bool(self.pending)
+
+	def startWriter(self):
+		self.writing = True
+		self.writer = threading.Thread(target=self.writeLoop, name='writer', daemon=True)
+		self.writer.start()
+
+	def stopWriter(self, timeout=2.0):  # flush what is pending, then stop
+		with self.cond:
+			self.writing = False
+			self.cond.notify()
+		self.writer.join(timeout)
+		with self.cond:
+			self.ndropped += len(self.pending)
+			self.pending.clear()
+		jlog.info(f'commands posted:{self.nposted}, sent:{self.nsent}, coalesced:{self.ncoalesced}, dropped:{self.ndropped}')
+
+	def writeLoop(self):  # writer thread
+		while True:
+			with self.cond:
+				while not self.checkEstop() and self.writing:  # the estop is checked even on the final flush
+					self.cond.wait(self.estopPoll)
+				if not self.pending:
+					break
+				cmd, value = self.nextCommand()
+			try:
+				self.sendCommand(cmd, value)  # paces itself to sendSettleTime
+			except Exception as ex:
+				with self.cond:
+					self.writing = False  # post() sends directly again, nothing waits on a dead writer
+					self.ndropped += 1
+				if not isKilled():
+					kill(f'serial write error {ex}')
+				break
+			self.nsent += 1
+
+	def startReader(self):
+		threading.Thread(target=self.readLoop, name='serial', daemon=True).start()
+
+	def readLoop(self):  # serial thread
+		nbad = 0
+		while not isKilled():
+			try:
+				data = self.serial_port.read(max(1, self.serial_port.in_waiting))  # at least one byte, or timeout
+			except Exception as ex:
+				if not isKilled():
+					kill(f'serial read error {ex}')
+				break
+			try:
+				samples = self.decoder.feed(data)
+				if samples:
+					self.recvSensor(samples[-1])  # only the newest matters
+					wake.set()
+			except Exception as ex:  # one bad sample must not end the serial thread
+				self.nrecverrors += 1
+				jlog.error(f'serial sensor message failed, {self.nrecverrors} so far: {ex}')
+			if self.decoder.nbad > nbad:
+				nbad = self.decoder.nbad
+				jlog.info(f'bad serial sensor message ignored, {nbad} so far, mode {self.decoder.mode}')
+
+	def recvSensor(self, sample):
+		sensor.heading, sensor.roll, sensor.pitch, sensor.sys, sensor.gyro, sensor.accel, sensor.mag = sample
 		sensor.t	= time.time()
-		jlog.debug(f'lenstr:{len(b)}, lenlst:{len(lst)}, heading:{sensor.heading:.2f}, roll:{sensor.roll:.2f}, gyro:{sensor.gyro}, mag:{sensor.mag}')
+		jlog.debug(f'mode:{self.decoder.mode}, heading:{sensor.heading:.2f}, roll:{sensor.roll:.2f}, gyro:{sensor.gyro}, mag:{sensor.mag}')
 	
 		# the BRO055 does NOT adjust for magnetic declination, so we do that here
 		adjheading = sensor.heading + args.declination
 		if adjheading < 0:
 			adjheading = (360 - adjheading)
 		sensor.heading = adjheading
+		ahrs.add(sensor.t, sensor.heading, sensor.roll, sensor.pitch, sensor.sys, sensor.gyro, sensor.accel, sensor.mag)
+
+def photoLoop():  # photo thread
+	while not isKilled():
+		if gmem_photoevent.wait(timeout=1):
+			gmem_photoevent.clear()
+			wake.set()
+
+def waitForEvent(timeout):
+	wake.wait(timeout)
+	wake.clear()
 
 # ----------------------------------------
 #    navigator - choreographer
@@ -504,29 +948,29 @@ class Comm:
 def formatPoint(pt):
 	return f'[{pt[0]:.2f}, {pt[1]:.2f}]'
 
-def calcCenterWheelbase(donut):
-	theta = nav.thetaFromHeading((sensor.heading + helm.helm + 180) % 360)
+def calcCenterWheelbase(donut, heading):
+	theta = nav.thetaFromHeading((heading + helm.helm + 180) % 360)
 	cbase = nav.pointFromTheta( donut, theta, specs.helm_length)
-	jlog.info(f'calcCenterWheelBase {sensor.heading:.2f} {helm.helm:.2f}; {theta:.2f}, {formatPoint(donut)}, {formatPoint(cbase)}')
+	jlog.info(f'calcCenterWheelBase {heading:.2f} {helm.helm:.2f}; {theta:.2f}, {formatPoint(donut)}, {formatPoint(cbase)}')
 	# we should also apply the helm_offset and roll_y_offset
 	return cbase
 
 def getPhoto():  # get positions of donut, cones from shared memory, calc cbase position
-	photo.donut = specs.awacs2skate([gmem_positions[smem.DONUT_X], gmem_positions[smem.DONUT_Y]])
-	photo.cbase = calcCenterWheelbase(photo.donut)
-	photo.cones = getCones()
-	photo.t = gmem_timestamp[smem.TIME_PHOTO]
+	snap = smem.readRecord(gmem_telemetry.detection, photo.snap)  # one consistent copy of the whole record
+	photo.seq = int(snap['seq'][0])
+	photo.t = float(snap['t'][0])  # camera request time
+	photo.heading = ahrs.headingAt(photo.t)
+	photo.donut = specs.awacs2skate(snap['donut'][0].tolist())
+	photo.cbase = calcCenterWheelbase(photo.donut, photo.heading)
+	photo.cones = getCones(snap)
 	ui.cbaseChanged = True
+	telemetryPose(photo.t, photo.cbase, photo.heading, None)
 
-def getCones():
+def getCones(snap):
 	cones = []
-	numcones = gmem_positions[smem.NUM_CONES]
-	pos = smem.CONE1_X
-	for i in range(numcones):
-		pt = [gmem_positions[pos], gmem_positions[pos+1]]
+	for pt in snap['cones'][0][:snap['numcones'][0]].tolist():
 		cone = specs.awacs2skate(pt)
 		cones.append(cone)
-		pos += 2
 	return list(sorted(cones))
 	
 def parsePatternLine(line):
@@ -639,38 +1083,6 @@ def configArena():
 #    pilot
 # ----------------------------------------
 
-def normalizeTheta(tfrom, tto, tat, rdir):
-	tcirc = 2*np.pi
-	if rdir == 'ccw':
-		ntat = (tat - tfrom) % tcirc
-		ntto = (tto - tfrom) % tcirc
-	elif rdir == 'cw':
-		ntat = tcirc - ((tat - tfrom) % tcirc)
-		ntto = tcirc - ((tto - tfrom) % tcirc)
-	if ntat > 5.5:
-		ntat = 0.001
-	return ntat, ntto
-
-def isOnMark(cbase, ndxwaypt):
-	onmark = False
-	mark = arena.currentMark()
-	if ndxwaypt == mark.firstwaypt: # shape line
-		tot = nav.lengthOfLine(arena.waypts[ndxwaypt], arena.waypts[ndxwaypt-1])
-		sofar = nav.lengthOfLine(cbase, arena.waypts[ndxwaypt-1])
-		onmark = (sofar+arena.on_mark_distance) > tot
-		jlog.info(f'isonmark line {onmark} {tot} {sofar}')
-
-	else: # shape arc
-		ctr = mark.center
-		tbase,_ = nav.thetaFromPoint(cbase, ctr)
-		tto,_ = nav.thetaFromPoint(arena.waypts[ndxwaypt], ctr)
-		tfrom,_ = nav.thetaFromPoint(arena.waypts[ndxwaypt-1], ctr)
-		ntbase,ntto = normalizeTheta(tfrom, tto, tbase, mark.rdir)
-		onmark = (ntbase+arena.on_mark_theta) > ntto
-		jlog.info(f'isonmark arc {onmark} {arena.waypts[ndxwaypt]}, tfrom:{tfrom} tbase:{tbase} tto:{tto} rdir:{mark.rdir}')
-	jlog.info(f'isonmark {ndxwaypt} {arena.ndxmark} {mark.firstwaypt}') 
-	return onmark
-
 def helmPid(error):  # pid control of steering
 	# see https://docs.google.com/spreadsheets/d/1oKY4mz-0K-BwVNZ7Tu-k9PsOq_LeORR270-ICXyz-Rw/edit#gid=0
 	jlog.debug('helm PID')
@@ -722,273 +1134,187 @@ def pilot():
 	# get new position
 	if photo.hasNewPhoto():	
 		getPhoto()
+		if args.estimate:
+			estimator.correct(photo.cbase, photo.t, photo.heading)
 
 	if not throttle.autopilot:
 		return
 
+	# position and heading both as of photo.t, or as of now from the estimator
+	if args.estimate and estimator.ready:
+		cbase, P = estimator.estimate()
+		heading = sensor.heading
+		telemetryPose(estimator.t, cbase, heading, P)
+	else:
+		cbase, P = photo.cbase, None
+		heading = photo.heading
+
+	# after a dropout, pick up the route from wherever the skate is now
+	route = arena.route
+	if photo.resumed:
+		photo.resumed = False
+		reacquire(cbase, heading)
+
 	# on rounding mark
-	if isOnMark(photo.cbase, arena.ndxwaypt):
+	if route.isPast(arena.ndxwaypt, cbase):
 		arena.nextWaypt()
+	segtogo, togo = route.toGo(arena.ndxwaypt, cbase)
+	photo.togo = togo
 
 	# stay on course
 	#elif sofar > (tot - arena.steady_helm_distance):
-	bearing = nav.headingOfLine(photo.cbase, arena.waypts[arena.ndxwaypt])
-	error = bearing - sensor.heading
+	bearing = nav.headingOfLine(cbase, route.end[arena.ndxwaypt])
+	error = bearing - heading
 	if error > 180:
 		error -= 360
 	if error < -180:
 		error += 360
 	helm_adj = helmPid( error)
-	jlog.info(f'pilot: new helm line:{helm_adj}, err:{error}, bearing:{bearing}, heading:{sensor.heading}')
+	sigma = f', sigma:{math.sqrt(np.trace(P)):.2f}' if P is not None else ''
+	jlog.info(f'pilot: new helm line:{helm_adj}, err:{error}, bearing:{bearing}, heading:{heading:.2f}{sigma}, waypt:{arena.ndxwaypt}, segtogo:{segtogo:.1f}, togo:{togo:.1f}')
 	helm.set( helm_adj)
+	pilot.t = time.time()
+	telemetryPilot(bearing, error, segtogo, togo)
 
 	caplog()
 
 	#if arena.continuous and (arena.ndxwaypt >= len(arena.waypts))-3:
 	if arena.continuous and (arena.ndxpattern >= len(arena.patterns)-1):
-		arena.addRandomPattern() 
-		arena.recalcWaypts() 
+		arena.extendRoute()
+pilot.t = 0.0  # last steering update
+
+def reacquire(cbase, heading):
+	ndx, dist = arena.route.nearest(cbase, arena.ndxwaypt, heading, args.reacquireturn)
+	jlog.info(f'reacquire: cbase {formatPoint(cbase)}, heading {heading:.2f}, waypt {arena.ndxwaypt} to {ndx}, {dist:.1f} cm off route')
+	if ndx != arena.ndxwaypt:
+		arena.gotoWaypt(ndx)
+
+def telemetryPose(t, cbase, heading, P):
+	stage = poseStage
+	stage['t'] = t
+	stage['cbase'] = cbase
+	stage['heading'] = heading
+	stage['sigma'] = math.sqrt(np.trace(P)) if P is not None else 0.0
+	stage['estimated'] = P is not None
+	smem.writeRecord(gmem_telemetry.pose, stage)
+
+def telemetryPilot(bearing, error, segtogo, togo):
+	stage = pilotStage
+	stage['t'] = pilot.t
+	stage['ndxwaypt'] = arena.wayptoffset + arena.ndxwaypt
+	stage['bearing'] = bearing
+	stage['error'] = error
+	stage['segtogo'] = segtogo
+	stage['togo'] = togo
+	stage['helm'] = helm.helm
+	stage['throttle'] = throttle.throttle
+	stage['autopilot'] = throttle.autopilot
+	stage['paused'] = throttle.isPaused()
+	smem.writeRecord(gmem_telemetry.pilot, stage)
+
+def predictPosition():  # dead reckon to the newest sensor sample
+	speed = 0.0 if throttle.isPaused() else specs.speedFromThrottle(throttle.throttle)
+	estimator.predict(sensor.t, sensor.heading, speed)
 
 # ----------------------------------------
 #    UI
 # ----------------------------------------
 
 class UI:
-	fig = None
-	ax = None
-	skateline = None
-	wayline = None
-	nextline = None
-	cones = []
-	conerings = []
-	conetexts = []
-	legs = []
 	conesChanged = True
 	cbaseChanged = True
 	wayptChanged = True
 	markChanged = True
 	patternChanged = True
-	t = 0.0
-	eventkey = False
-	fps = 0
-	delay = 0
-	PAUSE = .001
-	fname = ''
-
-def onpress(event):
-	ui.eventkey = event.key
-
-def startUI():
-	ui.fps = 20
-	ui.delay = 1/ui.fps  # .05
-	ui.fname = f'{args.mediaout}/arena_%timestamp%.png'
-
-	# setup artists
-	ui.fig = plt.figure()
-	ui.ax = ui.fig.add_axes((0,0,1,1))
-
-	plt.xlim(-132,+132)
-	plt.ylim(-132,+132)
-
-	plt.autoscale(False)  # if True it will adapt x,ylim to the data
-	plt.tick_params(left=False, right=False, labelleft=False, labelbottom= False, bottom=False)
-	ui.ax.set_aspect('equal', anchor='C')  # keep fixed aspect ratio on window resize
-
-	plt.tick_params(left=False, right=False, labelleft=False, labelbottom= False, bottom=False)
-	plt.tick_params(axis='x', which='both', bottom=False, top=False, labelbottom=False) 
-	plt.tick_params(axis='y', which='both', right=False, left=False, labelleft=False) 
-
-	ui.fig.set_size_inches(6,6)  # savefig with dpi=100, for a 600x600 image to match aerial
-	mpl.rcParams['savefig.dpi'] = 100
-	mpl.rcParams['savefig.pad_inches'] = 0.0
-	mpl.rcParams['savefig.transparent'] = True
-	mpl.rcParams['savefig.bbox'] = 'tight'
-
-	ui.fig.canvas.mpl_connect('key_press_event', onpress) # keypress event handler
-
-	# cones in cone order left to right
-	for pt in arena.cones:
-		circ = plt.Circle(pt, specs.cone_diameter/2, color='y')
-		ui.ax.add_artist(circ)
-		ui.cones.append(circ)
-		if args.drawnav:
-			circ = plt.Circle(pt, specs.turning_radius, fill=False, color='y')
-			ui.ax.add_artist(circ)
-			ui.conerings.append(circ)
-		textnum = str(len(ui.cones)) # left to right
-		t = plt.text(pt[0], pt[1], textnum, fontsize='12', ha='center', va='center', color='black')
-		ui.conetexts.append(t)
-		ui.conesChanged = True
-		
-	# line connecting waypoints
-	wp_linestyle = ''
-	wp_marker = ''
-	wp_color = 'g'
-	hi_linestyle = ''
-	hi_marker = ''
-	hi_color = 'r'
-	if args.drawnav:
-		wp_linestyle = '-'
-		wp_marker = '.'
-		hi_linestyle = '-'
-		hi_marker = '.'
-	x,y = np.array(arena.waypts).T
-	ui.nextline, = ui.ax.plot(x,y, linestyle=wp_linestyle, marker=wp_marker, color=wp_color, linewidth=.5)
-	ui.wayline, = ui.ax.plot(x,y, linestyle=wp_linestyle, marker=wp_marker, color=wp_color)
-	ui.hiway, = ui.ax.plot([0,0],[0,0], linestyle=hi_linestyle, marker=hi_marker, color=hi_color)
-
-	# pretty legs
-	if args.drawpretty:
-		# one leg for each mark to be displayed.  each leg has one line and one arc.
-		dia = specs.turning_radius * 2
-		if arena.continuous:
-			numlegs = arena.draw_nback + arena.draw_nahead + 1
-		else:
-			numlegs = len(arena.marks) + 1
-		for i in range(numlegs):
-			leg = {}
-			leg['line'], = plt.plot([0,0], [0,0], color='blue', lw=1) # returns list of line2D objects
-			leg['arc'] = mpl.patches.Arc([0,0], dia, dia, 0, 0, 0, color='blue')
-			ui.ax.add_patch(leg['arc'])
-			ui.legs.append(leg)
-
-	# sprite
-	ui.sprite = mpl.patches.Polygon(specs.skateSprite, facecolor='none', edgecolor='black')
-	ui.ax.add_patch(ui.sprite)
-
-	# donut
-	ui.donutouter = plt.Circle(photo.donut, specs.donut_outer_dia/2, facecolor='white', edgecolor='black')
-	ui.donutinner = plt.Circle(photo.donut, specs.donut_inner_dia/2, color='magenta')
-	ui.ax.add_artist(ui.donutouter)
-	ui.ax.add_artist(ui.donutinner)
-
-	# gate
-	w = arena.on_mark_distance
-	h = arena.on_mark_distance
-	anchor = (photo.cbase[0]-(w/2), photo.cbase[1]-(h/2))
-	ui.gate = plt.Rectangle(anchor, w, h, color='black', fill=False)
-	ui.ax.add_artist(ui.gate)
-
+	fps = 20
+	delay = 1/fps  # .05, main loop wakes at least this often to poll keys
+	process = None
+	mem = None	# numpy view of smem_ui
+	version = 0
+
+def startUI():  # start the arenaui process, publish the arena
+	ui.process = multiprocessing.Process(target=arenaui.ui_main, args=(args, gmem_timestamp, gmem_telemetry, gmem_ui, gmem_uikeys, jlog.timestart))
+	ui.process.start()
+	ui.conesChanged = True
 	ui.cbaseChanged = True
 
-def refreshUI():
-	if time.time() - ui.t >= ui.delay:  # slow down to desired fps
-		jlog.debug(f'inside refresuUI, {ui.conesChanged}, {ui.cbaseChanged}, {ui.wayptChanged}, {ui.patternChanged}')
-
-		# first, adjust the data that defines the shape
-		# second, call plt.pause() which does the drawing
-		if ui.conesChanged:
-			i = 0
-			for i in range(len(ui.cones)):
-				ui.cones[i].center = arena.cones[i]
-				if args.drawnav:
-					ui.conerings[i].center = arena.cones[i]
-				ui.conetexts[i]._x = arena.cones[i][0]
-				ui.conetexts[i]._y = arena.cones[i][1]
-			ui.conesChanged = False
-	
-		if ui.patternChanged and args.drawnav:
-			pat = arena.currentPattern()
-			firstpoint = pat.firstwaypt
-			if arena.ndxpattern == 0:
-				firstpoint = 0 # back up from 1 to 0 to start at gate
-			points = arena.waypts[firstpoint:pat.lastwaypt+2]
-			points = np.transpose(points) 
-			ui.wayline.set_data(points)
-
-			pat = arena.nextPattern()
-			if pat:
-				points = arena.waypts[pat.firstwaypt:pat.lastwaypt+2]
-				points = np.transpose(points) 
-			else:
-				points = [[0,0],[0,0]]
-			ui.nextline.set_data(points)
-			ui.patternChanged = False
-
-		if ui.markChanged and args.drawpretty:
-			if arena.continuous:
-				lastmark = arena.ndxmark + arena.draw_nahead
-				firstmark= arena.ndxmark - arena.draw_nback
-			else:
-				lastmark = len(arena.marks)-1
-				firstmark= 0
-
-			numlegs = lastmark - firstmark
-			firstmark = max(0, firstmark)
-			lastmark = min(lastmark, len(arena.marks)-1)
-
-			i = 0
-			for ndxmark in range(firstmark,lastmark+1):
-				if ndxmark == 0:
-					A = arena.gate
-				else:
-					A = arena.marks[ndxmark-1].exit
-				B = arena.marks[ndxmark].entry
-				xd,yd = np.transpose([A,B]); 
-				ui.legs[i]['line'].set_data(xd,yd)
-
-				mark = arena.marks[ndxmark]
-				C = mark.center
-				t1,_ = nav.thetaFromPoint(mark.entry,C)
-				t2,_ = nav.thetaFromPoint(mark.exit,C)
-				if mark.rdir == 'cw':
-					t2,t1 = (t1, t2)  # reverse (mpl.Arc draws ccw)
-					if t1 == t2:
-						t2 -= .001  # avoid full circle
-				ui.legs[i]['arc'].center = C
-				ui.legs[i]['arc'].theta1 = math.degrees(t1)
-				ui.legs[i]['arc'].theta2 = math.degrees(t2)
-
-				i += 1
-
-			# one more line from prev exit to gate, if not continuous
-			if not arena.continuous:
-				A = arena.marks[ndxmark].exit
-				B = arena.gate
-				xd,yd = np.transpose([A,B]); 
-				ui.legs[i]['line'].set_data(xd,yd)
-
-			ui.markChanged = False
-	
-		if ui.wayptChanged:
-			end = max(0, arena.ndxwaypt)
-			end = min(end, len(arena.waypts)-1)
-			start = end
-
-			if args.drawnav:
-				start = max(0, end-1)
-
-			hiway = np.transpose([arena.waypts[start], arena.waypts[end]])
-			ui.hiway.set_data(hiway)
-			ui.wayptChanged = False
-
-		if ui.cbaseChanged:
-			# sprite
-			r = mpl.transforms.Affine2D().rotate_deg(360-sensor.heading)
-			t = mpl.transforms.Affine2D().translate(photo.cbase[0], photo.cbase[1])
-			tra = r + t + ui.ax.transData
-			ui.sprite.set_transform(tra)
-
-			# donut
-			ui.donutinner.center = photo.donut
-			ui.donutouter.center = photo.donut
-
-			ui.cbaseChanged = False
-
-			if not args.novideo:
-				timestamp = time.time()
-				stime = f'{jlog.selapsed()}'.replace('.','_')
-				fname = f'{args.mediaout}/{stime}.png'
-				ui.fig.savefig(fname)
-				jlog.debug(f'UI: screen capture {fname}')
-
-		ui.t = time.time()
-
-	plt.pause(ui.PAUSE)  # redraw and time.sleep()
-
-def respondToKeyboard():
-	key = ui.eventkey
-	ui.eventkey = False
+def stopUI():
+	if ui.process:
+		ui.process.join(timeout=3)
+		if ui.process.is_alive():  # else the multiprocessing atexit join would hang skate, and gcs with it
+			jlog.error('ui did not exit, terminate')
+			ui.process.terminate()
+			ui.process.join(timeout=1)
+
+def publishRoute():
+	# copy the window of the route the UI draws into smem_ui
+	mem = ui.mem
+	numcones = min(len(arena.cones), smem.MAX_CONES)
+
+	if arena.continuous:
+		firstmark = max(0, arena.ndxmark - arena.draw_nback)
+		lastmark = min(arena.ndxmark + arena.draw_nahead, len(arena.marks)-1)
+	else:
+		firstmark = 0
+		lastmark = len(arena.marks)-1
+	markbase = max(0, firstmark-1)  # the leg into firstmark starts at the exit of the mark before
+	lastmark = min(lastmark, markbase + smem.MAX_UI_MARKS - 1)
+	nummarks = max(0, lastmark - markbase + 1)
+
+	pat = arena.currentPattern() if arena.patterns else None
+	nextpat = arena.nextPattern() if arena.patterns else False
+	firstpoint = 0 if (not pat or arena.ndxpattern == 0) else pat.firstwaypt  # back up from 1 to 0 to start at gate
+	base = max(0, min(firstpoint, arena.ndxwaypt-1))
+	numwaypts = max(0, min(len(arena.waypts) - base, smem.MAX_UI_WAYPTS))
+	def local(ndx): return max(-1, min(ndx - base, numwaypts-1))
+
+	with gmem_ui.get_lock():
+		mem[smem.UI_CONTINUOUS] = 1 if arena.continuous else 0
+		mem[smem.UI_GATE_X:smem.UI_GATE_Y+1] = arena.gate
+		mem[smem.UI_GATE_SIZE] = arena.on_mark_distance
+		mem[smem.UI_NUM_CONES] = numcones
+		if numcones:
+			mem[smem.UI_CONES:smem.UI_CONES+numcones*2] = np.ravel(arena.cones[:numcones])
+		mem[smem.UI_NUM_MARKS] = nummarks
+		mem[smem.UI_MARK_BASE] = arena.markoffset + markbase
+		mem[smem.UI_MARK_FIRST] = arena.markoffset + firstmark
+		for i in range(nummarks):
+			mark = arena.marks[markbase+i]
+			ndx = smem.UI_MARKS + i*smem.MARK_SIZE
+			mem[ndx:ndx+6] = [*mark.center, *mark.entry, *mark.exit]
+			mem[ndx+6] = 1 if mark.rdir == 'cw' else -1
+		mem[smem.UI_NUM_WAYPTS] = numwaypts
+		if numwaypts:
+			mem[smem.UI_WAYPTS:smem.UI_WAYPTS+numwaypts*2] = arena.route.end[base:base+numwaypts].ravel()
+		mem[smem.UI_NDXWAYPT] = local(arena.ndxwaypt)
+		mem[smem.UI_PAT_FIRST] = local(firstpoint) if pat else -1
+		mem[smem.UI_PAT_LAST] = local(pat.lastwaypt) if pat else -1
+		mem[smem.UI_NEXT_FIRST] = local(nextpat.firstwaypt) if nextpat else -1
+		mem[smem.UI_NEXT_LAST] = local(nextpat.lastwaypt) if nextpat else -1
+		ui.version += 1
+		mem[smem.UI_VERSION] = ui.version
+
+def publishPose():
+	with gmem_ui.get_lock():
+		ui.mem[smem.UI_CBASE_X:smem.UI_CBASE_Y+1] = photo.cbase
+		ui.mem[smem.UI_HEADING] = photo.heading
+		ui.mem[smem.UI_DONUT_X:smem.UI_DONUT_Y+1] = photo.donut
+		ui.mem[smem.UI_TOGO] = photo.togo
+		ui.mem[smem.UI_POSE_T] = max(photo.t, ui.mem[smem.UI_POSE_T] + 1e-6)  # always changes
+
+def refreshUI():  # publish what changed, the arenaui process draws it
+	if ui.conesChanged or ui.patternChanged or ui.markChanged or ui.wayptChanged:
+		publishRoute()
+		ui.conesChanged = ui.patternChanged = ui.markChanged = ui.wayptChanged = False
+	if ui.cbaseChanged:
+		publishPose()
+		ui.cbaseChanged = False
+
+def respondToKeyboard():  # keys forwarded by the arenaui process
+	try:
+		key = gmem_uikeys.get_nowait()
+	except queue.Empty:
+		return False
 
 	if key == 'q':
 		kill('UI: kill')
@@ -996,15 +1322,6 @@ def respondToKeyboard():
 	elif key == 'ctrl+c':
 		kill('UI: kill interrupt')
 
-	elif key == 'c':
-		ts = time.strftime("%Y%m%d-%H%M%S")
-
-		stime = f'{timestamp:.2f}'.replace('.','_')
-		fname = f'{dirname}/{stime}.{imgext}'
-
-		ui.fig.savefig(fname.replace('%timestamp%', ts))
-		jlog.info(f'UI: screen capture {ts}')
-
 	elif key == 'a':
 		throttle.autopilot = True
 		jlog.info(f'UI: autopilot on')
@@ -1015,13 +1332,13 @@ def respondToKeyboard():
 
 	elif key == 'left':
 		throttle.autopilot = False
-		helm.incrPort()
-		jlog.info(f'UI: helm port {helm_incr} degree: {helm.helm} {sensor.roll}')
+		helm.incPort()
+		jlog.info(f'UI: helm port {helm.incr} degree: {helm.helm} {sensor.roll}')
 
 	elif key == 'right':
 		throttle.autopilot = False
-		helm.incrStarboar()
-		jlog.info(f'UI: helm starboard {helm_incr} degree: {helm.helm} {sensor.roll}')
+		helm.incStarboard()
+		jlog.info(f'UI: helm starboard {helm.incr} degree: {helm.helm} {sensor.roll}')
 
 	elif key == 'up':
 		newhelm = 0
@@ -1048,18 +1365,26 @@ def kill(msg):
 
 def isKilled():
 	return (gmem_timestamp[smem.TIME_KILLED] > 0)
+
+def isEstopped():
+	return (gmem_timestamp[smem.TIME_ESTOP] > 0)
 	
 def jloglist(olist): 
 	for o in olist: jlog.info(o)
 
-def skate_main(timestamp, positions):
-	global gmem_timestamp, gmem_positions
+def skate_main(timestamp, telemetry, photoevent):
+	global gmem_timestamp, gmem_telemetry, gmem_photoevent, gmem_ui, gmem_uikeys
 	try:
 		jlog.setup('skate', args.verbose, args.quiet, args.mediaout)
+		rt.apply('skate', args)  # before the serial, writer and photo threads start
 		jlog.info(f'starting process id: {os.getpid()}')
 		gmem_timestamp = timestamp
-		gmem_positions = positions
+		gmem_telemetry = telemetry
+		gmem_photoevent = photoevent
+		gmem_ui = multiprocessing.Array('d', smem.UI_ARRAY_SIZE)
+		gmem_uikeys = multiprocessing.Queue()
 		setupObjectModel()
+		ui.mem = np.frombuffer(gmem_ui.get_obj())
 		jlog.info(f'object model initialized')
 
 		if args.sim:
@@ -1071,6 +1396,7 @@ def skate_main(timestamp, positions):
 			photo.donut = gate
 			photo.cbase = gate
 			sensor.heading = 5
+			photo.heading = 5
 
 			for pat in patterns:
 				if pat[0] == 'continue':
@@ -1091,13 +1417,14 @@ def skate_main(timestamp, positions):
 			while True:
 				if isKilled():
 					break
+				waitForEvent(ui.delay)
 				refreshUI()
 				key = respondToKeyboard()
+				gmem_telemetry.beat(smem.HB_SKATE)
 
 				# copy from pilot()
 				if arena.continuous and (arena.ndxpattern >= len(arena.patterns)-1):
-					arena.addRandomPattern() 
-					arena.recalcWaypts() 
+					arena.extendRoute() 
 			quit()
 
 		# ignore KeyboardInterrupt, leave for gcs
@@ -1109,6 +1436,9 @@ def skate_main(timestamp, positions):
 			kill(f'serial port {args.port} connection failed')
 			return
 		jlog.info(f'serial port {args.port} connected')
+		comm.startReader()
+		comm.startWriter()
+		threading.Thread(target=photoLoop, name='photo', daemon=True).start()
 
 		# setup loop
 		calibrated	= False
@@ -1120,7 +1450,8 @@ def skate_main(timestamp, positions):
 				jlog.info(f'stopping setup loop due to kill')
 				break
 
-			comm.recvSensor()
+			waitForEvent(args.serialtimeout)
+			gmem_telemetry.beat(smem.HB_SKATE)
 
 			if not calibrated:
 				jlog.info('calibrating...')
@@ -1152,34 +1483,48 @@ def skate_main(timestamp, positions):
 				break
 
 		# main loop
+		gmem_telemetry.setDeadline(smem.HB_SKATE, args.deadline)
 		while True:
 			if isKilled():
 				jlog.info(f'stopping main loop due to kill')
 				break
 
-			comm.recvSensor()
+			waitForEvent(ui.delay)
+			gmem_telemetry.beat(smem.HB_SKATE)
+			if isEstopped() and not throttle.isPaused():
+				throttle.pause()  # the writer already sent stop, this keeps pilot() from resuming
+			if args.estimate:
+				predictPosition()
 
 			if photo.hasNewPhoto():
 				jlog.debug(f'has photo')
-				if throttle.isPaused():
+				if throttle.isPaused() and not isEstopped():
 					throttle.unpause()
+					photo.resumed = True
 				pilot()	
 
 			elif photo.isPhotoLate():
 				throttle.pause()
 
+			elif args.estimate and estimator.ready and (time.time() - pilot.t) >= (1 / args.pilothz):
+				pilot()	# between photos, steer from the estimate
+
 			refreshUI()
-			if ui.eventkey:
-				key = respondToKeyboard()
+			key = respondToKeyboard()
 
 	except KeyboardInterrupt:
 		jlog.error('never happen')
 
 	finally:
+		if gmem_telemetry:
+			gmem_telemetry.setDeadline(smem.HB_SKATE, 0)  # shutting down, not missing deadlines
 		kill('finally')
+		stopUI()
 		if comm.serial_port and comm.serial_port.isOpen():
 			throttle.set(0)
 			helm.set(0)
+			if comm.writing:
+				comm.stopWriter()
 			comm.serial_port.close()
 	jlog.info(f'main exit')
 
@@ -1190,13 +1535,18 @@ if __name__ == '__main__':
 	parser.add_argument('--quiet'    ,action='store_true'  ,help='suppress all output'              )
 	parser.add_argument('--mediaout' ,default='/home/john/media/webapps/sk8mini/awacs/photos' ,help='folder out for images, log')
 	setupArgParser(parser)
+	rt.setupArgParser(parser)
 	args = parser.parse_args() # returns Namespace object, use dot-notation
 
 	args.mediaout = f'{args.mediaout}/{time.strftime("%Y%m%d-%H%M%S")}'
 	os.mkdir(args.mediaout)
 
-	import multiprocessing
 	smem_timestamp = multiprocessing.Array('d', smem.TIME_ARRAY_SIZE) # initialized with zeros
-	smem_positions = multiprocessing.Array('i', smem.POS_ARRAY_SIZE)  # initialized with zeros
-	skate_main(smem_timestamp, smem_positions)
+	smem_telemetry = smem.Telemetry(f'{smem.TELEMETRY_NAME}_skate', create=True)  # initialized with zeros, not the name a gcs uses
+	smem_photoevent = multiprocessing.Event()
+	try:
+		skate_main(smem_timestamp, smem_telemetry, smem_photoevent)
+	finally:
+		smem_telemetry.close()
+		smem_telemetry.unlink()
 
@@ -6,28 +6,426 @@ shared memory used by 3 threads: gcs, awacs, skate
 usage:
 # shared memory, instantiate in gcs.py
 smem_timestamp = multiprocessing.Array('d', range(0, TIME_ARRAY_SIZE))
-smem_positions = multiprocessing.Array('i', range(0, POS_ARRAY_SIZE))
+smem_telemetry = Telemetry(args.telemetry, create=True)  # named segment, see telemetry below
+
+smem_photoevent = multiprocessing.Event()  # awacs sets on each new photo, skate waits
+
+# skate allocates these for its UI process, see arenaui.py
+smem_ui = multiprocessing.Array('d', UI_ARRAY_SIZE)
+smem_uikeys = multiprocessing.Queue()  # keyboard commands, UI to skate
 
 # pass args to each new process
-awacs_process = multiprocessing.Process(target=awacs_main, args=(smem_timestamp, smem_positions))
+awacs_process = multiprocessing.Process(target=awacs_main, args=(smem_timestamp, smem_telemetry, smem_photoevent, jlog.timestart))
+
+telemetry:
+	one named multiprocessing.shared_memory segment, laid out by TELEMETRY_DTYPE
+	gcs creates it, and unlinks it at exit, a stale segment left by a crash is replaced
+	the header has the creator's pid, while it runs the segment is not replaced, a second gcs fails to start
+	awacs.py or skate.py run on their own create {name}_awacs or {name}_skate, so they can run beside a gcs
+	children get the Telemetry object from gcs, fork inherits the mapping
+	other programs attach by name, read-only, see telemetry.py:
+		tel = Telemetry('sk8mini', readonly=True)
+	header, magic and TELEMETRY_VERSION, checked on attach, bump the version when the layout changes
+	sections:
+		detection	written by awacs, one per photo, positions in awacs pixels, float, subpixel
+		pose		written by skate, cbase and heading used by the pilot, in cm
+		pilot		written by skate, on each steering update
+		heartbeat	one slot per process, see beat()
+
+seqlock, detection, pose, pilot:
+	writeRecord(rec, stage)		# the one writer of a section
+	snap = readRecord(rec, snap)	# any reader, a consistent copy
+	recordSeq(rec)			# changes when a new record is published
+	seq is odd while the writer is copying, and goes up by 2 for each record
+	the writer fills a private record, then copies it over the shared one in a single memcpy
+	a reader copies the whole record, and retries if seq was odd, or changed during the copy
+	there is only one writer, so no lock is needed, and the reader never blocks the writer
+	if a writer dies while copying, tel.recover() undoes the odd seq, gcs calls it before a restart
+
+heartbeat:
+	tel.beat(HB_SKATE)	# once per main loop pass
+	pid, count of passes, time of the last pass, moving averages of the period and its jitter
+	tel.setDeadline(HB_SKATE, .5)	# the gcs supervisor stops the throttle if a pass takes longer
+	each slot has one writer, fields are aligned 8-byte stores, so no seqlock
+
+frame ring:
+	a second segment, {name}_frames, created and attached with the telemetry, tel.frames
+	FRAME_SLOTS preallocated slots, each one arena crop as awacs decoded it, bgr, not rotated
+	awacs writes each published photo into the next slot, with the slot seqlocked, then sets latest
+	a viewer maps the newest slot in place, no copy, no disk:
+		n, t, pixels, seq = tel.frames.newest()
+		image.set_data(pixels[:,:,::-1])	# bgr to rgb, imshow with the extent flipped, see arenaui.py
+		if not tel.frames.isIntact(n, seq): ...	# awacs lapped the ring while we copied, skip it
 '''
 
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
 # global constants
 MAX_CONES	= 10
 MAX_LEGS	= 10
 
 # map smem_timestamp, all double floats
 TIME_KILLED	= 0
-TIME_PHOTO	= 1
+TIME_ESTOP	= 1	# set by the gcs supervisor when the skate loop misses its deadline, 0 clear
 TIME_ARRAY_SIZE	= 2
 
-# map smem_positions, all integers
-NUM_CONES	= 0
-NUM_LEGS	= 1
-DONUT_X		= 2
-DONUT_Y		= 3
-CONE1_X		= 4
-CONE1_Y		= 5
-CONEMAX_Y	= CONE1_X + MAX_CONES * 2
-POS_ARRAY_SIZE	= CONEMAX_Y + 1
+# telemetry segment
+TELEMETRY_NAME		= 'sk8mini'	# default name, gcs --telemetry
+TELEMETRY_MAGIC		= b'sk8telem'
+TELEMETRY_VERSION	= 3
+
+HB_GCS		= 0	# heartbeat slots
+HB_AWACS	= 1
+HB_SKATE	= 2
+HB_UI		= 3
+HB_NAMES	= ['gcs', 'awacs', 'skate', 'ui']
+HB_SMOOTH	= 1/16	# weight of each new period in the moving averages
+
+HEADER_DTYPE = np.dtype([
+	('magic'	,'S8'),
+	('version'	,'<u4'),
+	('size'		,'<u4'),		# bytes, itemsize of the segment dtype
+	('tcreated'	,'<f8'),
+	('pid'		,'<i8'),		# of the creator, a segment whose creator is alive is not replaced
+], align=True)
+
+DETECTION_DTYPE = np.dtype([
+	('seq'		,'<u8'),		# seqlock, see above
+	('t'		,'<f8'),		# photo timestamp, camera request time
+	('numcones'	,'<i4'),
+	('psr'		,'<f4'),		# donut peak-to-sidelobe ratio, confidence
+	('donut'	,'<f8', (2,)),
+	('cones'	,'<f8', (MAX_CONES,2)),
+], align=True)
+
+POSE_DTYPE = np.dtype([
+	('seq'		,'<u8'),
+	('t'		,'<f8'),		# as of, photo time, or sensor time if estimated
+	('cbase'	,'<f8', (2,)),		# cm
+	('heading'	,'<f8'),		# degrees
+	('sigma'	,'<f8'),		# estimator position sigma, cm, 0 if from the photo
+	('estimated'	,'u1'),
+], align=True)
+
+PILOT_DTYPE = np.dtype([
+	('seq'		,'<u8'),
+	('t'		,'<f8'),		# time of the steering update
+	('ndxwaypt'	,'<i8'),		# since the start of the run, not reset by compaction
+	('bearing'	,'<f8'),
+	('error'	,'<f8'),		# bearing - heading, -180 to +180
+	('segtogo'	,'<f8'),		# cm to the current waypt
+	('togo'		,'<f8'),		# cm to the end of the route
+	('helm'		,'<i4'),
+	('throttle'	,'<i4'),
+	('autopilot'	,'u1'),
+	('paused'	,'u1'),
+], align=True)
+
+HEARTBEAT_DTYPE = np.dtype([
+	('pid'		,'<i8'),
+	('count'	,'<u8'),		# main loop passes
+	('t'		,'<f8'),		# time of the last pass
+	('period'	,'<f8'),		# seconds between passes, moving average
+	('jitter'	,'<f8'),		# mean absolute deviation from period, moving average
+	('deadline'	,'<f8'),		# longest pass the process allows itself, 0 none, see gcs supervisor
+], align=True)
+
+TELEMETRY_DTYPE = np.dtype([
+	('header'	,HEADER_DTYPE),
+	('detection'	,DETECTION_DTYPE),
+	('pose'		,POSE_DTYPE),
+	('pilot'	,PILOT_DTYPE),
+	('heartbeat'	,HEARTBEAT_DTYPE, (len(HB_NAMES),)),
+], align=True)
+
+# frame ring segment, {telemetry name}_frames
+FRAMES_MAGIC	= b'sk8frame'
+FRAMES_VERSION	= 2
+FRAME_SLOTS	= 4			# a slot is reused after FRAME_SLOTS photos, time enough to draw one
+FRAME_SHAPE	= (600, 600, 3)		# the awacs arena crop, h, w, bgr, not rotated
+
+SLOT_DTYPE = np.dtype([
+	('seq'		,'<u8'),		# seqlock, see above
+	('frame'	,'<u8'),		# frame number, 1 up
+	('t'		,'<f8'),		# photo timestamp, as in the detection
+], align=True)
+
+FRAMES_DTYPE = np.dtype([
+	('header'	,HEADER_DTYPE),
+	('latest'	,'<u8'),		# frame number of the newest complete frame, 0 none
+	('slots'	,SLOT_DTYPE, (FRAME_SLOTS,)),
+	('pixels'	,'u1', (FRAME_SLOTS,) + FRAME_SHAPE),
+], align=True)
+
+def openSegment(name, size, create):
+	if create:
+		try:
+			return shared_memory.SharedMemory(name=name, create=True, size=size)
+		except FileExistsError:
+			old = shared_memory.SharedMemory(name=name)
+			resource_tracker.unregister(old._name, 'shared_memory')  # only looking at its header
+			pid = ownerPid(old, size)
+			old.close()
+			if pid:
+				raise FileExistsError(f'{name}: in use by pid {pid}, stop it or use another name')
+			shared_memory.SharedMemory(name=name).unlink()  # left by a run that crashed
+			return shared_memory.SharedMemory(name=name, create=True, size=size)
+	shm = shared_memory.SharedMemory(name=name)
+	resource_tracker.unregister(shm._name, 'shared_memory')  # attached, not ours to unlink at exit
+	if shm.size < size:
+		shm.close()
+		raise ValueError(f'{name}: {shm.size} bytes, expected {size}')
+	return shm
+
+def ownerPid(shm, size):
+	# pid of the creator of an existing segment if it is still running, else 0
+	if shm.size < HEADER_DTYPE.itemsize:
+		return 0
+	header = np.frombuffer(shm.buf, dtype=HEADER_DTYPE, count=1)
+	pid, hsize = int(header['pid'][0]), int(header['size'][0])
+	del header  # so the mapping can close
+	if pid <= 0 or hsize != size:
+		return 0  # another layout
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return 0
+	except PermissionError:  # another user's
+		pass
+	return pid
+
+def setHeader(header, magic, version, size):
+	header['magic'] = magic
+	header['version'] = version
+	header['size'] = size
+	header['tcreated'] = time.time()
+	header['pid'] = os.getpid()
+
+def checkHeader(header, name, magic, version):
+	if header['magic'][0] != magic or header['version'][0] != version:
+		raise ValueError(f'{name}: magic {header["magic"][0]}, version {header["version"][0]}, expected {magic}, {version}')
+
+def fieldView(shm, dtype, field):
+	# a contiguous view of one field, so a section can be copied as one block
+	fdtype, offset = dtype.fields[field][:2]
+	if fdtype.subdtype:  # array
+		base, shape = fdtype.subdtype
+		return np.frombuffer(shm.buf, dtype=base, count=int(np.prod(shape)), offset=offset).reshape(shape)
+	return np.frombuffer(shm.buf, dtype=fdtype, count=1, offset=offset)
+
+class Telemetry:
+	''' the telemetry segment, with a numpy view of each section, and the frame ring '''
+	def __init__(self, name=TELEMETRY_NAME, create=False, readonly=False):
+		self.name = name
+		self.owner = create
+		self.shm = openSegment(name, TELEMETRY_DTYPE.itemsize, create)
+		self.header = fieldView(self.shm, TELEMETRY_DTYPE, 'header')
+		self.detection = fieldView(self.shm, TELEMETRY_DTYPE, 'detection')
+		self.pose = fieldView(self.shm, TELEMETRY_DTYPE, 'pose')
+		self.pilot = fieldView(self.shm, TELEMETRY_DTYPE, 'pilot')
+		self.heartbeat = fieldView(self.shm, TELEMETRY_DTYPE, 'heartbeat')
+		if create:
+			setHeader(self.header, TELEMETRY_MAGIC, TELEMETRY_VERSION, TELEMETRY_DTYPE.itemsize)
+		else:
+			try:
+				checkHeader(self.header, name, TELEMETRY_MAGIC, TELEMETRY_VERSION)
+			except ValueError:
+				self.close()
+				raise
+		if readonly:
+			for view in (self.header, self.detection, self.pose, self.pilot, self.heartbeat):
+				view.flags.writeable = False
+
+		self.frames = None
+		try:
+			self.frames = FrameRing(f'{name}_frames', create, readonly)
+		except FileNotFoundError:  # attached to a run without frames
+			pass
+
+	def beat(self, slot):
+		hb = self.heartbeat[slot:slot+1]
+		t = time.time()
+		pid = os.getpid()
+		if hb['pid'][0] != pid:  # first beat, or a restarted process
+			hb['pid'] = pid
+			hb['period'] = 0.0
+			hb['jitter'] = 0.0
+		elif hb['period'][0] <= 0:
+			hb['period'] = t - hb['t'][0]
+		else:
+			period = t - hb['t'][0]
+			hb['period'] += HB_SMOOTH * (period - hb['period'][0])
+			hb['jitter'] += HB_SMOOTH * (abs(period - hb['period'][0]) - hb['jitter'][0])
+		hb['count'] += 1
+		hb['t'] = t
+
+	def setDeadline(self, slot, seconds):
+		self.heartbeat[slot:slot+1]['deadline'] = seconds
+
+	def recover(self):
+		# after a writer died, put back any record it left half written, readers would spin on the odd seq
+		for rec in (self.detection, self.pose, self.pilot):
+			if rec['seq'][0] & 1:
+				rec['seq'] -= 1
+		if self.frames:
+			self.frames.recover()
+
+	def close(self):
+		# numpy views must go before the mapping can close
+		self.header = self.detection = self.pose = self.pilot = self.heartbeat = None
+		try:
+			self.shm.close()
+		except BufferError:  # a view is still held somewhere
+			pass
+		if getattr(self, 'frames', None):
+			self.frames.close()
+
+	def unlink(self):
+		if self.owner:
+			self.shm.unlink()
+			if self.frames:
+				self.frames.unlink()
+
+class FrameRing:
+	''' the frame ring segment, FRAME_SLOTS photos, one writer, awacs '''
+	def __init__(self, name, create=False, readonly=False):
+		self.name = name
+		self.owner = create
+		self.shm = openSegment(name, FRAMES_DTYPE.itemsize, create)
+		self.header = fieldView(self.shm, FRAMES_DTYPE, 'header')
+		self.latest = fieldView(self.shm, FRAMES_DTYPE, 'latest')
+		self.slots = fieldView(self.shm, FRAMES_DTYPE, 'slots')
+		self.pixels = fieldView(self.shm, FRAMES_DTYPE, 'pixels')
+		if create:
+			setHeader(self.header, FRAMES_MAGIC, FRAMES_VERSION, FRAMES_DTYPE.itemsize)
+		else:
+			try:
+				checkHeader(self.header, name, FRAMES_MAGIC, FRAMES_VERSION)
+			except ValueError:
+				self.close()
+				raise
+		if readonly:
+			for view in (self.header, self.latest, self.slots, self.pixels):
+				view.flags.writeable = False
+
+	def write(self, t, image):
+		n = int(self.latest[0]) + 1
+		i = n % FRAME_SLOTS
+		slot = self.slots[i:i+1]
+		seq = int(slot['seq'][0])
+		slot['seq'] = seq + 1			# odd, writing
+		np.copyto(self.pixels[i], image)
+		slot['frame'] = n
+		slot['t'] = t
+		slot['seq'] = seq + 2			# even, done
+		self.latest[0] = n
+
+	def newest(self):
+		# frame number, t, pixels, seq of the newest frame, or None before the first
+		# pixels is the slot itself, not a copy, check isIntact() after using it
+		while True:
+			n = int(self.latest[0])
+			if n <= 0:
+				return None
+			i = n % FRAME_SLOTS
+			seq = int(self.slots['seq'][i])
+			if seq & 1 or int(self.slots['frame'][i]) != n:
+				time.sleep(0)  # being written, or already reused, let the writer run
+				continue
+			return n, float(self.slots['t'][i]), self.pixels[i], seq
+
+	def recover(self):
+		odd = (self.slots['seq'] & 1) == 1
+		self.slots['frame'][odd] = 0	# never returned by newest()
+		self.slots['seq'][odd] += 1
+
+	def isIntact(self, n, seq):
+		# the slot of frame n has not been touched since newest() returned seq
+		return int(self.slots['seq'][n % FRAME_SLOTS]) == seq
+
+	def close(self):
+		self.header = self.latest = self.slots = self.pixels = None
+		try:
+			self.shm.close()
+		except BufferError:
+			pass
+
+	def unlink(self):
+		if self.owner:
+			self.shm.unlink()
+
+def recordSeq(rec):
+	return int(rec['seq'][0])
+
+def writeRecord(rec, stage):
+	seq = int(rec['seq'][0])
+	stage['seq'] = seq + 2
+	body = rec.view(np.uint8)
+	rec['seq'] = seq + 1			# odd, writing
+	body[8:] = stage.view(np.uint8)[8:]
+	rec['seq'] = seq + 2			# even, done
+
+def readRecord(rec, snap=None):
+	if snap is None:
+		snap = np.zeros(1, dtype=rec.dtype)
+	while True:
+		seq = rec['seq'][0]
+		if not seq & 1:
+			snap[:] = rec
+			if rec['seq'][0] == seq:
+				return snap
+		time.sleep(0)  # the writer is copying, let it run
+
+detectionStage = np.zeros(1, dtype=DETECTION_DTYPE)  # private record of the one detection writer, awacs
+
+def writeDetection(rec, t, donut, cones, psr=0.0):
+	stage = detectionStage
+	n = min(len(cones), MAX_CONES)
+	stage['t'] = t
+	stage['numcones'] = n
+	stage['psr'] = psr
+	stage['donut'] = donut
+	stage['cones'] = 0
+	if n:
+		stage['cones'][0,:n] = cones[:n]
+	writeRecord(rec, stage)
+
+
+# map smem_ui, all doubles, written by skate, read by arenaui
+# route section, rewritten under the array lock, then UI_VERSION is incremented
+MAX_UI_MARKS	= 32	# window of marks around the current mark
+MAX_UI_WAYPTS	= 512	# window of waypts from the current pattern on
+MARK_SIZE	= 7	# center x,y, entry x,y, exit x,y, rdir +1 cw -1 ccw
+
+UI_VERSION	= 0
+UI_CONTINUOUS	= 1
+UI_GATE_X	= 2
+UI_GATE_Y	= 3
+UI_GATE_SIZE	= 4	# on mark distance, the square drawn around the gate
+UI_NUM_CONES	= 5
+UI_NUM_MARKS	= 6	# marks published
+UI_MARK_BASE	= 7	# arena index of the first mark published
+UI_MARK_FIRST	= 8	# arena index of the first mark to draw, base or base+1
+UI_NUM_WAYPTS	= 9	# waypts published, indexes below are into these
+UI_NDXWAYPT	= 10
+UI_PAT_FIRST	= 11	# current pattern
+UI_PAT_LAST	= 12
+UI_NEXT_FIRST	= 13	# next pattern, -1 if none
+UI_NEXT_LAST	= 14
+
+# pose section, written under the array lock on each new photo
+UI_POSE_T	= 15	# photo time, 0 before the first
+UI_CBASE_X	= 16
+UI_CBASE_Y	= 17
+UI_HEADING	= 18
+UI_DONUT_X	= 19
+UI_DONUT_Y	= 20
+UI_TOGO		= 21	# cm to the end of the route
 
+UI_CONES	= 22
+UI_MARKS	= UI_CONES + MAX_CONES * 2
+UI_WAYPTS	= UI_MARKS + MAX_UI_MARKS * MARK_SIZE
+UI_ARRAY_SIZE	= UI_WAYPTS + MAX_UI_WAYPTS * 2
@@ -45,6 +45,22 @@ hArenaCm = 272.7	# cm (600 / pxPerCm)
 wArenaPx = 600
 hArenaPx = 600
 
+# camera frame, px, determined by the camera framesize setting
+wCameraPx = 1280
+hCameraPx = 1024
+
+# the arena crop of the camera frame, px, awacs coordinates, before the 180 rotation
+cropCtrX = 660  # 640
+cropCtrY = 466  # 512
+cropLeft = int(cropCtrX - (wArenaPx/2))
+cropTop = int(cropCtrY - (hArenaPx/2))
+cropRight = cropLeft + wArenaPx
+cropBottom = cropTop + hArenaPx
+
+def cropPhoto(image):
+	# the arena from a full camera frame, a view, not a copy
+	return image[cropTop:cropBottom, cropLeft:cropRight]
+
 # px:cm ratio, determined by camera altitude
 pxPerCm = 2.27  # 150 cm = 340 pixels, using photo of tape measure
 cmPerPx = .44
@@ -77,15 +93,17 @@ def awacs2skate(pt):
 # 3		2.25
 
 speed = 10.32
+throttleSpeeds = [[0, 0.0], [3, 2.25], [23, 10.32], [43, 14.27]]  # measured, plus stopped
 
 def speedFromThrottle(throttle):
-	if throttle == 43:
-		speed = 14.27
-	if throttle == 23:
-		speed = 10.32
-	if throttle == 3:
-		speed = 2.25
-	return speed
+	# cm per second, linear between the measured throttle settings
+	throttle = max(0, min(throttleSpeeds[-1][0], throttle))
+	for i in range(1, len(throttleSpeeds)):
+		t1, s1 = throttleSpeeds[i]
+		if throttle <= t1:
+			t0, s0 = throttleSpeeds[i-1]
+			return s0 + (s1 - s0) * (throttle - t0) / (t1 - t0)
+	return throttleSpeeds[-1][1]
 
 skateSpriteRaw = [
 	[0	,4.84 ],
@@ -0,0 +1,77 @@
+'''
+telemetry.py - print the live telemetry of a run, from another terminal
+
+attaches to the named shared memory segment that gcs creates, read-only, see smem.py
+does not go through gcs, and does not change anything the run sees
+
+usage:
+	python telemetry.py			# default segment name, sk8mini
+	python telemetry.py --name sk8mini --hz 2
+	python telemetry.py --once
+
+output, one block per refresh:
+	detection	seq, photo age, donut px, psr, number of cones
+	pose		seq, age, cbase cm, heading, sigma if estimated
+	pilot		seq, age, waypt, helm, throttle, error, togo, flags
+	heartbeat	per process: pid, loop count, loop rate since the last refresh, mean period and jitter, age of the last pass
+'''
+
+import argparse
+import time
+import numpy as np
+
+import smem
+
+def age(t, now):
+	return f'{now - t:6.2f}s' if t > 0 else '     - '
+
+def show(tel, snaps, last, now):
+	d = smem.readRecord(tel.detection, snaps['detection'])[0]
+	p = smem.readRecord(tel.pose, snaps['pose'])[0]
+	q = smem.readRecord(tel.pilot, snaps['pilot'])[0]
+	print(f'detection seq:{d["seq"]:6d} age:{age(d["t"], now)} donut:[{d["donut"][0]:.1f}, {d["donut"][1]:.1f}] psr:{d["psr"]:.1f} cones:{d["numcones"]}')
+	sigma = f' sigma:{p["sigma"]:.1f}' if p['estimated'] else ''
+	print(f'pose      seq:{p["seq"]:6d} age:{age(p["t"], now)} cbase:[{p["cbase"][0]:.1f}, {p["cbase"][1]:.1f}] heading:{p["heading"]:.1f}{sigma}')
+	flags = ('autopilot ' if q['autopilot'] else '') + ('paused' if q['paused'] else '')
+	print(f'pilot     seq:{q["seq"]:6d} age:{age(q["t"], now)} waypt:{q["ndxwaypt"]} helm:{q["helm"]} throttle:{q["throttle"]} error:{q["error"]:.1f} togo:{q["togo"]:.0f} {flags}')
+	hb = np.array(tel.heartbeat)
+	for i in range(len(smem.HB_NAMES)):
+		count, t = int(hb['count'][i]), float(hb['t'][i])
+		lastcount, lastt = last[i]
+		hz = (count - lastcount) / (now - lastt) if lastt > 0 and now > lastt else 0.0
+		deadline = f' deadline:{hb["deadline"][i]*1000:.0f}ms' if hb['deadline'][i] > 0 else ''
+		print(f'{smem.HB_NAMES[i]:9s} pid:{hb["pid"][i]:7d} count:{count:8d} {hz:6.1f}Hz period:{hb["period"][i]*1000:6.1f}ms jitter:{hb["jitter"][i]*1000:5.1f}ms age:{age(t, now)}{deadline}')
+		last[i] = (count, now)
+	print()
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--name'  ,default=smem.TELEMETRY_NAME  ,help='name of the telemetry segment')
+	parser.add_argument('--hz'    ,default=1.0  ,type=float     ,help='refresh rate')
+	parser.add_argument('--once'  ,action='store_true'          ,help='print once and exit')
+	args = parser.parse_args()
+
+	try:
+		tel = smem.Telemetry(args.name, readonly=True)
+	except FileNotFoundError:
+		print(f'no telemetry segment {args.name}, is gcs running?')
+		return
+	except ValueError as ex:
+		print(ex)
+		return
+
+	snaps = {name: np.zeros(1, dtype=getattr(tel, name).dtype) for name in ['detection', 'pose', 'pilot']}
+	last = [(0, 0.0)] * len(smem.HB_NAMES)
+	try:
+		while True:
+			show(tel, snaps, last, time.time())
+			if args.once:
+				break
+			time.sleep(1 / args.hz)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		tel.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,34 @@
+'''
+conftest.py - pytest setup for the sk8mini python modules
+
+run from sk8mini/python:
+	python -m pytest -q tests
+
+skate keeps its state in module globals, set up by setupObjectModel() from args
+the skate fixture gives each test a fresh object model, default args, and no serial port
+'''
+
+import os
+import sys
+import argparse
+import multiprocessing
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jlog
+import smem
+import skate as skatemodule
+
+@pytest.fixture(autouse=True, scope='session')
+def log(tmp_path_factory):
+	jlog.setup('test ', False, True, str(tmp_path_factory.mktemp('log')))  # quiet, errors only
+
+@pytest.fixture
+def skate():
+	parser = argparse.ArgumentParser()
+	skatemodule.setupArgParser(parser)
+	skatemodule.args = parser.parse_args([])
+	skatemodule.gmem_timestamp = multiprocessing.Array('d', smem.TIME_ARRAY_SIZE)
+	skatemodule.setupObjectModel()
+	return skatemodule
@@ -0,0 +1,65 @@
+import numpy as np
+
+def test_recvSensor_adds_to_ring(skate):
+	skate.comm.recvSensor((10.0, 1.0, 2.0, 3, 3, 3, 3))
+	assert skate.ahrs.n == 1
+	assert skate.sensor.heading == 10.0 + skate.args.declination
+	assert skate.ahrs.headingAt(skate.sensor.t) == skate.sensor.heading
+
+def test_readLoop_survives_a_bad_sample(skate):
+	lines = [b'10\t0\t0\t3\t3\t3\t3\n', b'20\t0\t0\t3\t3\t3\t3\n']
+	class Port:
+		in_waiting = 0
+		def read(self, n):
+			if not lines:
+				skate.kill('test done')
+				return b''
+			return lines.pop(0)
+	calls = []
+	recv = skate.comm.recvSensor
+	def flaky(sample):
+		calls.append(sample)
+		if len(calls) == 1:
+			raise ValueError('bad sample')
+		recv(sample)
+	skate.comm.serial_port = Port()
+	skate.comm.recvSensor = flaky
+	try:
+		skate.comm.readLoop()
+	finally:
+		del skate.comm.recvSensor
+		skate.comm.serial_port = False
+	assert len(calls) == 2
+	assert skate.comm.nrecverrors == 1
+	assert skate.ahrs.n == 1
+
+def test_at_interpolates_between_samples(skate):
+	ring = skate.AhrsRing(8)
+	ring.add(1.0, 10.0, 0.0, 0.0, 1, 1, 1, 1)
+	ring.add(2.0, 20.0, 4.0, 2.0, 3, 3, 3, 3)
+	s = ring.at(1.25)
+	assert np.isclose(s[ring.HEADING], 12.5)
+	assert np.isclose(s[ring.ROLL], 1.0)
+	assert s[ring.GYRO] == 1	# calibration from the nearer sample
+	assert ring.at(0.0)[ring.T] == 1.0	# before the buffer, the first sample
+	assert ring.at(9.0)[ring.T] == 2.0	# after, the last
+
+def test_at_heading_goes_the_short_way_around(skate):
+	ring = skate.AhrsRing(8)
+	ring.add(1.0, 350.0, 0, 0, 3, 3, 3, 3)
+	ring.add(2.0, 10.0, 0, 0, 3, 3, 3, 3)
+	assert np.isclose(ring.at(1.25)[ring.HEADING], 355.0)
+	assert np.isclose(ring.at(1.75)[ring.HEADING], 5.0)
+
+def test_ring_wraps_and_keeps_the_newest(skate):
+	ring = skate.AhrsRing(4)
+	for i in range(10):
+		ring.add(float(i), float(i), 0, 0, 3, 3, 3, 3)
+	assert ring.at(0.0)[ring.T] == 6.0	# oldest left
+	assert np.isclose(ring.at(8.5)[ring.HEADING], 8.5)
+
+def test_empty_ring_falls_back_to_sensor(skate):
+	ring = skate.AhrsRing(4)
+	assert ring.at(1.0) is None
+	skate.sensor.heading = 42.0
+	assert ring.headingAt(1.0) == 42.0
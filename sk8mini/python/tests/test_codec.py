@@ -0,0 +1,102 @@
+import os
+import re
+import struct
+import pytest
+
+import codec
+
+AHRS = (12.5, -1.25, 3.0, 3, 2, 1, 0)
+TEXTLINE = b'12.5\t-1.25\t3.0\t3\t2\t1\t0\n'
+
+def header():
+	fname = os.path.join(os.path.dirname(__file__), '..', '..', 'arduino', 'sk8mini.h')
+	with open(fname) as fp:
+		return fp.read()
+
+def structFormat(text, name):
+	# little-endian struct format of a typedef struct in sk8mini.h, packed, as the esp32 lays it out here
+	body = re.search(r'typedef struct ' + name + r'\s*\{(.*?)\}', text, re.S).group(1)
+	types = {'float': 'f', 'int': 'i', 'int32_t': 'i', 'uint8_t': 'B'}
+	return '<' + ''.join(types[t] for t in re.findall(r'^\s*(\w+)\s+\w+;', body, re.M))
+
+def test_structs_match_sk8mini_h():
+	text = header()
+	assert structFormat(text, 'AHRS') == codec.AHRS_STRUCT.format
+	assert structFormat(text, 'COMMAND') == codec.COMMAND_STRUCT.format
+	assert codec.AHRS_STRUCT.size == 16
+	assert codec.COMMAND_STRUCT.size == 8
+
+@pytest.mark.parametrize('data', [b'', b'\x00', b'\x00\x00', b'abc', b'a\x00b\x00', bytes(range(256)), bytes(300), b'\x01' * 600])
+def test_cobs_round_trip(data):
+	encoded = codec.cobsEncode(data)
+	assert b'\x00' not in encoded
+	dst = bytearray(len(data) + 8)
+	n = codec.cobsDecode(encoded, dst)
+	assert bytes(dst[:n]) == data
+
+def test_crc16_ccitt_false():
+	assert codec.crc16(b'123456789') == 0x29B1	# the standard check value
+
+def test_binary_ahrs_round_trip():
+	dec = codec.Decoder('binary')
+	frame = codec.encodeAhrs(AHRS, 'binary')
+	assert frame.endswith(b'\x00') and b'\x00' not in frame[:-1]
+	assert dec.feed(frame[:5]) == []	# partial frame waits
+	assert dec.feed(frame[5:]) == [AHRS]
+
+def test_binary_command_encoding():
+	frame = codec.encodeCommand(2, -45, 'binary')
+	dst = bytearray(codec.MAXFRAME)
+	n = codec.cobsDecode(frame[:-1], dst)
+	assert dst[0] == codec.COMMAND_TYPE
+	assert codec.COMMAND_STRUCT.unpack_from(dst, 1) == (2, -45)
+	assert codec.CRC_STRUCT.unpack_from(dst, n-2)[0] == codec.crc16(bytes(dst[:n-2]))
+
+def test_damaged_frame_fails_crc_and_resyncs():
+	dec = codec.Decoder('binary')
+	frame = bytearray(codec.encodeAhrs(AHRS, 'binary'))
+	frame[3] ^= 0x40
+	assert dec.feed(bytes(frame) + codec.encodeAhrs(AHRS, 'binary')) == [AHRS]
+	assert dec.nbad == 1
+
+def test_text_round_trip():
+	dec = codec.Decoder('text')
+	assert dec.feed(TEXTLINE) == [AHRS]
+	assert codec.encodeCommand(1, 30, 'text') == b'1\t30\n'
+
+def test_auto_detects_binary():
+	dec = codec.Decoder('auto')
+	assert dec.feed(codec.encodeAhrs(AHRS, 'binary') * 2) == [AHRS, AHRS]
+	assert dec.mode == 'binary'
+
+def test_auto_binary_frame_with_newline_byte():
+	ahrs = (struct.unpack('<f', b'\x0a\x0a\x0a\x41')[0], 0.0, 0.0, 3, 3, 3, 3)
+	frame = codec.encodeAhrs(ahrs, 'binary')
+	assert b'\n' in frame
+	dec = codec.Decoder('auto')
+	assert dec.feed(frame) == [ahrs]
+	assert dec.mode == 'binary'
+
+def test_auto_detects_text():
+	dec = codec.Decoder('auto')
+	assert dec.feed(TEXTLINE * 2) == [AHRS, AHRS]
+	assert dec.mode == 'text'
+
+def test_auto_stray_zero_costs_only_its_line():
+	dec = codec.Decoder('auto')
+	samples = dec.feed(TEXTLINE + b'12.5\t\x00garbage\n' + TEXTLINE)
+	assert samples == [AHRS, AHRS]
+	assert dec.mode == 'text'
+
+def test_auto_stray_zero_before_any_good_message():
+	dec = codec.Decoder('auto')
+	samples = dec.feed(b'\x00' + TEXTLINE + b'1\t2\x00\n' + TEXTLINE)
+	assert samples == [AHRS, AHRS]
+	assert dec.mode == 'text'
+
+def test_auto_text_then_binary_frame_in_one_read():
+	dec = codec.Decoder('auto')
+	samples = dec.feed(b'noise\n' + codec.encodeAhrs(AHRS, 'binary'))
+	assert samples == [AHRS]
+	assert dec.mode == 'binary'
+	assert dec.nbad == 1
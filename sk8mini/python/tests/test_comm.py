@@ -0,0 +1,72 @@
+import time
+import threading
+
+def startWriter(skate, block=None):
+	# writer with the serial port replaced by a list, block holds the first write until set
+	sent = []
+	def send(cmd, value):
+		if block is not None and not sent:
+			block.wait(2)
+		sent.append((cmd, value))
+	skate.comm.sendCommand = send
+	skate.comm.pending = {}
+	skate.comm.cond = threading.Condition()
+	skate.comm.startWriter()
+	return sent
+
+def stopWriter(skate):
+	skate.comm.stopWriter()
+	del skate.comm.sendCommand
+
+def test_newer_value_replaces_unsent(skate):
+	block = threading.Event()
+	sent = startWriter(skate, block)
+	skate.comm.post(skate.comm.HELM, 1)	# being written, held
+	deadline = time.time() + 2
+	while skate.comm.pending and time.time() < deadline:
+		time.sleep(.001)
+	assert skate.comm.pending == {}, 'the writer did not take the first command'
+	for v in range(2, 6):
+		skate.comm.post(skate.comm.HELM, v)
+	block.set()
+	stopWriter(skate)
+	assert sent == [(skate.comm.HELM, 1), (skate.comm.HELM, 5)]
+	assert skate.comm.ncoalesced == 3
+
+def test_stop_preempts_pending(skate):
+	with skate.comm.cond:
+		skate.comm.pending = {skate.comm.HELM: 10, skate.comm.THROTTLE: skate.Throttle.STOP}
+		assert skate.comm.nextCommand() == (skate.comm.THROTTLE, skate.Throttle.STOP)
+		assert skate.comm.nextCommand() == (skate.comm.HELM, 10)
+
+def test_oldest_slot_first(skate):
+	skate.comm.pending = {skate.comm.HELM: 10, skate.comm.THROTTLE: 23}
+	assert skate.comm.nextCommand() == (skate.comm.HELM, 10)
+
+def test_estop_sends_stop_and_holds_it(skate):
+	sent = startWriter(skate)
+	skate.gmem_timestamp[skate.smem.TIME_ESTOP] = 1.0
+	with skate.comm.cond:
+		skate.comm.cond.notify()
+	skate.comm.post(skate.comm.THROTTLE, 30)	# held at stop while estopped
+	stopWriter(skate)
+	throttles = [v for c, v in sent if c == skate.comm.THROTTLE]
+	assert throttles and all(v == skate.Throttle.STOP for v in throttles)
+	assert skate.comm.estopped
+
+def test_write_error_ends_the_writer_and_the_run(skate):
+	class Port:
+		def isOpen(self): return True
+		def write(self, data): raise OSError('port gone')
+	skate.comm.serial_port = Port()
+	skate.comm.pending = {}
+	skate.comm.cond = threading.Condition()
+	skate.comm.startWriter()
+	try:
+		skate.comm.post(skate.comm.THROTTLE, skate.Throttle.STOP)
+		skate.comm.writer.join(2)
+		assert not skate.comm.writer.is_alive()
+		assert not skate.comm.writing	# post() no longer parks commands for a dead writer
+		assert skate.isKilled()
+	finally:
+		skate.comm.serial_port = False
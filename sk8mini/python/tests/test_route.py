@@ -0,0 +1,120 @@
+import math
+import random
+import numpy as np
+
+cones = [[-100,100], [100,100], [100,-100], [-100,-100], [1,1]]
+gate = [-80,-120]
+
+def setupArena(skate, lines, continuous=False):
+	arena = skate.arena
+	arena.cones = cones
+	arena.gate = gate
+	arena.patterns, arena.marks, arena.waypts = [], [], []  # class lists, shared between tests otherwise
+	arena.continuous = continuous
+	skate.photo.cbase = gate
+	skate.photo.heading = 5
+	for line in lines:
+		arena.addPattern(skate.parsePatternLine(line))
+	arena.recalcWaypts()
+	return arena
+
+def checkIndexes(arena):
+	# marks and patterns cover the waypts without gaps, and the route matches the waypts
+	for a, b in zip(arena.marks, arena.marks[1:]):
+		assert b.firstwaypt == a.lastwaypt + 1
+	for pat in arena.patterns:
+		assert pat.firstwaypt == arena.marks[pat.firstmark].firstwaypt
+		finish = 0 if arena.continuous or pat is not arena.patterns[-1] else 1  # the finish gate
+		assert pat.lastwaypt == arena.marks[pat.lastmark-1].lastwaypt + finish
+	assert arena.route.n == len(arena.waypts)
+	assert np.allclose(arena.route.end, arena.waypts)
+
+def test_route_follows_the_waypts(skate):
+	arena = setupArena(skate, ['oval, [1,2], cw, 2'])
+	route = arena.route
+	assert np.allclose(route.end[0], gate) and np.allclose(route.end[-1], gate)
+	assert route.kind[0] == route.NONE
+	for mark in arena.marks:
+		assert route.kind[mark.firstwaypt] == route.LINE	# to the preentry point
+		assert (route.kind[mark.firstwaypt+1:mark.lastwaypt+1] == route.ARC).all()
+		assert (route.rdir[mark.firstwaypt+1:mark.lastwaypt+1] == -1).all()	# cw
+	assert np.isclose(route.cumlen[-1], route.length.sum())
+	checkIndexes(arena)
+
+def test_toGo_and_isPast_on_a_line(skate):
+	route = setupArena(skate, ['oval, [1,2], cw, 1']).route
+	i = 1
+	start, end = route.start[i], route.end[i]
+	seg, total = route.toGo(i, start)
+	assert np.isclose(seg, route.length[i])
+	assert np.isclose(total, route.cumlen[-1])
+	seg, total = route.toGo(i, end)
+	assert np.isclose(seg, 0)
+	assert np.isclose(total, route.cumlen[-1] - route.cumlen[i])
+	assert not route.isPast(i, start)
+	assert route.isPast(i, end)
+	assert route.isPast(i, end + route.unit[i] * 20)	# overshot
+	assert route.toGo(i, end + route.unit[i] * 20)[0] == 0
+
+def test_toGo_and_isPast_on_an_arc(skate):
+	route = setupArena(skate, ['oval, [1,2], cw, 1']).route
+	i = int(np.flatnonzero(route.kind == route.ARC)[0])
+	assert np.isclose(route.toGo(i, route.start[i])[0], route.length[i])
+	assert np.isclose(route.toGo(i, route.end[i])[0], 0, atol=1e-6)
+	assert not route.isPast(i, route.start[i])
+	assert route.isPast(i, route.end[i])
+	# halfway round, the same distance from the center, to go is half the arc
+	theta = route.tfrom[i] + route.rdir[i] * route.sweep[i] / 2
+	mid = route.center[i] + route.radius[i] * np.array([math.cos(theta), math.sin(theta)])
+	assert np.isclose(route.toGo(i, mid)[0], route.length[i] / 2)
+
+def test_nearest_picks_the_segment_under_the_point(skate):
+	route = setupArena(skate, ['oval, [1,2], cw, 2']).route
+	for i in range(1, route.n):
+		if route.length[i] < 1:
+			continue
+		if route.kind[i] == route.ARC:
+			theta = route.tfrom[i] + route.rdir[i] * route.sweep[i] / 2
+			pt = route.center[i] + route.radius[i] * np.array([math.cos(theta), math.sin(theta)])
+			tangent = route.rdir[i] * np.array([-math.sin(theta), math.cos(theta)])
+		else:
+			pt = route.start[i] + route.unit[i] * route.length[i] / 2
+			tangent = route.unit[i]
+		heading = math.degrees(math.atan2(tangent[0], tangent[1])) % 360	# compass, 0 north, cw
+		assert route.nearest(pt, i, heading, 50)[0] == i
+		ndx, dist = route.nearest(pt, 1, heading, 50)	# the same place on an earlier lap, or here
+		assert np.isclose(dist, 0, atol=1e-6)
+		assert ndx <= i
+	assert route.nearest(gate, route.n, 0, 50) == (route.n, float('inf'))
+
+def test_extendRoute_matches_a_full_recalc(skate):
+	random.seed(1)
+	arena = setupArena(skate, ['oval, [1,2], cw, 1'], continuous=True)
+	arena.extendRoute()
+	arena.extendRoute()
+	checkIndexes(arena)
+	extended = np.array(arena.waypts)
+	arena.recalcWaypts()
+	assert np.allclose(extended, arena.waypts)
+
+def test_compact_rebases_the_indexes(skate):
+	random.seed(2)
+	arena = setupArena(skate, ['oval, [1,2], cw, 1'], continuous=True)
+	arena.nextWaypt()
+	for i in range(40):
+		# drive to the last pattern, as pilot() does, then extend
+		while arena.ndxpattern < len(arena.patterns)-1:
+			abswaypt = arena.ndxwaypt + arena.wayptoffset
+			arena.nextWaypt()
+			assert arena.ndxwaypt + arena.wayptoffset == abswaypt + 1
+		abswaypt = arena.ndxwaypt + arena.wayptoffset
+		pt = arena.currentWaypt()
+		arena.extendRoute()
+		assert arena.ndxwaypt + arena.wayptoffset == abswaypt	# the same waypt, rebased
+		assert np.allclose(arena.currentWaypt(), pt)
+		assert arena.isWayptInMark(arena.ndxwaypt, arena.currentMark())
+		assert arena.isWayptInPattern(arena.ndxwaypt, arena.currentPattern())
+		checkIndexes(arena)
+		# every pattern kept but the current one has a mark the UI still draws
+		assert arena.ndxpattern == 0 or arena.patterns[0].lastmark > arena.ndxmark - arena.draw_nback - 1
+	assert arena.patternoffset > 0
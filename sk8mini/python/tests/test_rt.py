@@ -0,0 +1,43 @@
+import os
+import argparse
+import pytest
+
+import rt
+
+@pytest.fixture
+def calls(monkeypatch):
+	# the os scheduling calls, recorded instead of made
+	calls = []
+	for name in ['sched_setaffinity', 'sched_setscheduler', 'setpriority']:
+		monkeypatch.setattr(os, name, lambda *a, name=name: calls.append((name,) + a))
+	return calls
+
+def getArgs(argv):
+	parser = argparse.ArgumentParser()
+	rt.setupArgParser(parser)
+	return parser.parse_args(argv)
+
+def test_no_profile_leaves_the_process_as_launched(calls):
+	rt.apply('skate', getArgs([]))
+	rt.apply('ui', getArgs([]), 'skate')
+	rt.apply('awacs', getArgs(['--rtfifo', 'skate=50']))
+	assert calls == []
+
+def test_only_the_named_settings_are_applied(calls):
+	rt.apply('skate', getArgs(['--rtfifo', 'skate=50']))
+	assert [c[0] for c in calls] == ['sched_setscheduler']
+	assert calls[0][2] == os.SCHED_FIFO
+
+def test_ui_resets_what_skate_set(calls):
+	rt.apply('ui', getArgs(['--rtcpus', 'skate=1', '--rtnice', 'ui=10']), 'skate')
+	assert calls == [
+		('sched_setaffinity', 0, rt.allcpus),
+		('sched_setscheduler', 0, rt.launchpolicy, rt.launchparam),
+		('setpriority', os.PRIO_PROCESS, 0, rt.launchnice),
+		('setpriority', os.PRIO_PROCESS, 0, 10),
+	]
+
+def test_parseCpus():
+	assert rt.parseCpus('0,2-4') == {0, 2, 3, 4}
+	with pytest.raises(ValueError):
+		rt.parseRoles('gcs=1')
@@ -0,0 +1,130 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+
+import smem
+
+class Racing(np.ndarray):
+	# a record whose writer takes the next step each time a reader looks at seq
+	def __getitem__(self, key):
+		if key == 'seq' and self.steps:
+			self.steps.pop(0)(self.view(np.ndarray))
+		return super().__getitem__(key)
+
+def racing(steps):
+	rec = np.zeros(1, dtype=smem.POSE_DTYPE).view(Racing)
+	rec.steps = steps
+	return rec
+
+def publish(seq, heading):
+	def step(rec):
+		rec['seq'] = seq
+		if heading is not None:
+			rec['heading'] = heading
+	return step
+
+@pytest.fixture
+def tel():
+	tel = smem.Telemetry(f'sk8test_{os.getpid()}', create=True)
+	yield tel
+	tel.unlink()
+	tel.close()
+
+def test_writeRecord_publishes_with_even_seq():
+	rec = np.zeros(1, dtype=smem.POSE_DTYPE)
+	stage = np.zeros(1, dtype=smem.POSE_DTYPE)
+	for i in range(1, 4):
+		stage['heading'] = i * 10.0
+		smem.writeRecord(rec, stage)
+		assert smem.recordSeq(rec) == 2 * i
+		assert smem.readRecord(rec)['heading'][0] == i * 10.0
+
+def test_readRecord_waits_out_a_write_in_progress():
+	# the reader arrives while seq is odd, the writer finishes
+	steps = [publish(1, 5.0), publish(1, None), publish(2, 20.0)]
+	snap = smem.readRecord(racing(steps))
+	assert not steps
+	assert snap['seq'][0] == 2 and snap['heading'][0] == 20.0
+
+def test_readRecord_retries_a_torn_copy():
+	# seq is even when the copy starts, the writer starts over it, so the copy is thrown away
+	steps = [publish(2, 10.0), publish(3, 15.0), publish(3, None), publish(4, 20.0)]
+	snap = smem.readRecord(racing(steps))
+	assert not steps
+	assert snap['seq'][0] == 4 and snap['heading'][0] == 20.0
+
+def test_writeDetection_clips_the_cones():
+	rec = np.zeros(1, dtype=smem.DETECTION_DTYPE)
+	cones = [[i, i] for i in range(smem.MAX_CONES + 3)]
+	smem.writeDetection(rec, 1.0, [300, 300], cones, 9.0)
+	snap = smem.readRecord(rec)
+	assert snap['numcones'][0] == smem.MAX_CONES
+	assert (snap['cones'][0][-1] == cones[smem.MAX_CONES-1]).all()
+	smem.writeDetection(rec, 2.0, [300, 300], [])
+	assert smem.readRecord(rec)['numcones'][0] == 0
+	assert (smem.readRecord(rec)['cones'][0] == 0).all()	# none left from the last photo
+
+def test_recover_undoes_a_dead_writer(tel):
+	tel.pose['seq'] = 7	# died while copying
+	tel.recover()
+	assert smem.recordSeq(tel.pose) == 6
+	snap = smem.readRecord(tel.pose)	# would spin on the odd seq
+	assert snap['seq'][0] == 6
+
+def test_frame_ring_newest_and_isIntact(tel):
+	frames = tel.frames
+	assert frames.newest() is None
+	for k in range(1, 3):
+		frames.write(float(k), np.full(smem.FRAME_SHAPE, k, dtype=np.uint8))
+	n, t, pixels, seq = frames.newest()
+	assert (n, t) == (2, 2.0) and pixels[0,0,0] == 2
+	assert frames.isIntact(n, seq)
+	for k in range(3, 3 + smem.FRAME_SLOTS):  # lap the ring, frame 2's slot is reused
+		frames.write(float(k), np.full(smem.FRAME_SHAPE, k, dtype=np.uint8))
+	assert not frames.isIntact(n, seq)
+	assert frames.newest()[0] == 2 + smem.FRAME_SLOTS
+
+def test_frame_ring_recover_hides_a_half_written_slot(tel):
+	frames = tel.frames
+	frames.write(1.0, np.zeros(smem.FRAME_SHAPE, dtype=np.uint8))
+	frames.slots['seq'][2] += 1	# died writing frame 2, latest still 1
+	frames.slots['frame'][2] = 2
+	tel.recover()
+	assert frames.slots['seq'][2] % 2 == 0
+	assert frames.slots['frame'][2] == 0
+	assert frames.newest()[0] == 1
+
+def another(code):
+	# run code in a new python, another gcs, with its own resource tracker
+	here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	out = subprocess.run([sys.executable, '-c', f'import smem\n{code}'], cwd=here, capture_output=True, text=True, timeout=30)
+	assert out.returncode == 0, out.stderr
+	return out.stdout.split()
+
+def test_a_live_segment_is_not_replaced(tel):
+	tel.pose['seq'] = 2
+	out = another(f'''
+try:
+	smem.Telemetry('{tel.name}', create=True)
+except FileExistsError:
+	print('refused')
+tel = smem.Telemetry('{tel.name}', readonly=True)
+print(smem.recordSeq(tel.pose))
+''')
+	assert out == ['refused', '2']
+
+def test_a_stale_segment_is_replaced(tel):
+	for header in (tel.header, tel.frames.header):
+		header['pid'] = 2**22 + 1	# above pid_max, a creator that is gone
+	tel.pose['seq'] = 2
+	out = another(f'''
+import os
+from multiprocessing import resource_tracker
+tel = smem.Telemetry('{tel.name}', create=True)
+for name in ('{tel.name}', '{tel.name}_frames'):
+	resource_tracker.unregister('/' + name, 'shared_memory')  # left for the test to unlink
+print(smem.recordSeq(tel.pose), tel.header['pid'][0] == os.getpid())
+''')
+	assert out == ['0', 'True']
@@ -0,0 +1,107 @@
+'''
+timing.py - per-stage latency histograms
+
+usage:
+	timing.setup('awacs', args.mediaout)
+	with timing.stage('decode'):
+		image = decode(jpeg)
+	timing.record('http', seconds)	# when a with-block does not fit
+	timing.dumpIfDue()		# in the main loop, rewrites the histogram file every interval seconds
+	timing.summary()		# at exit, p50/p95/p99 per stage to the log
+
+histograms:
+	fixed buckets, 4 per octave, 0.05 ms to 52 s, plus one overflow bucket
+	adding a sample is a bisect and an increment, no allocation
+	percentiles are reported as the upper edge of the bucket they fall in, or the max if lower
+
+file:
+	{dirname}/0_timing_{component}.tsv
+	one row per stage: name, count, mean, max, then the count in each bucket
+	header row gives the upper edge of each bucket in ms
+'''
+
+import time
+import threading
+import contextlib
+import bisect
+
+import jlog
+
+edges = [0.05 * (2 ** (k/4)) for k in range(81)]  # bucket upper edges, ms
+
+component = ''
+fname = ''
+interval = 10.0	# seconds between dumps
+tdump = 0.0
+histograms = {}	# name: Histogram, in order of first use
+lock = threading.Lock()
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * (len(edges) + 1)  # last is overflow
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, ms):
+		self.counts[bisect.bisect_left(edges, ms)] += 1
+		self.count += 1
+		self.total += ms
+		self.max = max(self.max, ms)
+
+	def percentile(self, p):
+		if self.count <= 0:
+			return 0.0
+		target = self.count * p / 100
+		cum = 0
+		for i in range(len(self.counts)):
+			cum += self.counts[i]
+			if cum >= target:
+				return min(edges[i], self.max) if i < len(edges) else self.max
+		return self.max
+
+	def mean(self):
+		return (self.total / self.count) if self.count else 0.0
+
+def setup(name, dirname='.', seconds=10.0):
+	global component, fname, interval, tdump
+	component = name
+	fname = f'{dirname}/0_timing_{name}.tsv'
+	interval = seconds
+	tdump = time.time()
+
+def record(name, seconds):
+	with lock:
+		if name not in histograms:
+			histograms[name] = Histogram()
+		histograms[name].add(seconds * 1000)
+
+@contextlib.contextmanager
+def stage(name):
+	t = time.perf_counter()
+	try:
+		yield
+	finally:
+		record(name, time.perf_counter() - t)
+
+def dump():
+	if not fname:
+		return
+	with lock:
+		rows = [['stage', 'count', 'mean', 'max'] + [f'{e:.3f}' for e in edges] + ['inf']]
+		for name, hist in histograms.items():
+			rows.append([name, str(hist.count), f'{hist.mean():.3f}', f'{hist.max:.3f}'] + [str(c) for c in hist.counts])
+	with open(fname, 'w') as fp:
+		for row in rows:
+			fp.write('\t'.join(row) + '\n')
+
+def dumpIfDue():
+	global tdump
+	if time.time() - tdump >= interval:
+		tdump = time.time()
+		dump()
+
+def summary():
+	with lock:
+		for name, hist in histograms.items():
+			jlog.info(f'timing {name:10} n:{hist.count:6} mean:{hist.mean():8.2f} p50:{hist.percentile(50):8.2f} p95:{hist.percentile(95):8.2f} p99:{hist.percentile(99):8.2f} max:{hist.max:8.2f} ms')